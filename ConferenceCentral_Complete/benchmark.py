@@ -0,0 +1,798 @@
+#!/usr/bin/env python
+
+"""benchmark.py
+
+Udacity conference server-side Python App Engine endpoint benchmarks
+
+Seeds the App Engine testbed stubs (datastore, memcache, taskqueue, mail)
+with conferences x sessions x profiles, then drives every ConferenceApi
+endpoint method and the main.py handlers, recording per call p50/p95
+latency, datastore/memcache/taskqueue RPC counts and entities read. Two
+micro-benchmarks ride along: the precompiled FormConverters against the
+reflective copy loops they replaced, and the concurrent (future/tasklet)
+lookups against their sequential equivalents.
+
+Calls that raise are counted as errors and left out of the latency and
+RPC figures. Results are written as JSON; --compare prints the change
+against an earlier results file (benchmark-sample.json is one), flagging
+slower latencies and any increase in datastore RPCs or errors, e.g.:
+
+    python benchmark.py --sdk $APPENGINE_SDK --output new.json
+    python benchmark.py --sdk $APPENGINE_SDK --compare old.json new.json
+
+The stubs run in-process, so absolute latencies measure CPU cost, not
+network time; RPC counts are the numbers that carry over to production.
+
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib
+from collections import OrderedDict
+from datetime import date
+from datetime import timedelta
+
+USERS = 'user%d@example.com'
+CITIES = ['London', 'Paris', 'Tokyo', 'Chicago', 'Berlin', 'Default City']
+TOPICS = ['Medical Innovations', 'Programming Languages', 'Web Technologies',
+    'Movie Making', 'Health and Nutrition']
+WORDS = ['python', 'cloud', 'datastore', 'scaling', 'design', 'mobile',
+    'security', 'performance', 'testing', 'machine', 'learning', 'data']
+SESSION_TYPES = ['Lecture', 'Workshop', 'Keynote', 'Panel']
+DURATIONS = ['30', '45 min', '60', '1:30', '2h']
+
+
+def setupSdk(sdk_path):
+    """Put the App Engine SDK and its bundled libraries on sys.path."""
+    if sdk_path:
+        sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, pct):
+    """Return the nearest-rank pct percentile of values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100.0 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def gitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+            stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class RpcCounter(object):
+    """RpcCounter -- counts API calls and datastore entities read through
+    apiproxy hooks"""
+
+    def __init__(self):
+        self.reset()
+
+    def install(self, apiproxy):
+        apiproxy.GetPreCallHooks().Append('benchmark', self._preCall)
+        apiproxy.GetPostCallHooks().Append('benchmark', self._postCall)
+
+    def reset(self):
+        self.calls = {}
+        self.entities = 0
+
+    def _preCall(self, service, call, request, response):
+        self.calls[service] = self.calls.get(service, 0) + 1
+
+    def _postCall(self, service, call, request, response):
+        if service != 'datastore_v3':
+            return
+        if call == 'Get':
+            self.entities += sum(1 for group in response.entity_list()
+                if group.has_entity())
+        elif call in ('RunQuery', 'Next'):
+            self.entities += response.result_size()
+
+
+class Bench(object):
+    """Bench -- testbed, seeded data and the measurement loop"""
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.counter = RpcCounter()
+
+    # - - - environment - - - - - - - - - - - - - - - - - - - - - -
+
+    def activate(self):
+        from google.appengine.api import apiproxy_stub_map
+        from google.appengine.datastore import datastore_stub_util
+        from google.appengine.ext import testbed
+
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.setup_env(app_id='conference-benchmark',
+            current_version_id='1.1', overwrite=True)
+        self.testbed.init_datastore_v3_stub(consistency_policy=
+            datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(
+            root_path=os.path.dirname(os.path.abspath(__file__)))
+        self.testbed.init_mail_stub()
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_urlfetch_stub()
+        self.testbed.init_user_stub()
+        self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        self.counter.install(apiproxy_stub_map.apiproxy)
+
+        # exports go to a scratch directory; set before export is imported
+        import settings
+        settings.EXPORT_ROOT = tempfile.mkdtemp(prefix='conference-export-')
+
+        import conference
+        import main
+        self.conference = conference
+        self.main = main
+
+
+    def deactivate(self):
+        self.testbed.deactivate()
+
+
+    def actAs(self, user):
+        os.environ['ENDPOINTS_AUTH_EMAIL'] = USERS % user
+        os.environ['ENDPOINTS_AUTH_DOMAIN'] = 'example.com'
+
+
+    def api(self):
+        """Return a ConferenceApi instance for one request."""
+        return self.conference.ConferenceApi()
+
+
+    def request(self, container, **fields):
+        return container.combined_message_class(**fields)
+
+
+    def handle(self, url, method='GET', params=None):
+        """Run a main.py handler; return the response."""
+        import webapp2
+        params = params or {}
+        if method == 'GET':
+            if params:
+                url += '?' + urllib.urlencode(params, doseq=True)
+            req = webapp2.Request.blank(url)
+        else:
+            req = webapp2.Request.blank(url, POST=params)
+        response = req.get_response(self.main.app)
+        if response.status_int >= 500:
+            # count it as an error, like an endpoint that raises
+            raise RuntimeError('%s: %s' % (url, response.status))
+        return response
+
+
+    def runTasks(self, limit=10000):
+        """Run the queued push tasks (and those they enqueue)."""
+        import webapp2
+        ran = 0
+        while ran < limit:
+            tasks = self.taskqueue.get_filtered_tasks(queue_names=['default'])
+            if not tasks:
+                break
+            self.taskqueue.FlushQueue('default')
+            for task in tasks:
+                req = webapp2.Request.blank(task.url, method=task.method,
+                    headers=task.headers,
+                    body=task.payload if task.method != 'GET' else None)
+                req.get_response(self.main.app)
+                ran += 1
+        return ran
+
+
+    def flushTasks(self):
+        for queue in ('default', 'confirmation-emails'):
+            self.taskqueue.FlushQueue(queue)
+
+    # - - - seed data - - - - - - - - - - - - - - - - - - - - - - -
+
+    def seed(self):
+        """Create profiles, conferences, sessions, registrations and
+        wishlists through the API, then run the tasks they queued."""
+        from models import ConferenceForm
+        from models import ProfileMiniForm
+        from models import SessionForm
+        from models import TeeShirtSize
+        from models import WebsafeKeysForm
+        args, rng, conf_api = self.args, self.rng, self.conference
+
+        for user in range(args.profiles):
+            self.actAs(user)
+            self.api().saveProfile(ProfileMiniForm(displayName='User %d' % user,
+                teeShirtSize=TeeShirtSize.NOT_SPECIFIED))
+
+        self.conferences = []
+        self.sessions = []
+        self.speakers = ['Speaker %d' % i
+            for i in range(max(args.sessions // 2, 1))]
+        base = date(2016, 1, 1)
+        for i in range(args.conferences):
+            owner = i % args.profiles
+            self.actAs(owner)
+            start = base + timedelta(days=rng.randint(0, 360))
+            cf = self.api().createConference(ConferenceForm(
+                name='Conference %d %s' % (i, rng.choice(WORDS)),
+                description=' '.join(rng.sample(WORDS, 4)),
+                topics=rng.sample(TOPICS, 2),
+                city=rng.choice(CITIES),
+                startDate=str(start),
+                endDate=str(start + timedelta(days=2)),
+                maxAttendees=rng.randint(args.profiles, args.profiles * 4),
+            ))
+            # createConference returns the request; find the stored key
+            wsck = self._createdKey(owner, cf.name)
+            self.conferences.append((wsck, owner))
+
+            forms = []
+            for j in range(args.sessions):
+                forms.append(SessionForm(
+                    name='Session %d.%d %s' % (i, j, rng.choice(WORDS)),
+                    highlights=' '.join(rng.sample(WORDS, 3)),
+                    speaker=rng.choice(self.speakers),
+                    duration=rng.choice(DURATIONS),
+                    typeOfSession=rng.choice(SESSION_TYPES),
+                    date=str(start + timedelta(days=rng.randint(0, 2))),
+                    startTime='%02d:%02d' % (rng.randint(9, 17),
+                        rng.choice([0, 30])),
+                ))
+            if forms:
+                sf = self.api().createSessions(self.request(
+                    conf_api.SESS_BULK_POST_REQUEST, items=forms,
+                    websafeConferenceKey=wsck))
+                self.sessions.extend(
+                    (sess.websafeSessionKey, wsck) for sess in sf.items)
+
+        for user in range(args.profiles):
+            self.actAs(user)
+            keys = [wsck for wsck, _ in rng.sample(self.conferences,
+                min(3, len(self.conferences)))]
+            self.api().registerForConferences(WebsafeKeysForm(keys=keys))
+            if self.sessions:
+                keys = [wssk for wssk, _ in rng.sample(self.sessions,
+                    min(5, len(self.sessions)))]
+                self.api().addSessionsToWishlist(WebsafeKeysForm(keys=keys))
+
+        tasks = self.runTasks()
+        self.flushTasks()
+        return tasks
+
+
+    def _createdKey(self, owner, name):
+        from google.appengine.ext import ndb
+        from models import Conference
+        from models import Profile
+        conf = Conference.query(Conference.name == name,
+            ancestor=ndb.Key(Profile, USERS % owner)).get()
+        return conf.key.urlsafe()
+
+    # - - - measurement - - - - - - - - - - - - - - - - - - - - - -
+
+    def measure(self, name, call, setup=None, user=0):
+        """Time call over the configured iterations; return its stats.
+
+        Calls that raise (or whose setup raises) are counted as errors and
+        left out of the latency and RPC figures, which are over the
+        successful calls only.
+        """
+        from google.appengine.api import memcache
+        from google.appengine.ext import ndb
+        latencies = []
+        rpcs = {}
+        entities = 0
+        errors = []
+        for i in range(self.args.iterations):
+            self.actAs(user)
+            try:
+                if setup:
+                    setup(i)
+                ndb.get_context().clear_cache()
+                if self.args.cold:
+                    memcache.flush_all()
+                self.counter.reset()
+                started = time.time()
+                call(i)
+                latencies.append((time.time() - started) * 1000)
+            except Exception, e:
+                errors.append(e)
+                if self.args.verbose:
+                    print >> sys.stderr, '%s: %r' % (name, e)
+                continue
+            finally:
+                self.flushTasks()
+            for service, count in self.counter.calls.items():
+                rpcs[service] = rpcs.get(service, 0) + count
+            entities += self.counter.entities
+
+        n = float(max(len(latencies), 1))
+        stats = OrderedDict([
+            ('p50_ms', percentile(latencies, 50)),
+            ('p95_ms', percentile(latencies, 95)),
+            ('mean_ms', sum(latencies) / n if latencies else None),
+            ('datastore_rpcs', rpcs.get('datastore_v3', 0) / n),
+            ('memcache_rpcs', rpcs.get('memcache', 0) / n),
+            ('taskqueue_rpcs', rpcs.get('taskqueue', 0) / n),
+            ('entities_read', entities / n),
+            ('errors', len(errors)),
+        ])
+        if errors:
+            stats['first_error'] = '%s: %s' % (type(errors[0]).__name__,
+                errors[0])
+        if self.args.verbose:
+            print >> sys.stderr, '%-40s p50 %7.2fms p95 %7.2fms errors %d' % (
+                name, stats['p50_ms'] or 0, stats['p95_ms'] or 0, len(errors))
+        return stats
+
+
+    def pick(self, items, i):
+        return items[i % len(items)]
+
+    # - - - cases - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def endpointCases(self):
+        """Return (name, call, setup, user) per endpoint case."""
+        from models import ConferenceForm
+        from models import ConferenceQueryForm
+        from models import ConferenceQueryForms
+        from models import ConferenceView
+        from models import ProfileMiniForm
+        from models import SessionForm
+        from models import TeeShirtSize
+        from models import WebsafeKeysForm
+        from protorpc import message_types
+        c = self.conference
+        api, req, pick = self.api, self.request, self.pick
+        void = message_types.VoidMessage
+        wsck, owner = self.conferences[0]
+        conf_keys = [key for key, _ in self.conferences]
+        sess_keys = [key for key, _ in self.sessions] or [None]
+        wssk = sess_keys[0]
+
+        def query(view, *filters):
+            return ConferenceQueryForms(view=view, filters=[
+                ConferenceQueryForm(field=f, operator=o, value=v)
+                for f, o, v in filters])
+
+        cases = [
+            ('getProfile', lambda i: api().getProfile(void()), None, 0),
+            ('saveProfile', lambda i: api().saveProfile(ProfileMiniForm(
+                displayName='User 0 (%d)' % i,
+                teeShirtSize=TeeShirtSize.NOT_SPECIFIED)), None, 0),
+            ('createConference', lambda i: api().createConference(
+                ConferenceForm(name='Bench conference %d' % i,
+                    city='London', startDate='2016-06-01',
+                    maxAttendees=100)), None, 0),
+            ('updateConference', lambda i: api().updateConference(
+                req(c.CONF_POST_REQUEST, websafeConferenceKey=wsck,
+                    description='updated %d' % i)), None, owner),
+            ('getConference', lambda i: api().getConference(
+                req(c.CONF_GET_REQUEST,
+                    websafeConferenceKey=pick(conf_keys, i))), None, 0),
+            ('getConferencesCreated', lambda i: api().getConferencesCreated(
+                req(c.CONF_PAGE_REQUEST)), None, 0),
+            ('queryConferences', lambda i: api().queryConferences(
+                query(ConferenceView.FULL, ('CITY', 'EQ', 'London'))),
+                None, 0),
+            ('queryConferences[SUMMARY]', lambda i: api().queryConferences(
+                query(ConferenceView.SUMMARY, ('MONTH', 'GT', '3'))),
+                None, 0),
+            ('queryConferences[multi-inequality]',
+                lambda i: api().queryConferences(query(ConferenceView.FULL,
+                    ('MONTH', 'GT', '3'), ('MAX_ATTENDEES', 'LT', '100'))),
+                None, 0),
+            ('explainConferenceQuery', lambda i: api().explainConferenceQuery(
+                query(ConferenceView.FULL, ('MONTH', 'GT', '3'),
+                    ('MAX_ATTENDEES', 'LT', '100'))), None, 0),
+            ('filterPlayground', lambda i: api().filterPlayground(void()),
+                None, 0),
+            ('getConferencesToAttend', lambda i:
+                api().getConferencesToAttend(req(c.CONF_PAGE_REQUEST)),
+                None, 0),
+            ('getSessionsInWishlist', lambda i:
+                api().getSessionsInWishlist(req(c.CONF_PAGE_REQUEST)),
+                None, 0),
+            ('getMyAgenda', lambda i: api().getMyAgenda(void()), None, 0),
+            ('registerForConference', lambda i: api().registerForConference(
+                req(c.CONF_GET_REQUEST, websafeConferenceKey=wsck)),
+                lambda i: self._unregister(wsck), 0),
+            ('registerForConferences', lambda i:
+                api().registerForConferences(WebsafeKeysForm(keys=conf_keys[:5])),
+                lambda i: [self._unregister(key) for key in conf_keys[:5]], 0),
+            ('addSessionToWishlist', lambda i: api().addSessionToWishlist(
+                req(c.SESS_POST_TO_WISHLIST, websafeSessionKey=wssk)),
+                lambda i: self._wishlist(wssk, False), 0),
+            ('deleteSessionInWishlist', lambda i: api().deleteSessionInWishlist(
+                req(c.SESS_POST_TO_WISHLIST, websafeSessionKey=wssk)),
+                lambda i: self._wishlist(wssk, True), 0),
+            ('addSessionsToWishlist', lambda i: api().addSessionsToWishlist(
+                WebsafeKeysForm(keys=sess_keys[:10])),
+                lambda i: api().deleteSessionsInWishlist(
+                    WebsafeKeysForm(keys=sess_keys[:10])), 0),
+            ('deleteSessionsInWishlist', lambda i:
+                api().deleteSessionsInWishlist(
+                    WebsafeKeysForm(keys=sess_keys[:10])),
+                lambda i: api().addSessionsToWishlist(
+                    WebsafeKeysForm(keys=sess_keys[:10])), 0),
+            ('getAnnouncement', lambda i: api().getAnnouncement(void()),
+                None, 0),
+            ('getFeaturedSpeaker', lambda i: api().getFeaturedSpeaker(
+                req(c.CONF_GET_REQUEST,
+                    websafeConferenceKey=pick(conf_keys, i))), None, 0),
+            ('createSession', lambda i: api().createSession(
+                req(c.SESS_POST_REQUEST, websafeConferenceKey=wsck,
+                    name='Bench session %d' % i, speaker='Speaker 0',
+                    duration='60', date='2016-06-01', startTime='10:00')),
+                None, owner),
+            ('createSessions', lambda i: api().createSessions(
+                req(c.SESS_BULK_POST_REQUEST, websafeConferenceKey=wsck,
+                    items=[SessionForm(name='Bench bulk %d.%d' % (i, j),
+                        speaker='Speaker %d' % j, duration='30')
+                        for j in range(10)])), None, owner),
+            ('getConferenceSessions', lambda i: api().getConferenceSessions(
+                req(c.SESS_GET_REQUEST,
+                    websafeConferenceKey=pick(conf_keys, i))), None, 0),
+            ('getConferenceSessionsByType', lambda i:
+                api().getConferenceSessionsByType(req(c.SESS_TYPE_GET_REQUEST,
+                    websafeConferenceKey=pick(conf_keys, i),
+                    typeOfSession='Workshop')), None, 0),
+            ('getConferenceSessionsByDuration', lambda i:
+                api().getConferenceSessionsByDuration(
+                    req(c.SESS_DUR_GET_REQUEST, duration='60')), None, 0),
+            ('getConferenceSessionsByTime', lambda i:
+                api().getConferenceSessionsByTime(
+                    req(c.SESS_TIME_GET_REQUEST, startTime='10:00')),
+                None, 0),
+            ('getConferenceSessionsBySpeaker', lambda i:
+                api().getConferenceSessionsBySpeaker(
+                    req(c.SESS_SPEAKER_GET_REQUEST, speaker='Speaker 0')),
+                None, 0),
+            ('querySessions', lambda i: api().querySessions(
+                req(c.SESS_SEARCH_REQUEST, startTimeFrom='09:00',
+                    startTimeTo='12:00', maxDuration=60)), None, 0),
+            ('searchConferences', lambda i: api().searchConferences(
+                req(c.SEARCH_REQUEST, q=pick(WORDS, i))), None, 0),
+            ('searchSessions', lambda i: api().searchSessions(
+                req(c.SEARCH_REQUEST, q=pick(WORDS, i)[:3] + '*')), None, 0),
+        ]
+        return cases
+
+
+    def _wishlist(self, wssk, wishlisted):
+        """Add the session to user 0's wishlist or remove it, whether or
+        not it is already there."""
+        from models import ConflictException
+        request = self.request(self.conference.SESS_POST_TO_WISHLIST,
+            websafeSessionKey=wssk)
+        try:
+            if wishlisted:
+                self.api().addSessionToWishlist(request)
+            else:
+                self.api().deleteSessionInWishlist(request)
+        except ConflictException:
+            pass
+
+
+    def _unregister(self, wsck):
+        self.api()._conferenceRegistration(self.request(
+            self.conference.CONF_GET_REQUEST, websafeConferenceKey=wsck),
+            reg=False)
+
+
+    def handlerCases(self):
+        """Return (name, call, setup, user) per main.py handler case."""
+        import export
+        import rpcstats
+        handle, pick = self.handle, self.pick
+        wsck, _ = self.conferences[0]
+        conf_keys = [key for key, _ in self.conferences]
+        jobs = {}
+
+        def newExportJob(i):
+            jobs['job'] = export.startJob('jsonl')
+
+        return [
+            ('/crons/set_announcement', lambda i:
+                handle('/crons/set_announcement'), None, 0),
+            ('/crons/send_digest_emails', lambda i:
+                handle('/crons/send_digest_emails'), None, 0),
+            ('/tasks/send_confirmation_email', lambda i:
+                handle('/tasks/send_confirmation_email', 'POST',
+                    {'email': USERS % 0, 'conferenceInfo': 'Conference'}),
+                None, 0),
+            ('/tasks/set_featured_speaker', lambda i:
+                handle('/tasks/set_featured_speaker', 'GET',
+                    {'websafeConferenceKey': pick(conf_keys, i),
+                    'speaker': self.speakers[:3]}), None, 0),
+            ('/tasks/index_documents', lambda i:
+                handle('/tasks/index_documents', 'POST',
+                    {'kind': 'Conference', 'key': pick(conf_keys, i)}),
+                None, 0),
+            ('/tasks/backfill_registrations', lambda i:
+                handle('/tasks/backfill_registrations', 'POST'), None, 0),
+            ('/tasks/backfill_speaker_index', lambda i:
+                handle('/tasks/backfill_speaker_index', 'POST'), None, 0),
+            ('/tasks/backfill_session_durations', lambda i:
+                handle('/tasks/backfill_session_durations', 'POST'), None, 0),
+            ('/tasks/build_conference_search_index', lambda i:
+                handle('/tasks/build_conference_search_index', 'POST'),
+                None, 0),
+            ('/tasks/build_session_search_index', lambda i:
+                handle('/tasks/build_session_search_index', 'POST'), None, 0),
+            ('/tasks/export', lambda i: handle('/tasks/export', 'POST',
+                {'job': jobs['job'].key.id(),
+                'batch': export.taskName(jobs['job'])}), newExportJob, 0),
+            ('/admin/rpcstats', lambda i: handle('/admin/rpcstats', 'GET',
+                {'minutes': rpcstats.ROLLING_MINUTES}), None, 0),
+        ]
+
+    # - - - micro-benchmarks - - - - - - - - - - - - - - - - - - - -
+
+    def converterCases(self):
+        """Compare the FormConverters with the reflective copy loops
+        ConferenceApi used before them, on the seeded entities."""
+        from google.appengine.ext import ndb
+        from models import ConferenceForm
+        from models import Profile
+        from models import ProfileForm
+        from models import SessionForm
+        from models import TeeShirtSize
+        c = self.conference
+
+        def reflectiveProfile(prof):
+            pf = ProfileForm()
+            for field in pf.all_fields():
+                if hasattr(prof, field.name):
+                    if field.name == 'teeShirtSize':
+                        setattr(pf, field.name,
+                            getattr(TeeShirtSize, getattr(prof, field.name)))
+                    else:
+                        setattr(pf, field.name, getattr(prof, field.name))
+            pf.check_initialized()
+            return pf
+
+        def reflectiveConference(conf):
+            cf = ConferenceForm()
+            for field in cf.all_fields():
+                if hasattr(conf, field.name):
+                    if field.name.endswith('Date'):
+                        setattr(cf, field.name, str(getattr(conf, field.name)))
+                    else:
+                        setattr(cf, field.name, getattr(conf, field.name))
+                elif field.name == "websafeKey":
+                    setattr(cf, field.name, conf.key.urlsafe())
+            cf.check_initialized()
+            return cf
+
+        def reflectiveSession(sess):
+            sf = SessionForm()
+            for field in sf.all_fields():
+                if hasattr(sess, field.name):
+                    if field.name == 'date' or field.name == 'startTime':
+                        setattr(sf, field.name, str(getattr(sess, field.name)))
+                    else:
+                        setattr(sf, field.name, getattr(sess, field.name))
+            sf.check_initialized()
+            return sf
+
+        profiles = Profile.query().fetch(100)
+        conferences = ndb.get_multi([ndb.Key(urlsafe=key)
+            for key, _ in self.conferences[:100]])
+        sessions = ndb.get_multi([ndb.Key(urlsafe=key)
+            for key, _ in self.sessions[:100]])
+        results = OrderedDict()
+        for name, entities, old, new in (
+                ('Profile', profiles, reflectiveProfile,
+                    c.PROFILE_CONVERTER.convert),
+                ('Conference', conferences, reflectiveConference,
+                    c.CONFERENCE_CONVERTER.convert),
+                ('Session', sessions, reflectiveSession,
+                    c.SESSION_CONVERTER.convert)):
+            if not entities:
+                continue
+            timings = []
+            for convert in (old, new):
+                started = time.time()
+                for _ in range(self.args.converter_rounds):
+                    for entity in entities:
+                        convert(entity)
+                conversions = self.args.converter_rounds * len(entities)
+                timings.append((time.time() - started) * 1e6 / conversions)
+            results[name] = OrderedDict([
+                ('reflective_us', timings[0]),
+                ('converter_us', timings[1]),
+                ('speedup', timings[0] / max(timings[1], 1e-9)),
+            ])
+        return results
+
+
+    def asyncCases(self):
+        """Return (name, call, setup, user) pairs comparing the concurrent
+        lookups of the async paths with sequential equivalents."""
+        from google.appengine.ext import ndb
+        from models import ConferenceSessionSummary
+        from models import Profile
+        from models import Registration
+        import counters
+        c = self.conference
+        api, req, pick = self.api, self.request, self.pick
+        conf_keys = [key for key, _ in self.conferences]
+
+        def sequentialGetConference(wsck):
+            # getConference as it was before its gets were overlapped
+            c_key = ndb.Key(urlsafe=wsck)
+            conf = c_key.get()
+            prof = c_key.parent().get()
+            summary = ConferenceSessionSummary.makeKey(c_key).get()
+            seats = counters.seatsAvailable([conf])[conf.key]
+            cf = api()._copyConferenceToForm(conf,
+                getattr(prof, 'displayName'), seats)
+            cf.sessionSummary = api()._copySessionSummaryToForm(summary or
+                ConferenceSessionSummary())
+            return cf
+
+        def registrationKeys(wsck):
+            p_key = ndb.Key(Profile, USERS % 0)
+            return [p_key, ndb.Key(urlsafe=wsck),
+                Registration.makeKey(p_key, wsck)]
+
+        def flush(i):
+            from google.appengine.api import memcache
+            memcache.flush_all()
+
+        return [
+            ('getConference[concurrent]', lambda i: api().getConference(
+                req(c.CONF_GET_REQUEST,
+                    websafeConferenceKey=pick(conf_keys, i))), flush, 0),
+            ('getConference[sequential]', lambda i:
+                sequentialGetConference(pick(conf_keys, i)), flush, 0),
+            ('registrationLookups[concurrent]', lambda i:
+                ndb.Future.wait_all([key.get_async()
+                    for key in registrationKeys(pick(conf_keys, i))]),
+                None, 0),
+            ('registrationLookups[sequential]', lambda i:
+                [key.get() for key in registrationKeys(pick(conf_keys, i))],
+                None, 0),
+        ]
+
+    # - - - driver - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def run(self):
+        import re
+        only = re.compile(self.args.only) if self.args.only else None
+        self.activate()
+        try:
+            started = time.time()
+            tasks = self.seed()
+            seed_seconds = time.time() - started
+
+            results = OrderedDict([('meta', OrderedDict([
+                ('commit', gitCommit()),
+                ('timestamp', int(time.time())),
+                ('conferences', self.args.conferences),
+                ('sessions', self.args.sessions),
+                ('profiles', self.args.profiles),
+                ('iterations', self.args.iterations),
+                ('cold', self.args.cold),
+                ('seed', self.args.seed),
+                ('seed_seconds', seed_seconds),
+                ('seed_tasks', tasks),
+            ]))])
+            for section, cases in (('endpoints', self.endpointCases()),
+                    ('handlers', self.handlerCases()),
+                    ('async', self.asyncCases())):
+                results[section] = OrderedDict()
+                for name, call, setup, user in cases:
+                    if only and not only.search(name):
+                        continue
+                    results[section][name] = self.measure(name, call,
+                        setup, user)
+
+            # report endpoints methods no case covers
+            covered = set(name.split('[')[0] for name in results['endpoints'])
+            results['meta']['uncovered_endpoints'] = sorted(
+                name for name in self.conference.ConferenceApi.all_remote_methods()
+                if name not in covered) if not only else []
+            results['meta']['uncovered_handlers'] = sorted(
+                path for path, _ in self.main.routes
+                if path not in results['handlers']) if not only else []
+            results['converters'] = self.converterCases()
+            return results
+        finally:
+            self.deactivate()
+
+
+def compare(old_path, new_path, threshold):
+    """Print p50/p95, RPC and error changes from old_path to new_path
+    results; return the number of regressions: latencies up by more than
+    threshold (a fraction), and any increase in datastore RPCs or
+    errors."""
+    old = json.load(open(old_path))
+    new = json.load(open(new_path))
+    regressions = 0
+    print '%-45s %18s %18s %14s %10s' % ('case', 'p50 ms', 'p95 ms',
+        'datastore', 'errors')
+    for section in ('endpoints', 'handlers', 'async'):
+        for name, stats in new.get(section, {}).items():
+            base = old.get(section, {}).get(name)
+            if not base:
+                print '%-45s %18s' % (name, '(new)')
+                continue
+            cells = []
+            for metric in ('p50_ms', 'p95_ms'):
+                if stats[metric] is None or base[metric] is None:
+                    # no successful calls on one side; see errors
+                    cells.append('%18s' % '-')
+                    continue
+                change = (stats[metric] - base[metric]) / max(base[metric],
+                    1e-9)
+                flag = ''
+                if change > threshold:
+                    flag = ' !'
+                    regressions += 1
+                cells.append('%7.2f %+6.0f%%%s' % (stats[metric],
+                    change * 100, flag))
+            rpcs = '%5.1f -> %5.1f' % (base['datastore_rpcs'],
+                stats['datastore_rpcs'])
+            if stats['datastore_rpcs'] > base['datastore_rpcs']:
+                regressions += 1
+                rpcs += ' !'
+            errors = '%d -> %d' % (base.get('errors', 0), stats['errors'])
+            if stats['errors'] > base.get('errors', 0):
+                regressions += 1
+                errors += ' !'
+            print '%-45s %18s %18s %14s %10s' % (name, cells[0], cells[1],
+                rpcs, errors)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sdk', default=os.environ.get('APPENGINE_SDK'),
+        help='path to the App Engine SDK (google_appengine directory)')
+    parser.add_argument('--conferences', type=int, default=20)
+    parser.add_argument('--sessions', type=int, default=10,
+        help='sessions per conference')
+    parser.add_argument('--profiles', type=int, default=50)
+    parser.add_argument('--iterations', type=int, default=30,
+        help='timed calls per case')
+    parser.add_argument('--converter-rounds', type=int, default=200)
+    parser.add_argument('--cold', action='store_true',
+        help='flush memcache before every timed call')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--only', help='regex of case names to run')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+        help='compare two results files instead of running')
+    parser.add_argument('--threshold', type=float, default=0.2,
+        help='latency change counted as a regression by --compare')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(args.compare[0], args.compare[1],
+            args.threshold) else 0)
+
+    setupSdk(args.sdk)
+    results = Bench(args).run()
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print 'wrote %s' % args.output
+
+
+if __name__ == '__main__':
+    main()
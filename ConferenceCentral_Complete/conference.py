@@ -13,16 +13,22 @@ created by wesc on 2014 apr 21
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 
+from collections import OrderedDict
 from datetime import datetime
+import hashlib
 import json
+import logging
 import os
 import time
 
 import endpoints
 from protorpc import messages
 from protorpc import message_types
+from protorpc import protojson
 from protorpc import remote
 
+from google.appengine.api import datastore_errors
+from google.net.proto.ProtocolBuffer import ProtocolBufferDecodeError
 from google.appengine.api import urlfetch
 from google.appengine.ext import ndb
 
@@ -31,15 +37,30 @@ from models import ProfileMiniForm
 from models import ProfileForm
 from models import TeeShirtSize
 
+import counters
+import emails
+import planner
+import rpcstats
+import search
+from converters import FormConverter
 from settings import WEB_CLIENT_ID
 from utils import getUserId
+from utils import findOverlaps
+from utils import parseDurationMinutes
+from utils import sessionInterval
 
 from models import Conference
+from models import NearlySoldOut
 from models import ConferenceForm
 from models import ConferenceForms
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
+from models import ConferenceSummaryForm
+from models import ConferenceView
 from models import BooleanMessage
+from models import BatchResultForm
+from models import BatchResultForms
+from models import WebsafeKeysForm
 from models import ConflictException
 
 from google.appengine.api import memcache
@@ -48,10 +69,19 @@ from models import FeaturedSpeaker
 
 from google.appengine.api import taskqueue
 
+from models import AgendaForm
+from models import AgendaItemForm
+from models import ConferenceSessionSummary
 from models import Session
+from models import SessionSummaryForm
+from models import TypeCountForm
 from models import SessionForm
 from models import SessionForms
 
+from models import Registration
+from models import SpeakerSessions
+from models import WishlistEntry
+
 
 DEFAULTS = {
     "city": "Default City",
@@ -69,6 +99,50 @@ OPERATORS = {
             'NE':   '!='
             }
 
+MEMCACHE_ANNOUNCEMENTS_KEY = 'MEMCACHE_ANNOUNCEMENTS_KEY'
+MEMCACHE_NEARLY_SOLD_OUT_KEY = 'nearly_sold_out'
+NEARLY_SOLD_OUT_SEATS = 5
+CAS_RETRIES = 10
+
+MEMCACHE_FEATURED_SPEAKER_KEY = 'featured_speaker:%s'
+
+MEMCACHE_CONFERENCE_GENERATION_KEY = 'conference_generation'
+MEMCACHE_CONFERENCE_QUERY_KEY = 'conference_query:%s:%s'
+
+MEMCACHE_CONFERENCE_KEY = 'conference:%s'
+MEMCACHE_SESSIONS_KEY = 'sessions:%s'
+MEMCACHE_PROFILE_KEY = 'profile:%s'
+# after an invalidation, reads may not re-populate the cache for this long,
+# so a read that raced the write cannot cache stale data
+CACHE_LOCK_SECONDS = 2
+# cached forms expire after this long, bounding the effect of a missed
+# invalidation
+FORM_CACHE_SECONDS = 600
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# results per RPC when an unpaged query is fetched in full
+QUERY_BATCH_SIZE = 100
+# most sessions createSessions accepts in one request
+MAX_BULK_SESSIONS = 200
+# most entities one request may scan when filters are evaluated in memory
+SCAN_BUDGET = 1000
+
+# value ranges the query planner uses to estimate range filter selectivity
+CONFERENCE_DOMAINS = {
+    'month': (1, 12),
+    'maxAttendees': (0, 1000),
+}
+SESSION_DOMAINS = {
+    'durationMinutes': (0, 480),
+}
+# querySessions results are sorted by the range field the datastore runs
+# (the planner's pick), then by these
+SESSION_ORDER = ('date', 'startTime')
+# the planner only picks queries these indexes (or built-in ones) serve
+INDEXES = planner.loadIndexes(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'index.yaml'))
+
 FIELDS =    {
             'CITY': 'city',
             'TOPIC': 'topics',
@@ -91,30 +165,69 @@ SESS_POST_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_PAGE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1),
+    cursor=messages.StringField(2),
+)
+
+SEARCH_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    q=messages.StringField(1),
+    limit=messages.IntegerField(2),
+)
+
+SESS_BULK_POST_REQUEST = endpoints.ResourceContainer(
+    SessionForms,
+    websafeConferenceKey=messages.StringField(1),
+)
+
 SESS_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    cursor=messages.StringField(3),
 )
 
 SESS_TYPE_GET_REQUEST = endpoints.ResourceContainer(
     SessionForm,
     websafeConferenceKey=messages.StringField(1),
     typeOfSession=messages.StringField(2),
+    pageSize=messages.IntegerField(3),
+    cursor=messages.StringField(4),
 )
 
 SESS_TIME_GET_REQUEST = endpoints.ResourceContainer(
     SessionForm,
     startTime=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    cursor=messages.StringField(3),
 )
 
 SESS_DUR_GET_REQUEST = endpoints.ResourceContainer(
     SessionForm,
     duration=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    cursor=messages.StringField(3),
 )
 
 SESS_SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
     SessionForm,
     speaker=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    cursor=messages.StringField(3),
+)
+
+SESS_SEARCH_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    startTimeFrom=messages.StringField(2),
+    startTimeTo=messages.StringField(3),
+    maxDuration=messages.IntegerField(4),
+    dateFrom=messages.StringField(5),
+    dateTo=messages.StringField(6),
+    pageSize=messages.IntegerField(7),
+    cursor=messages.StringField(8),
 )
 
 SESS_POST_TO_WISHLIST = endpoints.ResourceContainer(
@@ -122,6 +235,27 @@ SESS_POST_TO_WISHLIST = endpoints.ResourceContainer(
     websafeSessionKey=messages.StringField(1),
 )
 
+# entity -> form converters, resolved once at import time
+PROFILE_CONVERTER = FormConverter(Profile, ProfileForm,
+    transforms={'teeShirtSize': lambda size: getattr(TeeShirtSize, size)},
+)
+
+CONFERENCE_CONVERTER = FormConverter(Conference, ConferenceForm,
+    transforms={'startDate': str, 'endDate': str},
+    computed={'websafeKey': lambda conf: conf.key.urlsafe()},
+)
+
+# summary converters are built once per set of fields left out of the
+# projection (see _copyConferencesToSummaries)
+SUMMARY_FIELDS = ('name', 'city', 'startDate')
+SUMMARY_CONVERTERS = {}
+
+SESSION_CONVERTER = FormConverter(Session, SessionForm,
+    transforms={'date': str, 'startTime': str},
+    computed={'websafeSessionKey': lambda sess: sess.key.urlsafe(),
+        'websafeConferenceKey': lambda sess: sess.key.parent().urlsafe()},
+)
+
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 
@@ -138,38 +272,142 @@ class ConferenceApi(remote.Service):
 
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
-        return pf
+        return PROFILE_CONVERTER.convert(prof)
 
 
     def _getProfileFromUser(self):
-        """Return user Profile from datastore, creating new one if non-existent."""
+        """Return user Profile, or a new unsaved one if non-existent."""
+        return self._getProfileFromUserAsync().get_result()
+
+
+    @ndb.tasklet
+    def _getProfileFromUserAsync(self):
+        """Tasklet version of _getProfileFromUser.
+
+        The Profile is looked up once per request (then kept on self), in
+        memcache before the datastore. A user without a Profile gets a new
+        one that is only stored by _saveProfile/_ensureProfile, so read-only
+        endpoints never write. The one exception is a Profile still holding
+        the legacy registration/wishlist lists, which are moved into
+        Registration and WishlistEntry entities first, so that no endpoint
+        misses them.
+        """
+        profile = getattr(self, '_profile', None)
+        if profile:
+            raise ndb.Return(profile)
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
-         
-        user_id = getUserId(user)
-        p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()  
 
+        user_id = getUserId(user)
+        cache_key = MEMCACHE_PROFILE_KEY % user_id
+        profile = yield ndb.get_context().memcache_get(cache_key)
+        stored = profile is not None
         if not profile:
-            profile = Profile(
-                key = p_key,
-                displayName = user.nickname(), 
-                mainEmail= user.email(),
-                teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
-            )
-            profile.put()
-        return profile
+            p_key = ndb.Key(Profile, user_id)
+            profile = yield p_key.get_async()
+            stored = profile is not None
+            if profile and not self._hasLegacyLists(profile):
+                yield ndb.get_context().memcache_add(cache_key, profile)
+            elif not profile:
+                profile = Profile(
+                    key = p_key,
+                    displayName = user.nickname(),
+                    mainEmail= user.email(),
+                    teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
+                )
+        if self._hasLegacyLists(profile):
+            profile = yield self._migrateLegacyListsAsync(profile.key)
+            yield ndb.get_context().memcache_delete(cache_key)
+            self._profileMigrated = True
+        self._profile = profile
+        self._profileStored = stored
+        raise ndb.Return(profile)
+
+
+    @staticmethod
+    def _hasLegacyLists(prof):
+        return bool(prof.conferenceKeysToAttend or prof.sessionWishList)
+
+
+    @staticmethod
+    @ndb.transactional_tasklet()
+    def _migrateLegacyListsAsync(p_key):
+        """Move the registrations and wishlist stored on the Profile at
+        p_key into Registration and WishlistEntry entities; return the
+        Profile.
+
+        They all live in the Profile's entity group, so this is one
+        transaction, and edits made to the Profile meanwhile are kept.
+        """
+        prof = yield p_key.get_async()
+        if not prof or not ConferenceApi._hasLegacyLists(prof):
+            raise ndb.Return(prof)
+        entities = [Registration(key=Registration.makeKey(p_key, wsck),
+                conferenceKey=ndb.Key(urlsafe=wsck))
+            for wsck in prof.conferenceKeysToAttend]
+        entities += [WishlistEntry(key=WishlistEntry.makeKey(p_key, wssk),
+                sessionKey=ndb.Key(urlsafe=wssk))
+            for wssk in prof.sessionWishList]
+        prof.conferenceKeysToAttend = []
+        prof.sessionWishList = []
+        yield ndb.put_multi_async(entities + [prof])
+        raise ndb.Return(prof)
+
+
+    def _saveProfile(self, prof, changes=None):
+        """Store prof, or apply changes (dict of field -> value) to it, and
+        update the cached copy unless the cache already holds a newer
+        version; return the stored Profile.
+
+        prof may be a cached copy, so it is only used as is if no Profile
+        is stored yet; otherwise the changes are applied to the stored one
+        (see _storeProfile). The cache is only ever read from.
+        """
+        stored = self._storeProfile(prof, changes or {})
+        if prof is getattr(self, '_profile', None):
+            self._profile = stored
+            self._profileStored = True
+        cache_key = MEMCACHE_PROFILE_KEY % stored.key.id()
+        client = memcache.Client()
+        for i in range(CAS_RETRIES):
+            cached = client.gets(cache_key)
+            if cached is None:
+                if client.add(cache_key, stored):
+                    break
+            elif (cached.version or 0) >= stored.version:
+                break
+            elif client.cas(cache_key, stored):
+                break
+        else:
+            memcache.delete(cache_key)
+        return stored
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _storeProfile(prof, changes):
+        """Apply changes to the stored copy of prof (or to prof itself if it
+        is not stored yet) and put it if anything changed; return it."""
+        stored = prof.key.get()
+        if stored is None:
+            stored = prof
+        elif all(getattr(stored, field) == value
+                for field, value in changes.iteritems()):
+            return stored
+        for field, value in changes.iteritems():
+            setattr(stored, field, value)
+        stored.put()
+        return stored
+
+
+    def _ensureProfile(self):
+        """Return user Profile, storing it if it is new (for write paths
+        that need it to exist, e.g. as a Conference's organizer)."""
+        prof = self._getProfileFromUser()
+        if not self._profileStored:
+            self._saveProfile(prof)
+        return prof
 
 
     def _doProfile(self, save_request=None):
@@ -179,49 +417,95 @@ class ConferenceApi(remote.Service):
 
         # if saveProfile(), process user-modifyable fields
         if save_request:
+            old_name = prof.displayName
+            changes = {}
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
                     val = getattr(save_request, field)
                     if val:
-                        setattr(prof, field, str(val))
-            prof.put()
+                        changes[field] = str(val)
+            prof = self._saveProfile(prof, changes)
+            # cached ConferenceForms show the organizer's displayName
+            if prof.displayName != old_name:
+                for c_key in Conference.query(ancestor=prof.key).iter(
+                        keys_only=True):
+                    self._invalidateConferenceCache(c_key)
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
 
 
-    def _copyConferenceToForm(self, conf, displayName):
+    def _copyConferenceToForm(self, conf, displayName, seatsAvailable=None):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
-        if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
-        return cf
+        return CONFERENCE_CONVERTER.convert(conf,
+            organizerDisplayName=displayName or None,
+            seatsAvailable=seatsAvailable)
+
+
+    def _copySessionSummaryToForm(self, summary):
+        """Copy ConferenceSessionSummary to SessionSummaryForm."""
+        return SessionSummaryForm(
+            sessionCount=summary.sessionCount,
+            typeCounts=[TypeCountForm(typeOfSession=name, count=count)
+                for name, count in sorted((summary.typeCounts or {}).items())],
+            speakerCount=summary.speakerCount,
+            firstDate=str(summary.firstDate) if summary.firstDate else None,
+            lastDate=str(summary.lastDate) if summary.lastDate else None,
+        )
+
+
+    def _copyConferencesToForms(self, conferences):
+        """Copy Conferences to ConferenceForms, batching the organizer name
+        and seat count lookups for the whole list."""
+        names = self._getDisplayNames(conferences)
+        seats = counters.seatsAvailable(conferences)
+        return [self._copyConferenceToForm(conf, names[conf.key.parent()],
+            seats[conf.key]) for conf in conferences]
+
+
+    def _summaryProjection(self, request):
+        """Return the projection for a SUMMARY queryConferences request and
+        a dict of the summary fields left out of it because they carry an
+        equality filter (projections can't include those), with the value
+        they are filtered on."""
+        fixed = {}
+        for f in request.filters:
+            field = FIELDS.get(f.field)
+            if field in SUMMARY_FIELDS and OPERATORS.get(f.operator) == '=':
+                fixed[field] = f.value
+        projection = [field for field in SUMMARY_FIELDS if field not in fixed]
+        return projection, fixed
+
+
+    def _copyConferencesToSummaries(self, conferences, fixed):
+        """Copy projected Conferences to ConferenceSummaryForms, filling the
+        fields left out of the projection from fixed."""
+        exclude = tuple(sorted(fixed))
+        converter = SUMMARY_CONVERTERS.get(exclude)
+        if converter is None:
+            converter = SUMMARY_CONVERTERS[exclude] = FormConverter(
+                Conference, ConferenceSummaryForm,
+                transforms={'startDate': str},
+                computed={'websafeKey': lambda conf: conf.key.urlsafe()},
+                exclude=exclude,
+            )
+        return [converter.convert(conf, **fixed) for conf in conferences]
+
+
+    def _getDisplayNames(self, conferences):
+        """Return dict of organizer Profile key -> displayName for conferences.
+
+        Parent Profile keys are deduplicated and resolved with one batch get.
+        """
+        p_keys = list(set(conf.key.parent() for conf in conferences))
+        profiles = ndb.get_multi(p_keys)
+        return dict((p_key, getattr(prof, 'displayName', None))
+            for p_key, prof in zip(p_keys, profiles))
 
 
     def _copySessionToForm(self, sess):
         """Copy relevant fields from Session to SessionForm."""
-        sf = SessionForm()
-        for field in sf.all_fields():
-            if hasattr(sess, field.name):
-                # convert Date to date string
-                if field.name == 'date' or field.name == 'startTime':
-                    setattr(sf, field.name, str(getattr(sess, field.name)))
-                else:
-                    setattr(sf, field.name, getattr(sess, field.name))
-            elif field.name == 'websafeConferenceKey':
-                setattr(sf, field.name, sess.key.urlsafe())
-        sf.check_initialized()
-        return sf
+        return SESSION_CONVERTER.convert(sess)
 
 
     def _createConferenceObject(self, request):
@@ -239,6 +523,7 @@ class ConferenceApi(remote.Service):
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeKey']
         del data['organizerDisplayName']
+        del data['sessionSummary']
 
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS:
@@ -261,8 +546,8 @@ class ConferenceApi(remote.Service):
             data["seatsAvailable"] = data["maxAttendees"]
             setattr(request, "seatsAvailable", data["maxAttendees"])
 
-        # make Profile Key from user ID
-        p_key = ndb.Key(Profile, user_id)
+        # make Profile Key from user ID; the organizer's Profile must exist
+        p_key = self._ensureProfile().key
         # allocate new Conference ID with Profile key as parent
         c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
         # make Conference key from ID
@@ -270,67 +555,272 @@ class ConferenceApi(remote.Service):
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
 
-        # create Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-            'conferenceInfo': repr(request)},
-            url='/tasks/send_confirmation_email'
-        )
+        # create Conference & its seat shards, return (modified) ConferenceForm
+        conf = Conference(**data)
+        conf.put()
+        counters.createShards(c_key, data['seatsAvailable'])
+        self._checkNearlySoldOut(conf, 0, data['seatsAvailable'])
+        self._bumpConferenceGeneration()
+        search.queueIndex([c_key])
+        emails.enqueueConfirmation(user.email(), request)
 
         return request
 
 
     def _createSessionObject(self, request):
+        """Create new Session object, returning SessionForm."""
+        sessions = self._createSessionObjects(request.websafeConferenceKey,
+            [request])
+        return self._copySessionToForm(sessions[0])
+
+
+    def _createSessionObjects(self, websafeConferenceKey, forms):
+        """Create a Session per SessionForm in forms, returning the Sessions.
+
+        Ownership is checked once, IDs are allocated in one call and the
+        Sessions are written in one batch.
+        """
         # preload necessary data items
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
         user_id = getUserId(user)
 
-        if not request.name:
-            raise endpoints.BadRequestException("Session 'name' field required")
-
-        # copy ConferenceForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
-        
-        # update existing conference
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        if not forms:
+            raise endpoints.BadRequestException("No sessions given")
+        if len(forms) > MAX_BULK_SESSIONS:
+            raise endpoints.BadRequestException(
+                "At most %d sessions can be created at once" % MAX_BULK_SESSIONS)
+        for form in forms:
+            if not form.name:
+                raise endpoints.BadRequestException("Session 'name' field required")
+
+        # get the conference & allocate the new Session IDs concurrently
+        c_key = ndb.Key(urlsafe=websafeConferenceKey)
+        ids_future = Session.allocate_ids_async(size=len(forms), parent=c_key)
+        conf = c_key.get()
         # check that conference exists
         if not conf:
             raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
+                'No conference found with key: %s' % websafeConferenceKey)
 
         # check that user is owner
         if user_id != conf.organizerUserId:
             raise endpoints.ForbiddenException(
                 'Only the owner can add sessions to the conference.')
 
-        # convert dates from strings to Date objects
-        if data['date']:
-            data['date'] = datetime.strptime(data['date'][:10], "%Y-%m-%d").date()
+        first_id, last_id = ids_future.get_result()
+        sessions = []
+        for s_id, form in zip(range(first_id, last_id + 1), forms):
+            # copy SessionForm/ProtoRPC Message into dict
+            data = {field.name: getattr(form, field.name)
+                for field in SessionForm.all_fields()}
+
+            # convert dates from strings to Date objects
+            if data['date']:
+                data['date'] = datetime.strptime(data['date'][:10], "%Y-%m-%d").date()
+
+            if data['startTime']:
+                data['startTime'] = datetime.strptime(data['startTime'][:5], "%H:%M").time()
+
+            # store the duration in minutes for range queries
+            if data['durationMinutes'] is None:
+                data['durationMinutes'] = parseDurationMinutes(data['duration'])
+            elif not data['duration']:
+                data['duration'] = str(data['durationMinutes'])
+
+            s_key = ndb.Key(Session, s_id, parent=conf.key)
+            data['key'] = s_key
+            data['websafeSessionKey'] = s_key.urlsafe()
+            data['websafeConferenceKey'] = websafeConferenceKey
+            sessions.append(Session(**data))
 
-        if data['startTime']:
-            data['startTime'] = datetime.strptime(data['startTime'][:5], "%H:%M").time()
+        self._putSessions(conf.key, sessions)
+        self._invalidateConferenceCache(conf.key)
+        return sessions
 
-        s_id = Session.allocate_ids(size=1, parent=conf.key)[0]
-        s_key = ndb.Key(Session, s_id, parent=conf.key)
-        data['key'] = s_key
-        data['websafeSessionKey'] = s_key.urlsafe()
-        
-        Session(**data).put()
 
-        if data['speaker']:
-            taskqueue.add(url='/tasks/set_featured_speaker', 
-                params={'websafeConferenceKey': request.websafeConferenceKey, 
-                'speaker': data['speaker']}, method='GET')                    
-        
-        return self._copySessionToForm(request)
+    @ndb.transactional()
+    def _putSessions(self, conf_key, sessions):
+        """Store new Sessions, adding them to their speakers' session index
+        and to the Conference's session summary; all live in the
+        Conference's entity group. One featured speaker task and one search
+        indexing task are enqueued for the whole batch."""
+        # speakers in order of their last session in the batch
+        speakers = []
+        for sess in sessions:
+            if sess.speaker:
+                if sess.speaker in speakers:
+                    speakers.remove(sess.speaker)
+                speakers.append(sess.speaker)
+
+        ss_keys = [SpeakerSessions.makeKey(conf_key, speaker)
+            for speaker in speakers]
+        summary_key = ConferenceSessionSummary.makeKey(conf_key)
+        entities = ndb.get_multi([summary_key] + ss_keys)
+        summary = entities[0] or ConferenceSessionSummary(key=summary_key)
+        index = dict((ss_key.id(), entry or SpeakerSessions(key=ss_key))
+            for ss_key, entry in zip(ss_keys, entities[1:]))
+        # speakers without an index entry are new to the conference
+        summary.speakerCount += entities[1:].count(None)
+        for sess in sessions:
+            summary.addSession(sess)
+            if sess.speaker:
+                index[sess.speaker].sessionCount += 1
+                index[sess.speaker].sessionNames.append(sess.name)
+
+        if speakers:
+            taskqueue.add(url='/tasks/set_featured_speaker',
+                params={'websafeConferenceKey': conf_key.urlsafe(),
+                'speaker': speakers}, method='GET', transactional=True)
+        search.queueIndex([sess.key for sess in sessions], transactional=True)
+        ndb.put_multi(sessions + index.values() + [summary])
+
+
+    def _fetchPage(self, query, request, **options):
+        """Fetch one page of query results using the request's pageSize/cursor.
+
+        Paging is opt-in: without pageSize or cursor the whole result set is
+        returned. Returns (entities, nextCursor); nextCursor is None when there
+        are no further results. Extra query options (e.g. projection) are
+        passed on to the fetch.
+        """
+        page_size = self._pageSize(request)
+        if not page_size:
+            return query.fetch(batch_size=QUERY_BATCH_SIZE, **options), None
+
+        entities, next_cursor, more = query.fetch_page(
+            page_size, start_cursor=self._startCursor(request), **options)
+        if more and next_cursor:
+            return entities, next_cursor.urlsafe()
+        return entities, None
+
+
+    def _pageSize(self, request):
+        """Return the validated page size of a request, or None if it does
+        not ask for paging."""
+        page_size = getattr(request, 'pageSize', None)
+        if not page_size and not getattr(request, 'cursor', None):
+            return None
+        page_size = page_size or DEFAULT_PAGE_SIZE
+        if page_size < 1 or page_size > MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                "'pageSize' must be between 1 and %d." % MAX_PAGE_SIZE)
+        return page_size
+
+
+    def _startCursor(self, request):
+        """Return the ndb.Cursor a request starts from, or None."""
+        websafe_cursor = getattr(request, 'cursor', None)
+        if not websafe_cursor:
+            return None
+        try:
+            return ndb.Cursor(urlsafe=websafe_cursor)
+        except datastore_errors.BadValueError:
+            raise endpoints.BadRequestException("Invalid 'cursor' value.")
+
+
+    def _fetchFiltered(self, query, request, residual, **options):
+        """Fetch a page of query results that also pass the residual
+        filters, which are evaluated in memory while streaming.
+
+        At most SCAN_BUDGET entities are scanned per request; if the page
+        is not full by then, the partial page is returned with a nextCursor
+        to carry on from. Returns (entities, nextCursor).
+        """
+        if not residual:
+            return self._fetchPage(query, request, **options)
+
+        page_size = self._pageSize(request)
+        it = query.iter(start_cursor=self._startCursor(request),
+            produce_cursors=True, batch_size=QUERY_BATCH_SIZE, **options)
+        entities = []
+        scanned = 0
+        for entity in it:
+            scanned += 1
+            if planner.matches(entity, residual):
+                entities.append(entity)
+                if page_size and len(entities) >= page_size:
+                    break
+            if scanned >= SCAN_BUDGET:
+                break
+        else:
+            # the query is exhausted
+            return entities, None
 
+        if it.has_next():
+            return entities, it.cursor_after().urlsafe()
+        return entities, None
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
+
+    def _querySessions(self, request, query, not_found, residual=()):
+        """Run a session query once and return its SessionForms.
+
+        The results (one page of them if the request asks for paging) are
+        fetched a single time and "not found" is decided from them, so no
+        probe queries are needed. Residual filters are evaluated in memory
+        (see _fetchFiltered). The datastore RPCs issued are logged while
+        settings.RPC_STATS_ENABLED is set (see rpcstats.requestCalls).
+        """
+        calls = rpcstats.requestCalls('datastore_v3')
+        sessions, next_cursor = self._fetchFiltered(query, request, residual)
+        if calls is not None:
+            logging.debug('session query: %d result(s), %d datastore RPC(s)',
+                len(sessions), rpcstats.requestCalls('datastore_v3') - calls)
+
+        # an empty page with a nextCursor only ran out of scan budget
+        if not sessions and not next_cursor and not request.cursor:
+            raise endpoints.NotFoundException(not_found)
+        return SessionForms(
+            items=SESSION_CONVERTER.convert_many(sessions),
+            nextCursor=next_cursor
+        )
+
+
+    @staticmethod
+    def _getCachedForm(cache_key, form_class):
+        """Return the form_class message cached at cache_key, or None."""
+        encoded = memcache.get(cache_key)
+        if encoded is None:
+            return None
+        return protojson.decode_message(form_class, encoded)
+
+
+    @staticmethod
+    def _cacheForm(cache_key, form):
+        """Cache form at cache_key for FORM_CACHE_SECONDS unless the key was
+        just invalidated; forms too large for memcache are not cached."""
+        encoded = protojson.encode_message(form)
+        if len(encoded) > memcache.MAX_VALUE_SIZE:
+            logging.debug('not caching %s: %d bytes', cache_key, len(encoded))
+            return
+        try:
+            memcache.add(cache_key, encoded, time=FORM_CACHE_SECONDS)
+        except ValueError:
+            # the value is too large after memcache's own encoding
+            logging.debug('not caching %s', cache_key)
+
+
+    @staticmethod
+    def _invalidateConferenceCache(conf_key):
+        """Drop the cached ConferenceForm and SessionForms of a conference."""
+        wsck = conf_key.urlsafe()
+        memcache.delete_multi(
+            [MEMCACHE_CONFERENCE_KEY % wsck, MEMCACHE_SESSIONS_KEY % wsck],
+            seconds=CACHE_LOCK_SECONDS)
+
+
+    def _planQuery(self, filters, projection=()):
+        """Return the QueryPlan for the formatted filters, projected to
+        projection where index.yaml allows."""
+        return planner.plan('Conference', filters, CONFERENCE_DOMAINS,
+            projection=projection, indexes=INDEXES)
+
+
+    def _getQuery(self, plan):
+        """Return query running the datastore part of a QueryPlan."""
         q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
+        inequality_filter, filters = plan.inequality_field, plan.pushed
 
         # If exists, sort on inequality filter first
         if not inequality_filter:
@@ -340,17 +830,18 @@ class ConferenceApi(remote.Service):
             q = q.order(Conference.name)
 
         for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
             formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
             q = q.filter(formatted_query)
         return q
 
 
     def _formatFilters(self, filters):
-        """Parse, check validity and format user supplied filters."""
+        """Parse, check validity and format user supplied filters.
+
+        Inequalities may be on any number of fields; _planQuery decides
+        which of them the datastore evaluates.
+        """
         formatted_filters = []
-        inequality_field = None
 
         for f in filters:
             filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
@@ -361,67 +852,322 @@ class ConferenceApi(remote.Service):
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous filters
-                # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+            if filtr["field"] in ["month", "maxAttendees"]:
+                try:
+                    filtr["value"] = int(filtr["value"])
+                except (TypeError, ValueError):
+                    raise endpoints.BadRequestException(
+                        "Filter on '%s' needs an integer value." % filtr["field"])
 
             formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+        return formatted_filters
+
+
+    @staticmethod
+    def _conferenceGeneration():
+        """Return the current conference generation.
+
+        Every Conference write bumps the generation, which retires all
+        cached queryConferences results at once. If memcache lost the
+        counter it restarts from the clock, above any generation in use.
+        """
+        generation = memcache.get(MEMCACHE_CONFERENCE_GENERATION_KEY)
+        if generation is None:
+            memcache.add(MEMCACHE_CONFERENCE_GENERATION_KEY,
+                int(time.time() * 1000))
+            generation = memcache.get(MEMCACHE_CONFERENCE_GENERATION_KEY)
+        return generation
+
+
+    @staticmethod
+    def _bumpConferenceGeneration():
+        memcache.incr(MEMCACHE_CONFERENCE_GENERATION_KEY,
+            initial_value=int(time.time() * 1000))
+
+
+    def _queryCacheKey(self, filters, request):
+        """Return the memcache key of a queryConferences result.
+
+        Filters are canonicalized (normalized field, operator and coerced
+        value, sorted) so equivalent filter lists share one entry.
+        """
+        canonical = (
+            tuple(sorted((f["field"], f["operator"], f["value"])
+                for f in filters)),
+            request.pageSize,
+            request.cursor,
+            str(request.view),
+        )
+        return MEMCACHE_CONFERENCE_QUERY_KEY % (self._conferenceGeneration(),
+            hashlib.sha1(repr(canonical)).hexdigest())
 
 
-    @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
-        retval = None
-        prof = self._getProfileFromUser() # get user Profile
+        return self._conferenceRegistrationAsync(request, reg).get_result()
+
+
+    @ndb.tasklet
+    def _conferenceRegistrationAsync(self, request, reg):
+        """Tasklet version of _conferenceRegistration."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        p_key = ndb.Key(Profile, getUserId(user))
 
-        # check if conf exists given websafeConfKey
-        # get conference; check that it exists
+        # get user Profile, conference and registration concurrently;
+        # check that conference exists
         wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
+        r_key = Registration.makeKey(p_key, wsck)
+        prof, conf, registration = yield (self._getProfileFromUserAsync(),
+            ndb.Key(urlsafe=wsck).get_async(), r_key.get_async())
+        if getattr(self, '_profileMigrated', False):
+            # the registration may just have been moved off the Profile
+            registration = yield r_key.get_async(use_cache=False)
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
 
-        # register
-        if reg:
-            # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
-                raise ConflictException(
-                    "You have already registered for this conference")
+        # check registration up front so seat shards are only read if needed
+        if reg and registration:
+            raise ConflictException(
+                "You have already registered for this conference")
+        if not reg and not registration:
+            raise ndb.Return(BooleanMessage(data=False))
+
+        if reg and not self._profileStored:
+            self._saveProfile(prof)
+        retval = yield self._moveSeatAsync(conf, r_key, reg)
+        raise ndb.Return(BooleanMessage(data=retval))
+
 
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
+    @ndb.tasklet
+    def _moveSeatAsync(self, conf, r_key, reg):
+        """Take a seat of conf for the Registration at r_key (or give it
+        back), keeping the seat caches and announcement up to date.
+
+        Returns True on success and False if there was nothing to
+        unregister; raises ConflictException if no seat is available.
+        """
+        # take a seat from (or give one back to) a random shard; move on to
+        # the next shard if this one filled up (or emptied) in the meantime
+        retval = None
+        for shard_key in (yield counters.candidateShardsAsync(conf,
+                claim=reg)):
+            retval = yield self._updateRegistrationAsync(
+                r_key, conf.key, shard_key, reg)
+            if retval is not None:
+                if retval:
+                    yield self._seatMovedAsync(conf, -1 if reg else 1)
+                break
+
+        if retval is None:
+            if reg:
                 raise ConflictException(
                     "There are no seats available.")
+            # no shard accounts for this seat; grow one to take it back
+            retval = yield self._updateRegistrationAsync(r_key, conf.key,
+                counters.anyShardKey(conf.key), reg, grow=True)
+            if retval:
+                yield self._seatMovedAsync(conf, 1)
+        raise ndb.Return(retval)
 
-            # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
 
-        # unregister
-        else:
-            # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+    @ndb.tasklet
+    def _seatMovedAsync(self, conf, delta):
+        """Bring the seat caches and announcement up to date after delta
+        seats of conf were taken (-1) or given back (1)."""
+        seats = counters.adjustCachedSeats(conf.key, delta)
+        if seats is None:
+            seats = (yield counters.seatsAvailableAsync([conf]))[conf.key]
+        self._checkNearlySoldOut(conf, seats - delta, seats)
 
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
+
+    @staticmethod
+    def _keyFromWebsafe(websafe_key, kind):
+        """Return the ndb.Key of kind for websafe_key, or None if it is
+        malformed or of another kind."""
+        try:
+            key = ndb.Key(urlsafe=websafe_key)
+        except (ProtocolBufferDecodeError, TypeError, AttributeError,
+                datastore_errors.Error):
+            return None
+        return key if key.kind() == kind else None
+
+
+    @ndb.tasklet
+    def _registerBatchAsync(self, websafe_keys):
+        """Register user for each conference in websafe_keys.
+
+        The conferences and existing registrations are fetched in one
+        batch. Seats are then claimed for all conferences concurrently,
+        each in a transaction on one seat shard alone, and the
+        Registrations are written together in one transaction on the
+        user's entity group; seats of registrations that could not be
+        written are given back. Returns a BatchResultForm per key.
+        """
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        p_key = ndb.Key(Profile, getUserId(user))
+
+        websafe_keys = list(OrderedDict.fromkeys(websafe_keys))
+        c_keys = [self._keyFromWebsafe(wsck, 'Conference')
+            for wsck in websafe_keys]
+        valid = [(wsck, c_key) for wsck, c_key in zip(websafe_keys, c_keys)
+            if c_key]
+        r_keys = [Registration.makeKey(p_key, wsck) for wsck, _ in valid]
+        prof, entities = yield (self._getProfileFromUserAsync(),
+            ndb.get_multi_async([c_key for _, c_key in valid] + r_keys))
+        if getattr(self, '_profileMigrated', False):
+            # registrations may just have been moved off the Profile
+            entities[len(valid):] = yield ndb.get_multi_async(r_keys,
+                use_cache=False)
+        confs = dict(zip([wsck for wsck, _ in valid], entities[:len(valid)]))
+        registrations = dict(zip([wsck for wsck, _ in valid],
+            zip(r_keys, entities[len(valid):])))
+
+        if not self._profileStored:
+            self._saveProfile(prof)
+        errors = {}
+        wanted = []
+        for wsck in websafe_keys:
+            conf = confs.get(wsck)
+            r_key, registration = registrations.get(wsck, (None, None))
+            if not conf:
+                errors[wsck] = 'No conference found with key: %s' % wsck
+            elif registration:
+                errors[wsck] = \
+                    "You have already registered for this conference"
             else:
-                retval = False
+                wanted.append((wsck, conf, r_key))
+
+        # claim the seats concurrently; each claim only contends with
+        # other registrations for the same shard
+        shard_keys = yield [self._claimSeatAsync(conf)
+            for _, conf, _ in wanted]
+        claimed = []
+        for (wsck, conf, r_key), shard_key in zip(wanted, shard_keys):
+            if shard_key:
+                claimed.append((wsck, conf, r_key, shard_key))
+            else:
+                errors[wsck] = "There are no seats available."
 
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
-        return BooleanMessage(data=retval)
+        # write all the Registrations to the user's entity group at once
+        written = set()
+        failed = False
+        if claimed:
+            written = None
+            try:
+                written = yield self._putRegistrationsAsync(
+                    [(r_key, conf.key) for _, conf, r_key, _ in claimed])
+            except datastore_errors.TransactionFailedError:
+                logging.warning('batch registration of %s failed', p_key)
+                written = set()
+                failed = True
+            finally:
+                if written is None:
+                    # the write raised otherwise (e.g. timed out) and may
+                    # still have committed; keep the seats of the
+                    # Registrations that are there, give back the others
+                    yield self._settleSeatsAsync(claimed)
+        moves = []
+        for wsck, conf, r_key, shard_key in claimed:
+            if r_key in written:
+                moves.append(self._seatMovedAsync(conf, -1))
+                continue
+            # registered meanwhile, or the write failed; give the seat back
+            errors[wsck] = ("Registration failed; please try again."
+                if failed else
+                "You have already registered for this conference")
+            moves.append(self._releaseSeatAsync(conf))
+        yield moves
+
+        raise ndb.Return(BatchResultForms(items=[
+            BatchResultForm(websafeKey=wsck, data=wsck not in errors,
+                error=errors.get(wsck))
+            for wsck in websafe_keys]))
+
+
+    @ndb.tasklet
+    def _settleSeatsAsync(self, claimed):
+        """Give back the seats claimed for a batch registration whose
+        Registrations are not stored, after a write with unknown outcome;
+        claimed holds (websafe key, conf, registration key, shard key)."""
+        stored = yield ndb.get_multi_async(
+            [r_key for _, _, r_key, _ in claimed], use_cache=False)
+        yield [self._seatMovedAsync(conf, -1) if registration
+            else self._releaseSeatAsync(conf)
+            for (_, conf, _, _), registration in zip(claimed, stored)]
+
+
+    @ndb.tasklet
+    def _claimSeatAsync(self, conf):
+        """Take a seat of conf for a batch registration; return the key of
+        the shard it came from, or None if there was none to take."""
+        try:
+            shard_key = yield counters.moveSeatAsync(conf, -1)
+        except datastore_errors.TransactionFailedError:
+            shard_key = None
+        raise ndb.Return(shard_key)
+
+
+    @ndb.tasklet
+    def _releaseSeatAsync(self, conf):
+        """Give back a seat claimed by _claimSeatAsync."""
+        try:
+            shard_key = yield counters.moveSeatAsync(conf, 1)
+        except datastore_errors.TransactionFailedError:
+            shard_key = None
+        if not shard_key:
+            logging.error('could not give back a seat of %s', conf.key)
+
+
+    @ndb.transactional_tasklet()
+    def _putRegistrationsAsync(self, registrations):
+        """Store a Registration for each (key, conference key) pair in
+        registrations, all of one Profile, unless it exists already; return
+        the set of keys written."""
+        r_keys = [r_key for r_key, _ in registrations]
+        existing = yield ndb.get_multi_async(r_keys)
+        to_put = [Registration(key=r_key, conferenceKey=c_key)
+            for (r_key, c_key), found in zip(registrations, existing)
+            if not found]
+        yield ndb.put_multi_async(to_put)
+        raise ndb.Return(set(registration.key for registration in to_put))
+
+
+    @ndb.transactional_tasklet(xg=True)
+    def _updateRegistrationAsync(self, r_key, conf_key, shard_key, reg,
+            grow=False):
+        """Move one seat between a seat shard and the user's Registration.
+
+        Returns True on success, False if there was nothing to unregister
+        and None if the shard has no seat to give (or room to take one back,
+        unless grow; see counters.adjustShard).
+        """
+        entities = yield ndb.get_multi_async([r_key, shard_key])
+        registration = entities[0]
+        if reg and registration:
+            raise ConflictException(
+                "You have already registered for this conference")
+        if not reg and not registration:
+            raise ndb.Return(False)
+
+        shard = entities[1]
+        if not shard or not counters.adjustShard(shard, -1 if reg else 1,
+                grow):
+            raise ndb.Return(None)
+        writes = [shard.put_async()]
+
+        # write the registration change back to the datastore & return
+        if reg:
+            writes.append(
+                Registration(key=r_key, conferenceKey=conf_key).put_async())
+        else:
+            writes.append(r_key.delete_async())
+        yield writes
+        raise ndb.Return(True)
 
 
     def _updateSessionWishlist(self, request, add):
@@ -429,38 +1175,106 @@ class ConferenceApi(remote.Service):
         retval = None
         prof = self._getProfileFromUser()
         wssk = request.websafeSessionKey
-        sess = ndb.Key(urlsafe=wssk).get()
+        w_key = WishlistEntry.makeKey(prof.key, wssk)
+        sess, entry = ndb.get_multi([ndb.Key(urlsafe=wssk), w_key])
         if not sess:
             raise endpoints.NotFoundException(
                 'No session found with key: %s' % wssk)
         if add:
-            if wssk in prof.sessionWishList:
+            if entry:
                 raise ConflictException(
                     "This Session is already in your Wishlist.")
-            prof.sessionWishList.append(wssk)
+            if not self._profileStored:
+                self._saveProfile(prof)
+            WishlistEntry(key=w_key, sessionKey=sess.key).put()
             retval = True
         else:
-            if wssk in prof.sessionWishList:
-                prof.sessionWishList.remove(wssk)
+            if entry:
+                w_key.delete()
                 retval = True
             else:
                 retval = False
-        prof.put()
         return BooleanMessage(data=retval)
 
 
-    @ndb.transactional()
+    def _updateSessionWishlistBatch(self, websafe_keys, add):
+        """Add or remove sessions in websafe_keys to/from user's wishlist.
+
+        The sessions and existing wishlist entries are fetched in one batch
+        get and all changes are written in one batch put (or delete).
+        Returns a BatchResultForm per key.
+        """
+        prof = self._getProfileFromUser()
+        websafe_keys = list(OrderedDict.fromkeys(websafe_keys))
+        s_keys = [self._keyFromWebsafe(wssk, 'Session')
+            for wssk in websafe_keys]
+        valid = [(wssk, s_key) for wssk, s_key in zip(websafe_keys, s_keys)
+            if s_key]
+        w_keys = [WishlistEntry.makeKey(prof.key, wssk) for wssk, _ in valid]
+        entities = ndb.get_multi([s_key for _, s_key in valid] + w_keys)
+        found = dict((wssk, (sess, w_key, entry)) for (wssk, _), sess, w_key,
+            entry in zip(valid, entities[:len(valid)], w_keys,
+            entities[len(valid):]))
+
+        results = []
+        to_put = []
+        to_delete = []
+        for wssk in websafe_keys:
+            sess, w_key, entry = found.get(wssk, (None, None, None))
+            if not sess:
+                results.append(BatchResultForm(websafeKey=wssk, data=False,
+                    error='No session found with key: %s' % wssk))
+            elif add and entry:
+                results.append(BatchResultForm(websafeKey=wssk, data=False,
+                    error="This Session is already in your Wishlist."))
+            elif add:
+                to_put.append(WishlistEntry(key=w_key, sessionKey=sess.key))
+                results.append(BatchResultForm(websafeKey=wssk, data=True))
+            elif entry:
+                to_delete.append(w_key)
+                results.append(BatchResultForm(websafeKey=wssk, data=True))
+            else:
+                results.append(BatchResultForm(websafeKey=wssk, data=False))
+
+        if to_put:
+            if not self._profileStored:
+                self._saveProfile(prof)
+            ndb.put_multi(to_put)
+        if to_delete:
+            ndb.delete_multi(to_delete)
+        return BatchResultForms(items=results)
+
+
     def _updateConferenceObject(self, request):
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
-        user_id = _getUserId()
-
-        # copy ConferenceForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
+        user_id = getUserId(user)
 
-        # update existing conference
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        conf, prof, old_max = self._updateConferenceAsync(
+            request, user_id).get_result()
+        self._invalidateConferenceCache(conf.key)
+        self._bumpConferenceGeneration()
+        search.queueIndex([conf.key])
+
+        # seats live in the shards; resize them if capacity changed
+        applied = 0
+        if conf.maxAttendees != old_max:
+            applied = counters.addSeats(conf,
+                (conf.maxAttendees or 0) - (old_max or 0))
+        seats = counters.seatsAvailable([conf])[conf.key]
+        if applied:
+            self._checkNearlySoldOut(conf, seats - applied, seats)
+        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'),
+            seats)
+
+
+    @ndb.transactional_tasklet()
+    def _updateConferenceAsync(self, request, user_id):
+        """Copy the provided fields onto the Conference; return it, its
+        organizer Profile and the previous maxAttendees."""
+        # get existing conference
+        conf = yield ndb.Key(urlsafe=request.websafeConferenceKey).get_async()
         # check that conference exists
         if not conf:
             raise endpoints.NotFoundException(
@@ -471,9 +1285,13 @@ class ConferenceApi(remote.Service):
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
 
+        old_max = conf.maxAttendees
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
         for field in request.all_fields():
+            # seatsAvailable and sessionSummary are derived from other entities
+            if field.name in ('seatsAvailable', 'sessionSummary'):
+                continue
             data = getattr(request, field.name)
             # only copy fields where we get data
             if data not in (None, []):
@@ -484,87 +1302,223 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
-        conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        # the organizer's Profile is the root of the Conference's entity
+        # group, so it can be read in this transaction
+        prof, _ = yield conf.key.parent().get_async(), conf.put_async()
+        raise ndb.Return((conf, prof, old_max))
 
 
     @staticmethod
-    def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+    def _isNearlySoldOut(seats):
+        return 0 < seats <= NEARLY_SOLD_OUT_SEATS
+
+
+    @staticmethod
+    def _checkNearlySoldOut(conf, old_seats, new_seats):
+        """Keep the nearly sold out set in step with a seat count change.
+
+        Only counts at or near the threshold need looking at; membership
+        is verified there too, so conferences missed earlier are picked up.
         """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
+        was_nearly = ConferenceApi._isNearlySoldOut(old_seats)
+        is_nearly = ConferenceApi._isNearlySoldOut(new_seats)
+        if not (was_nearly or is_nearly):
+            return
+        wsck = conf.key.urlsafe()
+        names = memcache.get(MEMCACHE_NEARLY_SOLD_OUT_KEY)
+        if names is not None and (wsck in names) == is_nearly:
+            return
+        ConferenceApi._updateNearlySoldOut(conf, is_nearly)
+
+
+    @staticmethod
+    def _updateNearlySoldOut(conf, nearly):
+        """Add conf to (or remove it from) the nearly sold out set, which
+        is stored as NearlySoldOut entities and cached in memcache as a
+        dict of websafe key -> name, and re-render the announcement."""
+        wsck = conf.key.urlsafe()
+        if nearly:
+            NearlySoldOut(id=wsck, name=conf.name).put()
+        else:
+            ndb.Key(NearlySoldOut, wsck).delete()
+
+        client = memcache.Client()
+        for i in range(CAS_RETRIES):
+            names = client.gets(MEMCACHE_NEARLY_SOLD_OUT_KEY)
+            if names is None:
+                # cold cache: rebuild the set from the datastore
+                names = dict((entry.key.id(), entry.name)
+                    for entry in NearlySoldOut.query())
+            if nearly:
+                names[wsck] = conf.name
+            else:
+                names.pop(wsck, None)
+            if client.cas(MEMCACHE_NEARLY_SOLD_OUT_KEY, names) or \
+                    client.add(MEMCACHE_NEARLY_SOLD_OUT_KEY, names):
+                break
+        else:
+            # too much contention; let the cron job rebuild the set
+            memcache.delete(MEMCACHE_NEARLY_SOLD_OUT_KEY)
+        ConferenceApi._setAnnouncement(names)
 
-        if confs:
+
+    @staticmethod
+    def _setAnnouncement(names):
+        """Render the announcement for the nearly sold out conference names
+        and assign it to memcache."""
+        if names:
             # If there are almost sold out conferences,
             # format announcement and set it in memcache
-            print "We are going to set the announcement"
             announcement = '%s %s' % (
                 'Last chance to attend! The following conferences '
                 'are nearly sold out:',
-                ', '.join(conf.name for conf in confs))
-            print "The announcement has been created. Here: ", announcement
-            memcache.set("MEMCACHE_ANNOUNCEMENTS_KEY", announcement)
-            print "The announcement has been set."
+                ', '.join(sorted(names.itervalues())))
+            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
         else:
             # If there are no sold out conferences,
             # delete the memcache announcements entry
             announcement = ""
-            memcache.delete("MEMCACHE_ANNOUNCEMENTS_KEY")
-
+            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
         return announcement
 
 
+    @staticmethod
+    def _reconcileNearlySoldOut(conferences):
+        """Bring the nearly sold out set in step with the seat counts of
+        conferences, one batch of the memcache cron job's scan.
+
+        Registration, creation and capacity changes keep the set up to
+        date; this only adds the members that were missed and drops those
+        no longer nearly sold out, through the same CAS updates.
+        """
+        seats = counters.seatsAvailable(conferences)
+        members = ndb.get_multi([ndb.Key(NearlySoldOut, conf.key.urlsafe())
+            for conf in conferences])
+        for conf, member in zip(conferences, members):
+            nearly = ConferenceApi._isNearlySoldOut(seats[conf.key])
+            if nearly != bool(member) or (
+                    member and member.name != conf.name):
+                ConferenceApi._updateNearlySoldOut(conf, nearly)
+
+
+    @staticmethod
+    def _dropDeletedNearlySoldOut():
+        """Drop members of the nearly sold out set whose conference no
+        longer exists."""
+        keys = NearlySoldOut.query().fetch(keys_only=True)
+        for key, conf in zip(keys, ndb.get_multi([ndb.Key(urlsafe=key.id())
+                for key in keys])):
+            if not conf:
+                ConferenceApi._updateNearlySoldOut(
+                    Conference(key=ndb.Key(urlsafe=key.id())), False)
+
+
+    @staticmethod
+    def _cacheAnnouncement():
+        """Re-render the Announcement from the nearly sold out set; used by
+        memcache cron job."""
+        names = memcache.get(MEMCACHE_NEARLY_SOLD_OUT_KEY)
+        if names is None:
+            # cold cache: restore the set from the datastore, unless a CAS
+            # update got there first
+            names = dict((entry.key.id(), entry.name)
+                for entry in NearlySoldOut.query())
+            memcache.add(MEMCACHE_NEARLY_SOLD_OUT_KEY, names)
+        return ConferenceApi._setAnnouncement(names)
+
+
     @endpoints.method(message_types.VoidMessage, StringMessage,
             path='conference/announcement/get',
             http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""        
         # return an existing announcement from Memcache or an empty string.
-        announcement = memcache.get("MEMCACHE_ANNOUNCEMENTS_KEY")
+        announcement = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
         if not announcement:            
             announcement = ""
         return StringMessage(data=announcement)
 
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(CONF_PAGE_REQUEST, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
-        ndb_keys = []
         prof = self._getProfileFromUser()
-        websafe_keys = prof.conferenceKeysToAttend
-        for key in websafe_keys:
-            ndb_key = ndb.Key(urlsafe=key)
-            ndb_keys.append(ndb_key)
-        conferences = ndb.get_multi(ndb_keys)
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, "")\
-            for conf in conferences]
+        # Registration ids are the websafe keys of the conferences
+        r_keys, next_cursor = self._fetchPage(
+            Registration.query(ancestor=prof.key), request, keys_only=True)
+        ndb_keys = [ndb.Key(urlsafe=r_key.id()) for r_key in r_keys]
+        conferences = [conf for conf in ndb.get_multi(ndb_keys) if conf]
+        return ConferenceForms(
+            items=self._copyConferencesToForms(conferences),
+            nextCursor=next_cursor
         )
 
 
-    @endpoints.method(message_types.VoidMessage, SessionForms,
+    @endpoints.method(CONF_PAGE_REQUEST, SessionForms,
             path='sessions/wishlist', http_method='GET',
             name='getSessionsInWishlist')
     def getSessionsInWishlist(self, request):
         """Get sessions in user's wishlist."""
-        ndb_keys = []
         prof = self._getProfileFromUser()
-        websafe_keys = prof.sessionWishList
-        for key in websafe_keys:
-            ndb_key = ndb.Key(urlsafe=key)
-            ndb_keys.append(ndb_key)
+        # WishlistEntry ids are the websafe keys of the sessions
+        w_keys, next_cursor = self._fetchPage(
+            WishlistEntry.query(ancestor=prof.key), request, keys_only=True)
+        ndb_keys = [ndb.Key(urlsafe=w_key.id()) for w_key in w_keys]
         sessions = ndb.get_multi(ndb_keys)
-        return SessionForms(items=[self._copySessionToForm(sess)\
-            for sess in sessions]
+        return SessionForms(
+            items=SESSION_CONVERTER.convert_many(sess for sess in sessions if sess),
+            nextCursor=next_cursor
         )
 
 
+    @endpoints.method(message_types.VoidMessage, AgendaForm,
+            path='agenda', http_method='GET', name='getMyAgenda')
+    def getMyAgenda(self, request):
+        """Get user's conferences and wishlisted sessions in date/startTime
+        order, flagging sessions that overlap."""
+        prof = self._getProfileFromUser()
+        # Registration and WishlistEntry ids are the websafe keys of the
+        # conferences and sessions; list both concurrently
+        r_future = Registration.query(ancestor=prof.key).fetch_async(
+            keys_only=True)
+        w_future = WishlistEntry.query(ancestor=prof.key).fetch_async(
+            keys_only=True)
+        c_keys = [ndb.Key(urlsafe=r_key.id()) for r_key in r_future.get_result()]
+        s_keys = [ndb.Key(urlsafe=w_key.id()) for w_key in w_future.get_result()]
+
+        # one batch get for the attended conferences, the wishlisted
+        # sessions and the conferences those sessions belong to
+        all_c_keys = list(OrderedDict.fromkeys(
+            c_keys + [s_key.parent() for s_key in s_keys]))
+        entities = ndb.get_multi(all_c_keys + s_keys)
+        confs = dict(zip(all_c_keys, entities[:len(all_c_keys)]))
+        sessions = [sess for sess in entities[len(all_c_keys):] if sess]
+
+        # scheduled sessions in date/startTime order, then the others
+        intervals = dict((sess.key, sessionInterval(sess)) for sess in sessions)
+        sessions.sort(key=lambda sess: (intervals[sess.key] is None,
+            intervals[sess.key], sess.name))
+        overlaps = findOverlaps([interval + (s_key,)
+            for s_key, interval in intervals.iteritems() if interval])
+
+        items = []
+        for sess in sessions:
+            conf = confs.get(sess.key.parent())
+            items.append(AgendaItemForm(
+                session=SESSION_CONVERTER.convert(sess),
+                conferenceName=conf.name if conf else None,
+                overlapsWith=sorted(s_key.urlsafe()
+                    for s_key in overlaps.get(sess.key, ()))))
+        conferences = [confs[c_key] for c_key in c_keys if confs[c_key]]
+        conferences.sort(key=lambda conf: (conf.startDate is None,
+            conf.startDate, conf.name))
+        return AgendaForm(
+            conferences=self._copyConferencesToForms(conferences),
+            items=items)
+
+
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='POST', name='registerForConference')
@@ -589,19 +1543,73 @@ class ConferenceApi(remote.Service):
         return self._updateSessionWishlist(request, False)
 
 
+    @endpoints.method(WebsafeKeysForm, BatchResultForms,
+            path='conferences/register',
+            http_method='POST', name='registerForConferences')
+    def registerForConferences(self, request):
+        """Register user for several conferences at once."""
+        return self._registerBatchAsync(request.keys).get_result()
+
+
+    @endpoints.method(WebsafeKeysForm, BatchResultForms,
+            path='sessions/wishlist/add',
+            http_method='POST', name='addSessionsToWishlist')
+    def addSessionsToWishlist(self, request):
+        """Add several sessions to user's wishlist at once."""
+        return self._updateSessionWishlistBatch(request.keys, True)
+
+
+    @endpoints.method(WebsafeKeysForm, BatchResultForms,
+            path='sessions/wishlist/delete',
+            http_method='POST', name='deleteSessionsInWishlist')
+    def deleteSessionsInWishlist(self, request):
+        """Delete several sessions from user's wishlist at once."""
+        return self._updateSessionWishlistBatch(request.keys, False)
+
+
     @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='GET', name='getConference')
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        # serve the ConferenceForm from memcache if we can; it is cached
+        # without seatsAvailable, which changes with every registration and
+        # is cached on its own by counters
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        cache_key = MEMCACHE_CONFERENCE_KEY % c_key.urlsafe()
+        cf = self._getCachedForm(cache_key, ConferenceForm)
+        if cf:
+            cf.seatsAvailable = counters.cachedSeatsAvailable(c_key)
+            if cf.seatsAvailable is None:
+                conf = c_key.get()
+                if not conf:
+                    raise endpoints.NotFoundException(
+                        'No conference found with key: %s' %
+                        request.websafeConferenceKey)
+                cf.seatsAvailable = counters.seatsAvailable([conf])[c_key]
+            return cf
+
+        # get Conference object, its organizer's Profile & its session
+        # summary concurrently; bail if not found
+        conf_future = c_key.get_async()
+        prof_future = c_key.parent().get_async()
+        summary_future = ConferenceSessionSummary.makeKey(c_key).get_async()
+        conf = conf_future.get_result()
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
-        # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        prof = prof_future.get_result()
+        seats = counters.seatsAvailable([conf])[conf.key]
+        # cache & return ConferenceForm
+        cf = self._copyConferenceToForm(conf, getattr(prof, 'displayName'),
+            seats)
+        summary = summary_future.get_result()
+        cf.sessionSummary = self._copySessionSummaryToForm(summary or
+            ConferenceSessionSummary())
+        cf.seatsAvailable = None
+        self._cacheForm(cache_key, cf)
+        cf.seatsAvailable = seats
+        return cf
 
 
     @endpoints.method(SESS_GET_REQUEST, SessionForms,
@@ -612,20 +1620,23 @@ class ConferenceApi(remote.Service):
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
-        # make conference key
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
+        # make conference key; only the unpaged response is cached
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        paged = request.pageSize or request.cursor
+        cache_key = MEMCACHE_SESSIONS_KEY % c_key.urlsafe()
+        if not paged:
+            sf = self._getCachedForm(cache_key, SessionForms)
+            if sf:
+                return sf
+
         # create ancestor query for this conference
-        sessions = Session.query(ancestor=conf.key)
-        if not sessions.get():
-            raise endpoints.NotFoundException(
-                'No sessions found with conference key: %s' % request.websafeConferenceKey)
         # return set of SessionForm objects per Session
-        return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in sessions]
-            )
+        sf = self._querySessions(request, Session.query(ancestor=c_key),
+            'No sessions found with conference key: %s'
+            % request.websafeConferenceKey)
+        if not paged:
+            self._cacheForm(cache_key, sf)
+        return sf
 
 
     @endpoints.method(SESS_TYPE_GET_REQUEST, SessionForms,
@@ -636,24 +1647,13 @@ class ConferenceApi(remote.Service):
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
-        # make conference key
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
         # create ancestor query for this conference
-        sessions = Session.query(ancestor=conf.key)
-        if not sessions.get():
-            raise endpoints.NotFoundException(
-                'No sessions found with conference key: %s' % request.websafeConferenceKey)
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        sessions = Session.query(ancestor=c_key)
         sessions = sessions.filter(Session.typeOfSession == request.typeOfSession)
-        if not sessions.get():
-            raise endpoints.NotFoundException(
-                'No sessions found with conference key: %s and type of session: %s'
-                 % (request.websafeConferenceKey, request.typeOfSession))
-        return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in sessions]
-        )
+        return self._querySessions(request, sessions,
+            'No sessions found with conference key: %s and type of session: %s'
+            % (request.websafeConferenceKey, request.typeOfSession))
 
     
     @endpoints.method(SESS_DUR_GET_REQUEST, SessionForms,
@@ -664,17 +1664,14 @@ class ConferenceApi(remote.Service):
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
-        sessions = Session.query()
-        if not sessions.get():
-            raise endpoints.NotFoundException(
-                'No sessions found')
-        sessions = sessions.filter(Session.duration == request.duration)
-        if not sessions.get():
-            raise endpoints.NotFoundException(
-                'No sessions found with duration: %s' % request.duration)
-        return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in sessions]
-        )
+        # match on minutes, so '90', '90 min' and '1:30' are the same
+        minutes = parseDurationMinutes(request.duration)
+        if minutes is None:
+            sessions = Session.query(Session.duration == request.duration)
+        else:
+            sessions = Session.query(Session.durationMinutes == minutes)
+        return self._querySessions(request, sessions,
+            'No sessions found with duration: %s' % request.duration)
     
 
     @endpoints.method(SESS_TIME_GET_REQUEST, SessionForms,
@@ -685,18 +1682,86 @@ class ConferenceApi(remote.Service):
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
-        sessions = Session.query()
-        if not sessions.get():
-            raise endpoints.NotFoundException(
-                'No sessions found')
-        new_time = datetime.strptime(request.startTime, "%H:%M").time()
-        sessions = sessions.filter(Session.startTime == new_time)
-        if not sessions.get():
-            raise endpoints.NotFoundException(
-                'No sessions found with time: %s' % request.startTime)
-        return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in sessions]
-        )
+        try:
+            new_time = datetime.strptime(request.startTime, "%H:%M").time()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "'startTime' must be formatted as HH:MM.")
+        sessions = Session.query(Session.startTime == new_time)
+        return self._querySessions(request, sessions,
+            'No sessions found with time: %s' % request.startTime)
+
+
+    def _sessionSearchFilters(self, request):
+        """Return the range filters of a querySessions request."""
+        def parse(name, fmt, convert):
+            value = getattr(request, name)
+            try:
+                return convert(datetime.strptime(value, fmt))
+            except ValueError:
+                raise endpoints.BadRequestException(
+                    "'%s' must be formatted as %s." % (name,
+                    fmt.replace('%H', 'HH').replace('%M', 'MM')
+                    .replace('%Y', 'YYYY').replace('%m', 'MM')
+                    .replace('%d', 'DD')))
+
+        filters = []
+        for name, field, operator, fmt, convert in (
+                ('startTimeFrom', 'startTime', '>=', '%H:%M', datetime.time),
+                ('startTimeTo', 'startTime', '<=', '%H:%M', datetime.time),
+                ('dateFrom', 'date', '>=', '%Y-%m-%d', datetime.date),
+                ('dateTo', 'date', '<=', '%Y-%m-%d', datetime.date)):
+            if getattr(request, name):
+                filters.append({'field': field, 'operator': operator,
+                    'value': parse(name, fmt, convert)})
+        if request.maxDuration is not None:
+            filters.append({'field': 'durationMinutes', 'operator': '<=',
+                'value': request.maxDuration})
+        return filters
+
+
+    def _getSessionQuery(self, plan, ancestor=None):
+        """Return query running the datastore part of a Session QueryPlan."""
+        q = Session.query(ancestor=ancestor)
+        for filtr in plan.pushed:
+            compare = planner.COMPARATORS[filtr['operator']]
+            q = q.filter(compare(getattr(Session, filtr['field']),
+                filtr['value']))
+        if plan.inequality_field:
+            q = q.order(getattr(Session, plan.inequality_field))
+        for field in plan.order:
+            q = q.order(getattr(Session, field))
+        return q
+
+
+    @endpoints.method(SESS_SEARCH_REQUEST, SessionForms,
+        path='sessions/search',
+        http_method='GET', name='querySessions')
+    def querySessions(self, request):
+        """Return sessions by start time, date and duration ranges,
+        optionally within one conference.
+
+        Results are sorted by the one range the datastore query runs (date,
+        startTime or durationMinutes; see the planner), then by date and
+        startTime; the other ranges are checked in memory. A page may come
+        back empty but with a nextCursor when no match was found within the
+        scan budget.
+        """
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        ancestor = None
+        if request.websafeConferenceKey:
+            ancestor = ndb.Key(urlsafe=request.websafeConferenceKey)
+
+        # the datastore runs the most selective range; the others are
+        # evaluated in memory
+        plan = planner.plan('Session', self._sessionSearchFilters(request),
+            SESSION_DOMAINS, SESSION_ORDER, ancestor=ancestor is not None,
+            indexes=INDEXES)
+        return self._querySessions(request,
+            self._getSessionQuery(plan, ancestor),
+            'No sessions found matching the search.', plan.residual)
 
 
     @endpoints.method(SESS_SPEAKER_GET_REQUEST, SessionForms,
@@ -707,16 +1772,9 @@ class ConferenceApi(remote.Service):
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
-        sessions = Session.query()
-        if not sessions.get():
-            raise endpoints.NotFoundException('No sessions found')
-        sessions = sessions.filter(Session.speaker == request.speaker)
-        if not sessions.get():
-            raise endpoints.NotFoundException(
-                'No sessions found with speaker: %s' % request.speaker)
-        return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in sessions]
-        )
+        sessions = Session.query(Session.speaker == request.speaker)
+        return self._querySessions(request, sessions,
+            'No sessions found with speaker: %s' % request.speaker)
 
     
     @endpoints.method(CONF_GET_REQUEST, FeaturedSpeaker,
@@ -724,9 +1782,18 @@ class ConferenceApi(remote.Service):
         http_method='GET', name='getFeaturedSpeaker')
     def getFeaturedSpeaker(self, request):
         """Return featured speaker and sessions for a conference from memcache."""
-        featured_speaker_sessions = memcache.get('featured_speaker_sessions')
-        if not featured_speaker_sessions:
-            featured_speaker_sessions = ''
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        cache_key = MEMCACHE_FEATURED_SPEAKER_KEY % c_key.urlsafe()
+        featured_speaker_sessions = memcache.get(cache_key)
+        if featured_speaker_sessions is None:
+            # not cached; fall back to the speaker with the most sessions
+            featured_speaker_sessions = []
+            speaker = SpeakerSessions.query(ancestor=c_key).order(
+                -SpeakerSessions.sessionCount).get()
+            if speaker and speaker.sessionCount > 1:
+                featured_speaker_sessions = \
+                    [speaker.key.id()] + speaker.sessionNames
+            memcache.add(cache_key, featured_speaker_sessions)
         return FeaturedSpeaker(data=featured_speaker_sessions)
     
 
@@ -738,7 +1805,7 @@ class ConferenceApi(remote.Service):
         return self._updateConferenceObject(request)
 
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(CONF_PAGE_REQUEST, ConferenceForms,
         path='getConferencesCreated',
         http_method='POST', name='getConferencesCreated')
     def getConferencesCreated(self, request):
@@ -752,15 +1819,42 @@ class ConferenceApi(remote.Service):
         p_key = ndb.Key(Profile, getUserId(user))
         # create ancestor query for this user
         conferences = Conference.query(ancestor=p_key)
-        # get the user profile and display name
-        prof = p_key.get()
-        displayName = getattr(prof, 'displayName')
         # return set of ConferenceForm objects per Conference
+        conferences, next_cursor = self._fetchPage(conferences, request)
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, displayName) for conf in conferences]
+            items=self._copyConferencesToForms(conferences),
+            nextCursor=next_cursor
         )
 
 
+    def _searchLimit(self, request):
+        return min(max(request.limit or search.MAX_RESULTS, 1),
+            search.MAX_RESULTS)
+
+
+    @endpoints.method(SEARCH_REQUEST, ConferenceForms,
+        path='search/conferences',
+        http_method='GET', name='searchConferences')
+    def searchConferences(self, request):
+        """Return conferences whose name or description contain every word
+        of q (words ending in '*' match as prefixes)."""
+        conferences = search.search('Conference', request.q,
+            self._searchLimit(request))
+        return ConferenceForms(
+            items=self._copyConferencesToForms(conferences))
+
+
+    @endpoints.method(SEARCH_REQUEST, SessionForms,
+        path='search/sessions',
+        http_method='GET', name='searchSessions')
+    def searchSessions(self, request):
+        """Return sessions whose name or highlights contain every word of q
+        (words ending in '*' match as prefixes)."""
+        sessions = search.search('Session', request.q,
+            self._searchLimit(request))
+        return SessionForms(items=SESSION_CONVERTER.convert_many(sessions))
+
+
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
         path='filterPlayground', http_method='POST',
         name='filterPlayground')
@@ -770,10 +1864,10 @@ class ConferenceApi(remote.Service):
         c = c.filter(Conference.topics == 'Medical Innovations')
         c = c.order(Conference.name)
         c = c.filter(Conference.maxAttendees > 10)
-        
+        conferences = c.fetch()
+
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") \
-            for conf in c]
+            items=self._copyConferencesToForms(conferences)
         )
 
 
@@ -782,15 +1876,69 @@ class ConferenceApi(remote.Service):
             name='queryConferences')
     def queryConferences(self, request):
         """Query for conferences."""
-        conferences = self._getQuery(request)
+        filters = self._formatFilters(request.filters)
+        summary = request.view == ConferenceView.SUMMARY
+        projection, fixed = self._summaryProjection(request)
+        plan = self._planQuery(filters, projection if summary else ())
+
+        # SUMMARY results only hold Conference fields, so the response is
+        # cached whole; full results are cached as key lists, as their seat
+        # counts and organizer names change without a Conference write
+        cache_key = self._queryCacheKey(filters, request)
+        if summary:
+            cf = self._getCachedForm(cache_key, ConferenceForms)
+            if cf:
+                return cf
+        else:
+            cached = memcache.get(cache_key)
+            if cached is not None:
+                keys, next_cursor = cached
+                conferences = [conf for conf in ndb.get_multi(keys) if conf]
+                return ConferenceForms(
+                    items=self._copyConferencesToForms(conferences),
+                    nextCursor=next_cursor
+                )
+
+        conferences = self._getQuery(plan)
+        # SUMMARY view: project just the listed fields, unless other fields
+        # are needed to evaluate filters in memory or no index serves the
+        # projection
+        options = {}
+        if plan.projection:
+            options['projection'] = plan.projection
+        conferences, next_cursor = self._fetchFiltered(conferences,
+            request, plan.residual, **options)
+
+        if summary:
+            cf = ConferenceForms(
+                summaries=self._copyConferencesToSummaries(conferences, fixed),
+                nextCursor=next_cursor
+            )
+            self._cacheForm(cache_key, cf)
+            return cf
+
+        memcache.set(cache_key, ([conf.key for conf in conferences],
+            next_cursor), time=FORM_CACHE_SECONDS)
 
          # return individual ConferenceForm object per Conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") \
-            for conf in conferences]
+            items=self._copyConferencesToForms(conferences),
+            nextCursor=next_cursor
         )
 
 
+    @endpoints.method(ConferenceQueryForms, StringMessage,
+            path='explainConferenceQuery', http_method='POST',
+            name='explainConferenceQuery')
+    def explainConferenceQuery(self, request):
+        """Describe how queryConferences would run the filters, including
+        the index.yaml entry the datastore query needs."""
+        projection, _ = self._summaryProjection(request)
+        plan = self._planQuery(self._formatFilters(request.filters),
+            projection if request.view == ConferenceView.SUMMARY else ())
+        return StringMessage(data=plan.describe())
+
+
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
             http_method='POST', name='createConference')
     def createConference(self, request):
@@ -806,6 +1954,16 @@ class ConferenceApi(remote.Service):
         return self._createSessionObject(request)
 
 
+    @endpoints.method(SESS_BULK_POST_REQUEST, SessionForms,
+                  path='sessions/{websafeConferenceKey}',
+                  http_method='POST', name='createSessions')
+    def createSessions(self, request):
+        """Create new sessions in bulk."""
+        sessions = self._createSessionObjects(request.websafeConferenceKey,
+            request.items)
+        return SessionForms(items=SESSION_CONVERTER.convert_many(sessions))
+
+
     @endpoints.method(message_types.VoidMessage, ProfileForm,
             path='profile', http_method='GET', name='getProfile')
     def getProfile(self, request):
@@ -820,5 +1978,6 @@ class ConferenceApi(remote.Service):
         return self._doProfile(request)
 
 
-# registers API
-api = endpoints.api_server([ConferenceApi]) 
+# registers API, with RPC accounting if enabled in settings
+api = rpcstats.wrap(endpoints.api_server([ConferenceApi]),
+    services=[ConferenceApi])
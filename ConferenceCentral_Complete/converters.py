@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+"""converters.py
+
+Udacity conference server-side Python App Engine entity -> ProtoRPC
+form converters
+
+"""
+
+import operator
+
+
+def _makeGetter(name, transform=None, fallback=None):
+    """Return a function reading attribute name, optionally transformed;
+    if fallback is given, it computes the value when the attribute is
+    None."""
+    getter = operator.attrgetter(name)
+    if fallback is not None:
+        read = getter
+        def getter(entity):
+            value = read(entity)
+            return fallback(entity) if value is None else value
+    if transform is None:
+        return getter
+    return lambda entity: transform(getter(entity))
+
+
+class FormConverter(object):
+    """FormConverter -- copies ndb entities into ProtoRPC form messages.
+
+    The field mapping between the model and the message is resolved once,
+    when the converter is built, so converting an entity is a flat loop of
+    attribute reads instead of reflecting over every form field each time.
+
+    transforms maps a field name to a function applied to the entity value
+    (e.g. str for dates); computed maps a form field to a function of the
+    entity (e.g. the websafe key). A computed field the model also has is
+    only computed when the stored value is None. If exclude is given, those
+    model attributes are never read (e.g. ones left out of a projection
+    query).
+    """
+
+    def __init__(self, model, form, transforms=None, computed=None,
+            exclude=()):
+        transforms = transforms or {}
+        computed = computed or {}
+        plan = []
+        for field in form.all_fields():
+            if field.name in exclude:
+                continue
+            if hasattr(model, field.name):
+                plan.append((field.name,
+                    _makeGetter(field.name, transforms.get(field.name),
+                    computed.get(field.name))))
+            elif field.name in computed:
+                plan.append((field.name, computed[field.name]))
+        self._form = form
+        self._plan = tuple(plan)
+
+
+    def convert(self, entity, **extra):
+        """Return a form message for entity; extra values other than None
+        are set on the form after (and over) the mapped fields."""
+        form = self._form()
+        for name, getter in self._plan:
+            value = getter(entity)
+            if value is not None:
+                setattr(form, name, value)
+        for name, value in extra.iteritems():
+            if value is not None:
+                setattr(form, name, value)
+        form.check_initialized()
+        return form
+
+
+    def convert_many(self, entities):
+        """Return a list of form messages, one per entity."""
+        convert = self.convert
+        return [convert(entity) for entity in entities]
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+
+"""counters.py
+
+Udacity conference server-side Python App Engine sharded seat counters
+
+A Conference's seats are split across SEAT_SHARDS root SeatShard entities
+so concurrent registrations land on different entity groups. The aggregate
+number of seats available is cached in memcache for SEATS_CACHE_SECONDS,
+so a lost invalidation is corrected within that time.
+
+"""
+
+import random
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import SeatShard
+
+SEAT_SHARDS = 20
+MEMCACHE_SEATS_KEY = 'seats:%s'
+SEATS_CACHE_SECONDS = 60
+
+
+def shardKeys(conf_key):
+    """Return the SeatShard keys of a Conference."""
+    prefix = conf_key.urlsafe()
+    return [ndb.Key(SeatShard, '%s-%d' % (prefix, i))
+        for i in range(SEAT_SHARDS)]
+
+
+def _allotments(seats):
+    """Split seats as evenly as possible across SEAT_SHARDS shards."""
+    base, extra = divmod(max(seats, 0), SEAT_SHARDS)
+    return [base + (1 if i < extra else 0) for i in range(SEAT_SHARDS)]
+
+
+def _cacheKey(conf_key):
+    return MEMCACHE_SEATS_KEY % conf_key.urlsafe()
+
+
+def createShards(conf_key, seats):
+    """Create the seat shards for a new Conference with seats seats."""
+    shards = [SeatShard(key=key, allotment=n, seatsAvailable=n)
+        for key, n in zip(shardKeys(conf_key), _allotments(seats))]
+    ndb.put_multi(shards)
+    memcache.set(_cacheKey(conf_key), max(seats, 0),
+        time=SEATS_CACHE_SECONDS)
+    return shards
+
+
+def getShards(conf):
+    """Return the seat shards of conf.
+
+    Conferences created before seats were sharded get their shards created
+    here: maxAttendees is split into allotments, and the seats attendees
+    already hold (maxAttendees - seatsAvailable) count as taken. Shard
+    creation is idempotent (get_or_insert with deterministic allotments).
+    """
+    return getShardsAsync(conf).get_result()
+
+
+@ndb.tasklet
+def getShardsAsync(conf):
+    """Tasklet version of getShards."""
+    keys = shardKeys(conf.key)
+    shards = yield ndb.get_multi_async(keys)
+    if None in shards:
+        seats = max(conf.seatsAvailable or 0, 0)
+        # both are split the same way, so no shard has more seats available
+        # than its allotment
+        allotments = _allotments(max(conf.maxAttendees or 0, seats))
+        available = _allotments(seats)
+        shards = yield [SeatShard.get_or_insert_async(key.id(),
+                allotment=allotments[i], seatsAvailable=available[i])
+            if shard is None else _done(shard)
+            for i, (key, shard) in enumerate(zip(keys, shards))]
+    raise ndb.Return(shards)
+
+
+def _done(result):
+    future = ndb.Future()
+    future.set_result(result)
+    return future
+
+
+def candidateShards(conf, claim=True):
+    """Return, in random order, keys of the shards able to give up a seat
+    (claim=True) or to take one back (claim=False)."""
+    return candidateShardsAsync(conf, claim).get_result()
+
+
+@ndb.tasklet
+def candidateShardsAsync(conf, claim=True):
+    """Tasklet version of candidateShards."""
+    shards = yield getShardsAsync(conf)
+    if claim:
+        keys = [shard.key for shard in shards if shard.seatsAvailable > 0]
+    else:
+        keys = [shard.key for shard in shards
+            if shard.seatsAvailable < shard.allotment]
+    random.shuffle(keys)
+    raise ndb.Return(keys)
+
+
+def adjustShard(shard, delta, grow=False):
+    """Apply delta to shard's available seats.
+
+    Returns False, leaving shard untouched, if the shard cannot absorb the
+    change. With grow, seats given back beyond the shard's allotment grow
+    the allotment instead: they were held by attendees no shard accounted
+    for. Callers read and put shard in their own transaction.
+    """
+    seats = shard.seatsAvailable + delta
+    if seats < 0 or (seats > shard.allotment and not grow):
+        return False
+    shard.seatsAvailable = seats
+    shard.allotment = max(shard.allotment, seats)
+    return True
+
+
+def anyShardKey(conf_key):
+    """Return the key of a random shard of the Conference at conf_key, to
+    give a seat back to (with grow) when no shard has room for it."""
+    return random.choice(shardKeys(conf_key))
+
+
+@ndb.transactional_tasklet()
+def _adjustShardAsync(shard_key, delta, grow=False):
+    shard = yield shard_key.get_async()
+    if not shard or not adjustShard(shard, delta, grow):
+        raise ndb.Return(False)
+    yield shard.put_async()
+    raise ndb.Return(True)
+
+
+@ndb.tasklet
+def moveSeatAsync(conf, delta):
+    """Take one seat from (delta=-1) or give one back to (delta=1) one of
+    conf's shards, in a transaction on that shard alone; return the shard's
+    key, or None if no shard could.
+
+    Callers that record the seat in another entity group do so in a
+    transaction of their own, and give the seat back if that fails. A seat
+    given back when no shard has room for it grows a shard's allotment.
+    """
+    for shard_key in (yield candidateShardsAsync(conf, claim=delta < 0)):
+        if (yield _adjustShardAsync(shard_key, delta)):
+            raise ndb.Return(shard_key)
+    if delta > 0:
+        shard_key = anyShardKey(conf.key)
+        if (yield _adjustShardAsync(shard_key, delta, grow=True)):
+            raise ndb.Return(shard_key)
+    raise ndb.Return(None)
+
+
+def cachedSeatsAvailable(conf_key):
+    """Return the cached aggregate of the Conference at conf_key, or None
+    if it is not cached."""
+    return memcache.get(_cacheKey(conf_key))
+
+
+def adjustCachedSeats(conf_key, delta):
+    """Apply delta to the cached aggregate, if it is cached; return the new
+    aggregate, or None if it was not cached."""
+    if delta < 0:
+        return memcache.decr(_cacheKey(conf_key), -delta)
+    return memcache.incr(_cacheKey(conf_key), delta)
+
+
+@ndb.transactional()
+def _resizeShard(shard_key, delta):
+    shard = shard_key.get()
+    if delta < 0:
+        # only unclaimed seats can be taken away
+        delta = -min(-delta, shard.seatsAvailable)
+    shard.allotment += delta
+    shard.seatsAvailable += delta
+    shard.put()
+    return delta
+
+
+@ndb.transactional()
+def _storeSeats(conf_key, seats):
+    conf = conf_key.get()
+    if conf and conf.seatsAvailable != seats:
+        conf.seatsAvailable = seats
+        conf.put()
+
+
+def addSeats(conf, delta):
+    """Grow conf's capacity by delta seats, or shrink it by as many unclaimed
+    seats as possible when delta is negative. Returns the applied change.
+
+    The Conference's seatsAvailable is set to the resized shards' total, so
+    it stays in step with the new capacity.
+    """
+    sign = 1 if delta > 0 else -1
+    applied = 0
+    for shard, n in zip(getShards(conf), _allotments(abs(delta))):
+        if n:
+            applied += _resizeShard(shard.key, sign * n)
+    memcache.delete(_cacheKey(conf.key))
+    seats = sum(shard.seatsAvailable for shard in
+        ndb.get_multi(shardKeys(conf.key)))
+    _storeSeats(conf.key, seats)
+    conf.seatsAvailable = seats
+    return applied
+
+
+def seatsAvailable(conferences):
+    """Return dict of Conference key -> aggregate seats available.
+
+    Aggregates are read from memcache; misses are computed from one batch
+    get of all the missing conferences' shards and cached.
+    """
+    return seatsAvailableAsync(conferences).get_result()
+
+
+@ndb.tasklet
+def seatsAvailableAsync(conferences):
+    """Tasklet version of seatsAvailable."""
+    ctx = ndb.get_context()
+    by_cache_key = dict((_cacheKey(conf.key), conf) for conf in conferences)
+    cache_keys = by_cache_key.keys()
+    cached = yield [ctx.memcache_get(cache_key) for cache_key in cache_keys]
+    seats = {}
+    missing = []
+    for cache_key, value in zip(cache_keys, cached):
+        conf = by_cache_key[cache_key]
+        if value is not None:
+            seats[conf.key] = value
+        else:
+            missing.append((cache_key, conf))
+
+    if missing:
+        shards = yield ndb.get_multi_async(
+            [key for _, conf in missing for key in shardKeys(conf.key)])
+        totals = _totals(missing, shards)
+        for cache_key, conf in missing:
+            seats[conf.key] = totals[cache_key]
+        yield [ctx.memcache_add(cache_key, total, time=SEATS_CACHE_SECONDS)
+            for cache_key, total in totals.iteritems()]
+    raise ndb.Return(seats)
+
+
+def _totals(missing, shards):
+    """Return dict of cache key -> seats available for the (cache key,
+    Conference) pairs in missing, computed from their shards."""
+    totals = {}
+    for i, (cache_key, conf) in enumerate(missing):
+        group = shards[i * SEAT_SHARDS:(i + 1) * SEAT_SHARDS]
+        # shards not created yet hold their share of conf.seatsAvailable
+        allotments = _allotments(conf.seatsAvailable or 0)
+        totals[cache_key] = sum(shard.seatsAvailable if shard
+            else allotments[j] for j, shard in enumerate(group))
+    return totals
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+"""emails.py
+
+Udacity conference server-side Python App Engine confirmation email digests
+
+Conference confirmations are added to the EMAIL_QUEUE pull queue, tagged
+with the recipient. A cron job leases them one recipient at a time (by
+tag), folds each recipient's confirmations into one digest email and sends
+at most MAX_DIGESTS_PER_RUN digests per run, so bulk imports neither flood
+a push queue nor the mail API. Only the tasks a run sends are leased, so
+every lease counts toward queue.yaml's task_retry_limit as a real attempt.
+
+The queue and mailer are injectable; LocalQueue and LocalMailer are
+in-memory stand-ins for running the pipeline outside App Engine.
+
+"""
+
+import json
+import logging
+import time
+
+from google.appengine.api import app_identity
+from google.appengine.api import mail
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+
+EMAIL_QUEUE = 'confirmation-emails'
+LEASE_SECONDS = 60
+LEASE_BATCH_SIZE = 1000
+MAX_DIGESTS_PER_RUN = 100
+MEMCACHE_DIGEST_STATS_KEY = 'email_digest_stats'
+
+
+def enqueueConfirmation(email, conf, queue=None):
+    """Queue a confirmation email to email for the ConferenceForm conf."""
+    payload = json.dumps({
+        'name': conf.name,
+        'city': conf.city,
+        'startDate': conf.startDate,
+        'endDate': conf.endDate,
+        'maxAttendees': conf.maxAttendees,
+    })
+    queue = queue or taskqueue.Queue(EMAIL_QUEUE)
+    queue.add(taskqueue.Task(payload=payload, method='PULL', tag=email))
+
+
+def formatDigest(conferences):
+    """Return (subject, body) of a digest confirming conferences, a list of
+    payload dicts."""
+    if len(conferences) == 1:
+        subject = 'You created a new Conference!'
+    else:
+        subject = 'You created %d new Conferences!' % len(conferences)
+    lines = []
+    for conf in conferences:
+        lines.append('%s' % conf['name'])
+        for field in ('city', 'startDate', 'endDate', 'maxAttendees'):
+            if conf.get(field):
+                lines.append('    %s: %s' % (field, conf[field]))
+    body = ('Hi, you have created the following conference%s:\r\n\r\n%s' %
+        ('' if len(conferences) == 1 else 's', '\r\n'.join(lines)))
+    return subject, body
+
+
+class DigestSender(object):
+    """DigestSender -- leases queued confirmations and sends them as one
+    digest per recipient.
+
+    Each lease takes the tasks of one recipient, up to the per-run limit
+    of digests; recipients beyond it are not leased at all and wait for
+    the next run. A recipient's tasks are deleted only once their digest
+    is sent; tasks of failed sends are retried when their lease expires.
+    """
+
+    def __init__(self, queue=None, mailer=None, sender=None,
+            lease_seconds=LEASE_SECONDS, batch_size=LEASE_BATCH_SIZE,
+            max_digests=MAX_DIGESTS_PER_RUN):
+        self.queue = queue or taskqueue.Queue(EMAIL_QUEUE)
+        self.mailer = mailer or mail
+        self.sender = sender
+        self.lease_seconds = lease_seconds
+        self.batch_size = batch_size
+        self.max_digests = max_digests
+
+
+    def _sender(self):
+        if not self.sender:
+            self.sender = 'noreply@%s.appspotmail.com' % (
+                app_identity.get_application_id())
+        return self.sender
+
+
+    def run(self):
+        """Lease and send digests until the queue is empty or the per-run
+        limits are reached; return the run's metrics."""
+        started = time.time()
+        stats = {'leased': 0, 'sent': 0, 'digests': 0, 'failed': 0}
+        # failed sends count toward the limit too: it bounds the mail API
+        # calls of a run
+        for _ in range(self.max_digests):
+            # the tasks of the recipient whose oldest task is due first
+            tasks = self.queue.lease_tasks_by_tag(self.lease_seconds,
+                self.batch_size)
+            if not tasks:
+                break
+            stats['leased'] += len(tasks)
+            self._sendDigest(tasks, stats)
+
+        stats['seconds'] = time.time() - started
+        stats['throughput'] = stats['sent'] / max(stats['seconds'], 0.001)
+        stats['backlog'] = self.queue.fetch_statistics().tasks
+        logging.info('email digests: %s', stats)
+        memcache.set(MEMCACHE_DIGEST_STATS_KEY, stats)
+        return stats
+
+
+    def _sendDigest(self, tasks, stats):
+        """Send the digest of one recipient's leased tasks."""
+        recipient = tasks[0].tag
+        subject, body = formatDigest(
+            [json.loads(task.payload) for task in tasks])
+        try:
+            self.mailer.send_mail(self._sender(), recipient, subject, body)
+        except Exception:
+            logging.exception('digest to %s failed', recipient)
+            stats['failed'] += len(tasks)
+            return
+        self.queue.delete_tasks(tasks)
+        stats['digests'] += 1
+        stats['sent'] += len(tasks)
+
+
+class LocalTask(object):
+    """LocalTask -- a pull task held by LocalQueue"""
+
+    def __init__(self, payload, tag=None, name=None):
+        self.payload = payload
+        self.tag = tag
+        self.name = name
+        self.eta = 0
+        self.retry_count = 0
+
+
+class LocalQueue(object):
+    """LocalQueue -- in-memory stand-in for a taskqueue pull queue; like
+    queue.yaml's task_retry_limit, retry_limit drops tasks leased more
+    than that many times after the first"""
+
+    class _Statistics(object):
+        def __init__(self, tasks):
+            self.tasks = tasks
+
+    def __init__(self, clock=time.time, retry_limit=None):
+        self.clock = clock
+        self.retry_limit = retry_limit
+        self.tasks = []
+        self._added = 0
+
+    def add(self, task):
+        self._added += 1
+        self.tasks.append(LocalTask(task.payload, tag=task.tag,
+            name='task%d' % self._added))
+
+    def lease_tasks_by_tag(self, lease_seconds, max_tasks, tag=None):
+        now = self.clock()
+        if self.retry_limit is not None:
+            self.tasks = [task for task in self.tasks
+                if task.eta > now or task.retry_count <= self.retry_limit]
+        available = sorted((task for task in self.tasks if task.eta <= now),
+            key=lambda task: task.eta)
+        if tag is None and available:
+            # like the taskqueue API: the tag of the first task due
+            tag = available[0].tag
+        leased = [task for task in available if task.tag == tag][:max_tasks]
+        for task in leased:
+            task.eta = now + lease_seconds
+            task.retry_count += 1
+        return leased
+
+    def delete_tasks(self, tasks):
+        names = set(task.name for task in tasks)
+        self.tasks = [task for task in self.tasks if task.name not in names]
+
+    def fetch_statistics(self):
+        return self._Statistics(len(self.tasks))
+
+
+class LocalMailer(object):
+    """LocalMailer -- in-memory stand-in for the mail API"""
+
+    def __init__(self):
+        self.sent = []
+
+    def send_mail(self, sender, to, subject, body):
+        self.sent.append((sender, to, subject, body))
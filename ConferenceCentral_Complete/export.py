@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+"""export.py
+
+Udacity conference server-side Python App Engine bulk data export
+
+An ExportJob walks EXPORT_KINDS one kind after the other with query
+cursors. Each run of the /tasks/export task exports one batch of
+EXPORT_BATCH_SIZE entities as one JSONL or CSV chunk and chains the next
+task, so a job's memory use and task duration do not depend on the size
+of the dataset.
+
+A chunk's name depends only on the job, the kind and the chunk number,
+and the job only advances after its chunk is written. A batch that fails
+is retried by the task queue from the same cursor and rewrites the same
+chunk, so a job resumes where it stopped. The job advances in a
+transaction that checks it is still where the batch started, and each
+batch's task is named after that position (taskName), so a task that runs
+twice or is queued twice neither skips nor repeats a batch.
+
+Chunks are written to a LocalFileSink below EXPORT_ROOT, which is only
+writable on the development server; elsewhere a job needs a sink passed in
+(e.g. one writing to a blob store bucket) and startJob fails without one.
+
+"""
+
+import csv
+import datetime
+import json
+import os
+import StringIO
+
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import ExportJob
+from models import Profile
+from models import Registration
+from models import Session
+from settings import EXPORT_ROOT
+
+EXPORT_BATCH_SIZE = 500
+EXPORT_FORMATS = ('jsonl', 'csv')
+EXPORT_KINDS = (Conference, Session, Profile, Registration)
+_MODELS = dict((model._get_kind(), model) for model in EXPORT_KINDS)
+
+
+class LocalFileSink(object):
+    """LocalFileSink -- writes export chunks below a local directory, as a
+    stand-in for a blob store bucket"""
+
+    def __init__(self, root=EXPORT_ROOT):
+        self.root = root
+
+    def write(self, name, data):
+        path = os.path.join(self.root, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        # write then rename, so a chunk is never seen half written
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.rename(path + '.tmp', path)
+
+
+def _value(value):
+    """Return value as a JSON/CSV friendly value."""
+    if isinstance(value, list):
+        return [_value(v) for v in value]
+    if isinstance(value, ndb.Key):
+        return value.urlsafe()
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+def _columns(model):
+    return ['websafeKey'] + sorted(model._properties)
+
+
+def entityToRow(entity):
+    """Return dict of column -> value for entity."""
+    row = {'websafeKey': entity.key.urlsafe()}
+    for name in entity._properties:
+        row[name] = _value(getattr(entity, name))
+    return row
+
+
+def renderChunk(model, entities, fmt):
+    """Return entities of model rendered as one fmt chunk."""
+    out = StringIO.StringIO()
+    if fmt == 'jsonl':
+        for entity in entities:
+            out.write(json.dumps(entityToRow(entity), sort_keys=True))
+            out.write('\n')
+    else:
+        columns = _columns(model)
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        for entity in entities:
+            row = entityToRow(entity)
+            writer.writerow([_csvCell(row.get(column))
+                for column in columns])
+    return out.getvalue()
+
+
+def _csvCell(value):
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        return json.dumps(value)
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def chunkName(job, kind, chunk):
+    return 'export-%d/%s-%05d.%s' % (job.key.id(), kind, chunk, job.format)
+
+
+def taskName(job):
+    """Return the name of the task exporting job's next batch."""
+    return 'export-%d-%d-%d' % (job.key.id(), job.kindIndex, job.chunk)
+
+
+def defaultSink():
+    """Return a LocalFileSink on the development server; raise
+    RuntimeError elsewhere, where EXPORT_ROOT is not writable."""
+    if not os.environ.get('SERVER_SOFTWARE', '').startswith('Development'):
+        raise RuntimeError('No export sink: %s is only writable on the '
+            'development server' % EXPORT_ROOT)
+    return LocalFileSink()
+
+
+def startJob(fmt, sink=None):
+    """Create and return a new ExportJob writing fmt chunks."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError('Unknown export format: %s' % fmt)
+    if sink is None:
+        # fail now rather than in the job's first task
+        defaultSink()
+    job = ExportJob(format=fmt, kinds=[model._get_kind()
+        for model in EXPORT_KINDS])
+    job.put()
+    return job
+
+
+def _position(job):
+    return job.status, job.kindIndex, job.chunk, job.cursor
+
+
+@ndb.transactional()
+def _advance(job, start):
+    """Store job if the stored job is still at position start; return the
+    stored job."""
+    stored = job.key.get()
+    if _position(stored) != start:
+        return stored
+    job.put()
+    return job
+
+
+@ndb.transactional()
+def recordError(job_key, error):
+    job = job_key.get()
+    if job:
+        job.error = error
+        job.put()
+
+
+def runBatch(job, sink=None, batch_size=EXPORT_BATCH_SIZE):
+    """Export the next batch of job and advance it; return the job as
+    stored afterwards, which is already past the batch if another task ran
+    it first."""
+    if job.status != 'running':
+        return job
+    start = _position(job)
+    kind = job.kinds[job.kindIndex]
+    model = _MODELS[kind]
+    cursor = ndb.Cursor(urlsafe=job.cursor) if job.cursor else None
+    entities, next_cursor, more = model.query().fetch_page(batch_size,
+        start_cursor=cursor)
+
+    if entities:
+        (sink or defaultSink()).write(chunkName(job, kind, job.chunk),
+            renderChunk(model, entities, job.format))
+        job.chunk += 1
+        job.rowCount += len(entities)
+
+    if more and next_cursor:
+        job.cursor = next_cursor.urlsafe()
+    else:
+        # on to the next kind
+        job.kindIndex += 1
+        job.cursor = None
+        job.chunk = 0
+        if job.kindIndex >= len(job.kinds):
+            job.status = 'done'
+    job.error = None
+    return _advance(job, start)
@@ -1,13 +1,27 @@
 #!/usr/bin/env python
+import json
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
 from conference import ConferenceApi
+from conference import MEMCACHE_FEATURED_SPEAKER_KEY
+from conference import MEMCACHE_PROFILE_KEY
+from emails import DigestSender
+import export
+import rpcstats
+import search
 from google.appengine.api import app_identity
 from google.appengine.api import mail
 from google.appengine.api import memcache
+from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
+from models import Conference
+from models import ConferenceSessionSummary
+from models import ExportJob
+from models import Profile
 from models import Session
+from models import SpeakerSessions
+from utils import parseDurationMinutes
 
 # Handlers for taskqueues
 
@@ -24,28 +38,252 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
                 'conferenceInfo')
         )
 
-class SetAnnouncementHandler(webapp2.RequestHandler):
+# Send the queued confirmation emails as one digest per recipient. Runs from
+# cron; SendConfirmationEmailHandler above only drains push tasks queued
+# before confirmations moved to the pull queue.
+class SendDigestEmailsHandler(webapp2.RequestHandler):
     def get(self):
-        """Set Announcement in Memcache."""       
-        ConferenceApi._cacheAnnouncement()
+        DigestSender().run()
 
 # If the speaker hosts at least one other session in this conference,
-# set them as the new featured speaker. This is called when a new 
-# session is added to the conference.
+# set them as the conference's new featured speaker. This is called when
+# new sessions are added to the conference, with their speakers in order;
+# the last speaker that qualifies wins. The speakers' sessions are read from
+# the conference's speaker index with a single batch get.
 class SetFeaturedSpeaker(webapp2.RequestHandler):  
     def get(self):
-        conf = ndb.Key(urlsafe=self.request.get('websafeConferenceKey'))
-        sessions = Session.query(ancestor=conf)
-        speaker_sessions = sessions.filter(Session.speaker == self.request.get('speaker'))
-        speaker_session_names = [self.request.get('speaker')]
-        for sess in speaker_sessions:
-            speaker_session_names.append(sess.name)
-        if len(speaker_session_names) > 2:
-            memcache.set(key='featured_speaker_sessions', value=speaker_session_names)
+        wsck = self.request.get('websafeConferenceKey')
+        conf = ndb.Key(urlsafe=wsck)
+        speakers = self.request.get_all('speaker')
+        entries = ndb.get_multi([SpeakerSessions.makeKey(conf, speaker)
+            for speaker in speakers])
+        for speaker, speaker_sessions in reversed(zip(speakers, entries)):
+            if speaker_sessions and speaker_sessions.sessionCount > 1:
+                memcache.set(key=MEMCACHE_FEATURED_SPEAKER_KEY % conf.urlsafe(),
+                    value=[speaker] + speaker_sessions.sessionNames)
+                break
+
+# (Re-)index conferences or sessions for full-text search after they are
+# written. Enqueued by search.queueIndex.
+class IndexDocumentsHandler(webapp2.RequestHandler):
+    def post(self):
+        search.indexDocuments(self.request.get('kind'),
+            [ndb.Key(urlsafe=key) for key in self.request.get_all('key')])
+
+# Mixin for data migration handlers: each task migrates one batch of entities
+# and chains a task for the next batch with the query cursor, so a migration
+# of any size stays within the task deadline. Re-running a batch must be safe.
+# Handlers derive from it and webapp2.RequestHandler, and define query()
+# (the query whose entities are migrated) and migrate(entities).
+class BatchMigration(object):
+    batch_size = 100
+
+    def post(self):
+        cursor = self.request.get('cursor')
+        start_cursor = ndb.Cursor(urlsafe=cursor) if cursor else None
+        entities, next_cursor, more = self.query().fetch_page(
+            self.batch_size, start_cursor=start_cursor)
+        self.migrate(entities)
+        if more and next_cursor:
+            taskqueue.add(url=self.request.path,
+                params={'cursor': next_cursor.urlsafe()})
+
+    def get(self):
+        """Start the migration (e.g. from a browser, as admin)."""
+        self.post()
+
+# Reconcile the nearly sold out set with the conferences' seat counts and
+# set the Announcement in memcache. Runs from cron; the conferences are
+# checked a batch per task, so the run stays within the deadline however
+# many there are.
+class SetAnnouncementHandler(BatchMigration, webapp2.RequestHandler):
+    batch_size = 50
+
+    def query(self):
+        return Conference.query()
+
+    def migrate(self, conferences):
+        if not self.request.get('cursor'):
+            # first batch of the run
+            ConferenceApi._dropDeletedNearlySoldOut()
+        ConferenceApi._reconcileNearlySoldOut(conferences)
+        ConferenceApi._cacheAnnouncement()
+
+# Move the registrations and wishlists stored on Profile entities into
+# Registration and WishlistEntry entities. Each profile is migrated in its
+# own transaction, concurrently; ConferenceApi also migrates a profile the
+# first time it is used, so the two never overwrite each other's writes.
+class BackfillRegistrationsHandler(BatchMigration, webapp2.RequestHandler):
+    def query(self):
+        return Profile.query()
+
+    def migrate(self, profiles):
+        migrated = [prof for prof in profiles
+            if ConferenceApi._hasLegacyLists(prof)]
+        futures = [ConferenceApi._migrateLegacyListsAsync(prof.key)
+            for prof in migrated]
+        for future in futures:
+            # raise if any failed, so the task queue retries the batch
+            future.check_success()
+        memcache.delete_multi([MEMCACHE_PROFILE_KEY % prof.key.id()
+            for prof in migrated])
+
+# Build the speaker index and session summary of conferences whose sessions
+# predate them. Each conference's are rebuilt from its sessions in one
+# transaction.
+class BackfillSpeakerIndexHandler(BatchMigration, webapp2.RequestHandler):
+    batch_size = 20
+
+    def query(self):
+        return Conference.query()
+
+    def migrate(self, conferences):
+        for conf in conferences:
+            self.rebuild(conf.key)
+
+    @staticmethod
+    @ndb.transactional()
+    def rebuild(conf_key):
+        speakers = {}
+        summary = ConferenceSessionSummary(
+            key=ConferenceSessionSummary.makeKey(conf_key))
+        for sess in Session.query(ancestor=conf_key):
+            summary.addSession(sess)
+            if sess.speaker:
+                ss_key = SpeakerSessions.makeKey(conf_key, sess.speaker)
+                speaker = speakers.setdefault(sess.speaker,
+                    SpeakerSessions(key=ss_key))
+                speaker.sessionCount += 1
+                speaker.sessionNames.append(sess.name)
+        summary.speakerCount = len(speakers)
+        ndb.put_multi(speakers.values() + [summary])
+
+# Store the free-form duration of sessions created before durationMinutes
+# existed in minutes, so range searches find them.
+class BackfillSessionDurationsHandler(BatchMigration,
+        webapp2.RequestHandler):
+    def query(self):
+        return Session.query()
+
+    def migrate(self, sessions):
+        migrated = []
+        for sess in sessions:
+            if sess.durationMinutes is None and sess.duration:
+                sess.durationMinutes = parseDurationMinutes(sess.duration)
+                if sess.durationMinutes is not None:
+                    migrated.append(sess)
+        ndb.put_multi(migrated)
+
+# Mixin for (re)building the search index of all entities of one model,
+# e.g. those written before it existed; handlers set model.
+class BuildSearchIndex(BatchMigration):
+    model = None
+
+    def query(self):
+        return self.model.query()
+
+    def migrate(self, entities):
+        if entities:
+            search.indexDocuments(self.model._get_kind(),
+                [entity.key for entity in entities])
+
+# Build the search index of conferences.
+class BuildConferenceSearchIndexHandler(BuildSearchIndex,
+        webapp2.RequestHandler):
+    model = Conference
+
+# Build the search index of sessions.
+class BuildSessionSearchIndexHandler(BuildSearchIndex,
+        webapp2.RequestHandler):
+    model = Session
+
+# Export conferences, sessions, profiles and registrations as JSONL or CSV
+# chunks. GET starts a job (?format=jsonl|csv) or, given ?job=<id>, shows it
+# and resumes it if its next task was never queued; each POST exports one
+# batch of the job and chains the next. A batch that raises is retried by
+# the task queue from the job's last cursor.
+class ExportHandler(webapp2.RequestHandler):
+    def get(self):
+        job_id = self.request.get('job')
+        if job_id:
+            job = ExportJob.get_by_id(int(job_id))
+            if not job:
+                self.abort(404)
+        else:
+            try:
+                job = export.startJob(self.request.get('format', 'jsonl'))
+            except ValueError, e:
+                self.abort(400, str(e))
+            except RuntimeError, e:
+                self.abort(501, str(e))
+        self.queueBatch(job)
+        self.response.write('export job %d: %s' % (job.key.id(), job.status))
+
+    def post(self):
+        job = ExportJob.get_by_id(int(self.request.get('job')))
+        if not job:
+            return
+        if self.request.get('batch') != export.taskName(job):
+            # a retry of a batch another task has run; make sure the job's
+            # next batch is queued
+            self.queueBatch(job)
+            return
+        try:
+            job = export.runBatch(job)
+        except Exception, e:
+            export.recordError(job.key, str(e))
+            raise
+        self.queueBatch(job)
+
+    @staticmethod
+    def queueBatch(job):
+        """Queue the task exporting job's next batch, unless it already
+        was: the task's name is unique to the batch."""
+        if job.status != 'running':
+            return
+        try:
+            name = export.taskName(job)
+            taskqueue.add(url='/tasks/export', name=name,
+                params={'job': job.key.id(), 'batch': name})
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            pass
+
+# Admin page with the RPCs each endpoint and handler issued over the last
+# few minutes (?minutes=N, at most rpcstats.MAX_MINUTES), as JSON. Only
+# filled in while settings.RPC_STATS_ENABLED is set.
+class RpcStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        try:
+            minutes = int(self.request.get('minutes') or
+                rpcstats.ROLLING_MINUTES)
+        except ValueError:
+            self.abort(400, 'minutes must be a whole number')
+        if minutes < 1:
+            self.abort(400, 'minutes must be positive')
+        minutes = min(minutes, rpcstats.MAX_MINUTES)
+        endpoints = set(rpcstats.knownEndpoints())
+        endpoints.update(path for path, _ in routes)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({
+            'enabled': rpcstats.enabled(),
+            'minutes': minutes,
+            'endpoints': rpcstats.recentStats(sorted(endpoints), minutes),
+        }, indent=2, sort_keys=True))
 
 # Set URL's for each handler
-app = webapp2.WSGIApplication([
+routes = [
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/send_digest_emails', SendDigestEmailsHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
     ('/tasks/set_featured_speaker', SetFeaturedSpeaker),
-], debug=True)
\ No newline at end of file
+    ('/tasks/backfill_registrations', BackfillRegistrationsHandler),
+    ('/tasks/backfill_speaker_index', BackfillSpeakerIndexHandler),
+    ('/tasks/backfill_session_durations', BackfillSessionDurationsHandler),
+    ('/tasks/index_documents', IndexDocumentsHandler),
+    ('/tasks/build_conference_search_index', BuildConferenceSearchIndexHandler),
+    ('/tasks/build_session_search_index', BuildSessionSearchIndexHandler),
+    ('/tasks/export', ExportHandler),
+    ('/admin/rpcstats', RpcStatsHandler),
+]
+app = rpcstats.wrap(webapp2.WSGIApplication(routes, debug=True))
\ No newline at end of file
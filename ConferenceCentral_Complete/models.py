@@ -20,11 +20,39 @@ from google.appengine.ext import ndb
 
 class Profile(ndb.Model):
     """Profile -- User profile object"""
+    # cached by ConferenceApi with version checks instead of by ndb
+    _use_memcache = False
+
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
+    # legacy lists, moved to Registration/WishlistEntry by the backfill task
     conferenceKeysToAttend = ndb.StringProperty(repeated=True)
     sessionWishList = ndb.StringProperty(repeated=True)
+    version = ndb.IntegerProperty(default=0, indexed=False)
+
+    def _pre_put_hook(self):
+        self.version = (self.version or 0) + 1
+
+
+class Registration(ndb.Model):
+    """Registration -- Profile's registration for a Conference; child of the
+    Profile, keyed by websafe Conference key"""
+    conferenceKey = ndb.KeyProperty(kind='Conference')
+
+    @classmethod
+    def makeKey(cls, p_key, websafeConferenceKey):
+        return ndb.Key(cls, websafeConferenceKey, parent=p_key)
+
+
+class WishlistEntry(ndb.Model):
+    """WishlistEntry -- Session on a Profile's wishlist; child of the
+    Profile, keyed by websafe Session key"""
+    sessionKey = ndb.KeyProperty(kind='Session')
+
+    @classmethod
+    def makeKey(cls, p_key, websafeSessionKey):
+        return ndb.Key(cls, websafeSessionKey, parent=p_key)
 
 
 class ProfileMiniForm(messages.Message):
@@ -72,7 +100,60 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
-    
+
+
+class SeatShard(ndb.Model):
+    """SeatShard -- one shard of a Conference's seat counter"""
+    allotment       = ndb.IntegerProperty(default=0, indexed=False)
+    seatsAvailable  = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class SearchDocument(ndb.Model):
+    """SearchDocument -- terms an entity is indexed under for full-text
+    search, keyed by '<kind>|<websafe key>'"""
+    terms           = ndb.StringProperty(repeated=True, indexed=False)
+
+
+class PostingList(ndb.Model):
+    """PostingList -- one shard of a search term's posting list, keyed by
+    '<kind>|<term>|<shard>'; postings beyond the first chunk are held by
+    child PostingLists keyed by chunk number 1..chunks-1"""
+    keys            = ndb.StringProperty(repeated=True, indexed=False)
+    chunks          = ndb.IntegerProperty(default=1, indexed=False)
+
+
+class ExportJob(ndb.Model):
+    """ExportJob -- progress of a bulk data export (see export.py)"""
+    format          = ndb.StringProperty(indexed=False)
+    kinds           = ndb.StringProperty(repeated=True, indexed=False)
+    kindIndex       = ndb.IntegerProperty(default=0, indexed=False)
+    cursor          = ndb.StringProperty(indexed=False)
+    chunk           = ndb.IntegerProperty(default=0, indexed=False)
+    rowCount        = ndb.IntegerProperty(default=0, indexed=False)
+    status          = ndb.StringProperty(default='running')
+    error           = ndb.TextProperty()
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+    updated         = ndb.DateTimeProperty(auto_now=True)
+
+
+class NearlySoldOut(ndb.Model):
+    """NearlySoldOut -- member of the set of nearly sold out Conferences,
+    keyed by websafe Conference key"""
+    name            = ndb.StringProperty(indexed=False)
+
+
+class TypeCountForm(messages.Message):
+    """TypeCountForm -- number of Sessions of one typeOfSession"""
+    typeOfSession   = messages.StringField(1)
+    count           = messages.IntegerField(2)
+
+class SessionSummaryForm(messages.Message):
+    """SessionSummaryForm -- outbound summary of a Conference's Sessions"""
+    sessionCount    = messages.IntegerField(1)
+    typeCounts      = messages.MessageField(TypeCountForm, 2, repeated=True)
+    speakerCount    = messages.IntegerField(3)
+    firstDate       = messages.StringField(4)
+    lastDate        = messages.StringField(5)
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -88,10 +169,25 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10)
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    sessionSummary  = messages.MessageField(SessionSummaryForm, 13)
+
+class ConferenceSummaryForm(messages.Message):
+    """ConferenceSummaryForm -- compact Conference outbound form message"""
+    name            = messages.StringField(1)
+    city            = messages.StringField(2)
+    startDate       = messages.StringField(3)
+    websafeKey      = messages.StringField(4)
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextCursor = messages.StringField(2)
+    summaries = messages.MessageField(ConferenceSummaryForm, 3, repeated=True)
+
+class ConferenceView(messages.Enum):
+    """ConferenceView -- level of detail of queried Conferences"""
+    FULL = 1
+    SUMMARY = 2
 
 class ConferenceQueryForm(messages.Message):
     """ConferenceQueryForm -- Conference query inbound form message"""
@@ -102,11 +198,28 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    cursor = messages.StringField(3)
+    view = messages.EnumField('ConferenceView', 4)
 
 class BooleanMessage(messages.Message):
     """BooleanMessage -- outbound Boolean value message"""
     data = messages.BooleanField(1)
 
+class WebsafeKeysForm(messages.Message):
+    """WebsafeKeysForm -- multiple websafe keys inbound form message"""
+    keys = messages.StringField(1, repeated=True)
+
+class BatchResultForm(messages.Message):
+    """BatchResultForm -- outbound result for one key of a batch request"""
+    websafeKey = messages.StringField(1)
+    data = messages.BooleanField(2)
+    error = messages.StringField(3)
+
+class BatchResultForms(messages.Message):
+    """BatchResultForms -- multiple BatchResultForm outbound form message"""
+    items = messages.MessageField(BatchResultForm, 1, repeated=True)
+
 class ConflictException(endpoints.ServiceException):
     """ConflictException -- exception mapped to HTTP 409 response"""
     http_status = httplib.CONFLICT
@@ -125,12 +238,48 @@ class Session(ndb.Model):
     highlights    = ndb.StringProperty()
     speaker       = ndb.StringProperty()
     duration      = ndb.StringProperty()
+    durationMinutes = ndb.IntegerProperty()
     typeOfSession = ndb.StringProperty()
     date          = ndb.DateProperty()
     startTime     = ndb.TimeProperty()
     websafeSessionKey = ndb.StringProperty()
     websafeConferenceKey    = ndb.StringProperty()
 
+class SpeakerSessions(ndb.Model):
+    """SpeakerSessions -- a speaker's Sessions in a Conference; child of the
+    Conference, keyed by speaker name"""
+    sessionCount  = ndb.IntegerProperty(default=0)
+    sessionNames  = ndb.StringProperty(repeated=True, indexed=False)
+
+    @classmethod
+    def makeKey(cls, conf_key, speaker):
+        return ndb.Key(cls, speaker, parent=conf_key)
+
+class ConferenceSessionSummary(ndb.Model):
+    """ConferenceSessionSummary -- aggregates of a Conference's Sessions;
+    child of the Conference, updated with every Session write"""
+    sessionCount  = ndb.IntegerProperty(default=0, indexed=False)
+    typeCounts    = ndb.JsonProperty()
+    speakerCount  = ndb.IntegerProperty(default=0, indexed=False)
+    firstDate     = ndb.DateProperty(indexed=False)
+    lastDate      = ndb.DateProperty(indexed=False)
+
+    @classmethod
+    def makeKey(cls, conf_key):
+        return ndb.Key(cls, 'summary', parent=conf_key)
+
+    def addSession(self, sess):
+        """Count sess in the summary (but not its speaker; callers know
+        whether the speaker is new from the SpeakerSessions index)."""
+        self.sessionCount += 1
+        if sess.typeOfSession:
+            counts = dict(self.typeCounts or {})
+            counts[sess.typeOfSession] = counts.get(sess.typeOfSession, 0) + 1
+            self.typeCounts = counts
+        if sess.date:
+            self.firstDate = min(self.firstDate or sess.date, sess.date)
+            self.lastDate = max(self.lastDate or sess.date, sess.date)
+
 class SessionForm(messages.Message):
     """SessionForm -- Session outbound form message"""
     name          = messages.StringField(1)
@@ -142,7 +291,21 @@ class SessionForm(messages.Message):
     startTime     = messages.StringField(7)
     websafeSessionKey = messages.StringField(8)
     websafeConferenceKey    = messages.StringField(9)
+    durationMinutes = messages.IntegerField(10)
+
+class AgendaItemForm(messages.Message):
+    """AgendaItemForm -- a wishlisted Session on the user's agenda"""
+    session         = messages.MessageField(SessionForm, 1)
+    conferenceName  = messages.StringField(2)
+    overlapsWith    = messages.StringField(3, repeated=True)
+
+class AgendaForm(messages.Message):
+    """AgendaForm -- user's attended Conferences and wishlisted Sessions in
+    date/startTime order, with overlapping Sessions flagged"""
+    conferences     = messages.MessageField(ConferenceForm, 1, repeated=True)
+    items           = messages.MessageField(AgendaItemForm, 2, repeated=True)
 
 class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
-    items = messages.MessageField(SessionForm, 1, repeated=True)
\ No newline at end of file
+    items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextCursor = messages.StringField(2)
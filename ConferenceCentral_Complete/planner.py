@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+"""planner.py
+
+Udacity conference server-side Python App Engine query planner
+
+The datastore allows inequality filters on one property per query. The
+planner pushes all equality filters plus the inequality filters on the
+most selective property to the datastore and leaves the rest to be
+evaluated in memory on the streamed results.
+
+Given the indexes defined in index.yaml (see loadIndexes), the planner
+only picks queries one of them (or a built-in index) serves: if the
+preferred query has no index, it drops the projection, then pushes fewer
+filters, until the query left is served.
+
+Filters are dicts with 'field', 'operator' and 'value' keys, as built by
+ConferenceApi._formatFilters.
+
+"""
+
+import itertools
+import operator
+
+from google.appengine.datastore import datastore_index
+
+COMPARATORS = {
+    '=':  operator.eq,
+    '!=': operator.ne,
+    '>':  operator.gt,
+    '>=': operator.ge,
+    '<':  operator.lt,
+    '<=': operator.le,
+}
+
+# expected fraction of entities passing a filter when its field's value
+# range is unknown
+DEFAULT_SELECTIVITY = {
+    '=':  0.1,
+    '!=': 0.9,
+    '>':  1 / 3.0,
+    '>=': 1 / 3.0,
+    '<':  1 / 3.0,
+    '<=': 1 / 3.0,
+}
+
+
+def estimateSelectivity(filtr, domains=None):
+    """Estimate the fraction of entities that pass filtr.
+
+    domains maps a field to the (low, high) range of its values; range
+    filters on those fields are estimated from where the value falls in
+    the range, others use DEFAULT_SELECTIVITY.
+    """
+    op = filtr['operator']
+    domain = (domains or {}).get(filtr['field'])
+    if domain is None or op in ('=', '!='):
+        if domain is not None and op == '=':
+            low, high = domain
+            return 1.0 / max(high - low + 1, 1)
+        return DEFAULT_SELECTIVITY[op]
+    low, high = domain
+    below = (filtr['value'] - low) / float(max(high - low, 1))
+    below = min(max(below, 0.0), 1.0)
+    return below if op in ('<', '<=') else 1.0 - below
+
+
+def matches(entity, filters):
+    """Return True if entity passes every filter; repeated properties pass
+    if any of their values does, as in the datastore. Unset values never
+    pass a range filter."""
+    for filtr in filters:
+        compare = COMPARATORS[filtr['operator']]
+        value = getattr(entity, filtr['field'])
+        if value is None and filtr['operator'] not in ('=', '!='):
+            return False
+        if isinstance(value, list):
+            if not any(compare(v, filtr['value']) for v in value):
+                return False
+        elif not compare(value, filtr['value']):
+            return False
+    return True
+
+
+def loadIndexes(path):
+    """Return the composite indexes defined in the index.yaml at path, as
+    (kind, ancestor, ((property name, direction), ...)) tuples."""
+    with open(path) as f:
+        definitions = datastore_index.ParseIndexDefinitions(f)
+    return [(index.kind, bool(index.ancestor), tuple((prop.name,
+            prop.direction or 'asc') for prop in index.properties or ()))
+        for index in (definitions.indexes or ())]
+
+
+class QueryPlan(object):
+    """QueryPlan -- filters pushed to the datastore and evaluated in memory,
+    and the projection of the query"""
+
+    def __init__(self, kind, pushed, residual, inequality_field, order,
+            ancestor=False, projection=()):
+        self.kind = kind
+        self.pushed = pushed
+        self.residual = residual
+        self.inequality_field = inequality_field
+        self.order = order
+        self.ancestor = ancestor
+        self.projection = tuple(projection)
+
+    def _indexParts(self):
+        """Return the equality, sort order and projected properties of the
+        query's index; only the sort order's sequence matters."""
+        equality = sorted(set(f['field'] for f in self.pushed
+            if f['operator'] == '='))
+        ordered = []
+        for field in ([self.inequality_field] if self.inequality_field
+                else []) + list(self.order):
+            if field not in equality and field not in ordered:
+                ordered.append(field)
+        projected = sorted(set(self.projection) - set(equality) -
+            set(ordered))
+        return equality, ordered, projected
+
+    def requiredIndex(self):
+        """Return the properties of the composite index the pushed query
+        needs, or None if the built-in indexes serve it. Ancestor queries
+        need a composite index for any filter or sort order."""
+        equality, ordered, projected = self._indexParts()
+        properties = equality + ordered + projected
+        if len(properties) < (1 if self.ancestor else 2):
+            return None
+        return properties
+
+    def servedBy(self, indexes):
+        """Return True if the built-in indexes or one of indexes (as
+        returned by loadIndexes) serve the query."""
+        if self.requiredIndex() is None:
+            return True
+        equality, ordered, projected = self._indexParts()
+        n, m = len(equality), len(equality) + len(ordered)
+        for kind, ancestor, properties in indexes:
+            names = [name for name, _ in properties]
+            if (kind == self.kind and ancestor == self.ancestor and
+                    len(names) == m + len(projected) and
+                    sorted(names[:n]) == equality and
+                    list(properties[n:m]) == [(f, 'asc') for f in ordered]
+                    and sorted(names[m:]) == projected):
+                return True
+        return False
+
+    def indexYaml(self):
+        """Return the index.yaml entry for requiredIndex(), or ''."""
+        properties = self.requiredIndex()
+        if not properties:
+            return ''
+        return '- kind: %s\n%s  properties:\n%s' % (self.kind,
+            '  ancestor: yes\n' if self.ancestor else '',
+            ''.join('  - name: %s\n' % name for name in properties))
+
+    def describe(self):
+        """Return a human readable summary of the plan."""
+        def fmt(filters):
+            return ', '.join('%s %s %r' % (f['field'], f['operator'],
+                f['value']) for f in filters) or '(none)'
+        lines = [
+            'datastore filters: %s' % fmt(self.pushed),
+            'in-memory filters: %s' % fmt(self.residual),
+            'order: %s' % ', '.join(([self.inequality_field]
+                if self.inequality_field else []) + list(self.order)),
+            'projection: %s' % (', '.join(self.projection) or '(none)'),
+        ]
+        index = self.indexYaml()
+        lines.append('index:\n%s' % index if index else
+            'index: built-in indexes suffice')
+        return '\n'.join(lines)
+
+
+def _selectivities(filters, domains, equality):
+    """Return dict of field -> combined selectivity of its equality
+    (equality=True) or inequality filters."""
+    selectivity = {}
+    for filtr in filters:
+        if (filtr['operator'] == '=') == equality:
+            selectivity[filtr['field']] = selectivity.get(
+                filtr['field'], 1.0) * estimateSelectivity(filtr, domains)
+    return selectivity
+
+
+def _candidates(filters, domains):
+    """Yield (equality fields, inequality field) pairs to push to the
+    datastore, best first: all equality fields with each inequality field
+    in order of selectivity, then ever smaller sets of equality fields."""
+    equalities = _selectivities(filters, domains, True)
+    inequalities = _selectivities(filters, domains, False)
+    ranked = sorted(sorted(inequalities), key=inequalities.get) + [None]
+    fields = sorted(equalities)
+    subsets = []
+    for size in range(len(fields), -1, -1):
+        subsets.extend(sorted(itertools.combinations(fields, size),
+            key=lambda subset: reduce(operator.mul,
+                (equalities[f] for f in subset), 1.0)))
+    for subset in subsets:
+        for inequality_field in ranked:
+            yield set(subset), inequality_field
+
+
+def plan(kind, filters, domains=None, order=('name',), ancestor=False,
+        projection=(), indexes=None):
+    """Plan a query over kind with filters (within an ancestor if ancestor
+    is True), projected to projection if no filter is left to evaluate in
+    memory.
+
+    All equality filters are pushed to the datastore, as are the inequality
+    filters on the field whose combined selectivity is lowest; the
+    remaining inequality filters become residual in-memory filters. If
+    indexes (see loadIndexes) are given and none of them serves that
+    query, the projection is dropped, then other inequality fields and
+    fewer equality filters are tried, until a served query is found.
+    """
+    first = None
+    for equality, inequality_field in _candidates(filters, domains):
+        pushed = [f for f in filters if f['field'] == inequality_field or
+            (f['operator'] == '=' and f['field'] in equality)]
+        residual = [f for f in filters if f not in pushed]
+        ordered = tuple(field for field in order
+            if field != inequality_field)
+        for fields in ((projection, ()) if projection else ((),)):
+            query_plan = QueryPlan(kind, pushed, residual, inequality_field,
+                ordered, ancestor, () if residual else fields)
+            if indexes is None or query_plan.servedBy(indexes):
+                return query_plan
+            first = first or query_plan
+    return first
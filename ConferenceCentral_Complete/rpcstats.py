@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+"""rpcstats.py
+
+Udacity conference server-side Python App Engine RPC accounting
+
+When settings.RPC_STATS_ENABLED is set, wrap() installs API proxy hooks
+and a WSGI middleware that attribute every RPC -- count, request/response
+bytes and wall time, per service -- to the endpoint being served: the
+name declared in @endpoints.method for API calls, the URL path for
+main.py handlers. At the end of each request the totals are added to
+per-minute memcache counters, which recentStats() rolls up over the last
+ROLLING_MINUTES (at most MAX_MINUTES) minutes for the /admin/rpcstats
+handler.
+
+When disabled, wrap() returns the application unchanged and no hooks are
+installed, so there is no per-RPC cost at all.
+
+"""
+
+import logging
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+
+import settings
+
+MEMCACHE_RPC_STATS_KEY = 'rpcstats:%d:%s:%s:%s'
+ROLLING_MINUTES = 10
+# longest window recentStats() reads; counters are kept this long
+MAX_MINUTES = 60
+BUCKET_SECONDS = 60
+# services reported on their own; others are counted as 'other'
+SERVICES = ('datastore_v3', 'memcache', 'taskqueue', 'urlfetch', 'mail')
+METRICS = ('calls', 'bytes', 'us')
+SPI_PREFIX = '/_ah/spi/'
+
+_local = threading.local()
+_endpoints = {}
+_paths = set()
+_installed = []
+
+
+def enabled():
+    return getattr(settings, 'RPC_STATS_ENABLED', False)
+
+
+def _service(service):
+    return service if service in SERVICES else 'other'
+
+
+def _preCall(service, call, request, response):
+    totals = getattr(_local, 'totals', None)
+    if totals is not None:
+        _local.started[id(request)] = time.time()
+
+
+def _postCall(service, call, request, response):
+    totals = getattr(_local, 'totals', None)
+    if totals is None:
+        return
+    started = _local.started.pop(id(request), None)
+    stats = totals.setdefault(_service(service), [0, 0, 0])
+    stats[0] += 1
+    try:
+        stats[1] += request.ByteSize() + response.ByteSize()
+    except AttributeError:
+        pass
+    if started is not None:
+        stats[2] += int((time.time() - started) * 1e6)
+
+
+def requestCalls(service):
+    """Return the number of service RPCs the current request has issued so
+    far, or None if accounting is disabled."""
+    totals = getattr(_local, 'totals', None)
+    if totals is None:
+        return None
+    return totals.get(_service(service), (0,))[0]
+
+
+def _install():
+    if not _installed:
+        apiproxy = apiproxy_stub_map.apiproxy
+        apiproxy.GetPreCallHooks().Append('rpcstats', _preCall)
+        apiproxy.GetPostCallHooks().Append('rpcstats', _postCall)
+        _installed.append(apiproxy)
+
+
+def _endpointName(path):
+    """Return the name requests to path are accounted under."""
+    if path.startswith(SPI_PREFIX):
+        # /_ah/spi/<Service>.<method>
+        return _endpoints.get(path[len(SPI_PREFIX):], path[len(SPI_PREFIX):])
+    return path
+
+
+def _bucket(now=None):
+    return int((now or time.time()) // BUCKET_SECONDS)
+
+
+def _flush(endpoint, totals):
+    """Add one request's totals to the current minute's counters."""
+    bucket = _bucket()
+    offsets = {MEMCACHE_RPC_STATS_KEY % (bucket, endpoint, '', 'requests'): 1}
+    for service, values in totals.iteritems():
+        for metric, value in zip(METRICS, values):
+            if value:
+                offsets[MEMCACHE_RPC_STATS_KEY % (bucket, endpoint, service,
+                    metric)] = value
+    memcache.offset_multi(offsets, initial_value=0,
+        time=(MAX_MINUTES + 1) * BUCKET_SECONDS)
+
+
+def wrap(app, services=()):
+    """Return app with RPC accounting if it is enabled, else app itself.
+
+    services are the remote.Service classes served by app, whose methods
+    are reported under the names declared in @endpoints.method.
+    """
+    if not enabled():
+        return app
+    _install()
+    for service in services:
+        for py_name, method in service.all_remote_methods().iteritems():
+            info = getattr(method, 'method_info', None)
+            _endpoints['%s.%s' % (service.__name__, py_name)] = \
+                getattr(info, 'name', None) or py_name
+
+    def accounted(environ, start_response):
+        endpoint = _endpointName(environ.get('PATH_INFO', ''))
+        _local.totals = {}
+        _local.started = {}
+        try:
+            return app(environ, start_response)
+        finally:
+            totals = _local.totals
+            # stop accounting before flushing, so the flush isn't counted
+            _local.totals = None
+            _paths.add(endpoint)
+            try:
+                _flush(endpoint, totals)
+            except Exception:
+                # accounting must never fail the request it accounts for
+                logging.exception('rpcstats: could not record %s', endpoint)
+    return accounted
+
+
+def recentStats(endpoints, minutes=ROLLING_MINUTES):
+    """Return dict of endpoint -> rolled up stats over the last minutes.
+
+    Each entry holds the number of requests and, per service, the total
+    and per-request calls, bytes and milliseconds of RPC wall time.
+    minutes is capped at MAX_MINUTES.
+    """
+    minutes = min(minutes, MAX_MINUTES)
+    now = _bucket()
+    keys = []
+    for bucket in range(now - minutes + 1, now + 1):
+        for endpoint in endpoints:
+            keys.append((endpoint, None, 'requests',
+                MEMCACHE_RPC_STATS_KEY % (bucket, endpoint, '', 'requests')))
+            for service in SERVICES + ('other',):
+                for metric in METRICS:
+                    keys.append((endpoint, service, metric,
+                        MEMCACHE_RPC_STATS_KEY % (bucket, endpoint, service,
+                        metric)))
+    values = memcache.get_multi([key[-1] for key in keys])
+
+    stats = {}
+    for endpoint, service, metric, key in keys:
+        value = values.get(key)
+        if not value:
+            continue
+        entry = stats.setdefault(endpoint, {'requests': 0, 'services': {}})
+        if service is None:
+            entry['requests'] += value
+        else:
+            totals = entry['services'].setdefault(service,
+                dict((m, 0) for m in METRICS))
+            totals[metric] += value
+
+    for entry in stats.itervalues():
+        requests = max(entry['requests'], 1)
+        for totals in entry['services'].itervalues():
+            totals['ms'] = totals.pop('us') / 1000.0
+            for metric in ('calls', 'bytes', 'ms'):
+                totals['%sPerRequest' % metric] = \
+                    totals[metric] / float(requests)
+    return stats
+
+
+def knownEndpoints():
+    """Return the endpoint names accounting may have recorded."""
+    return sorted(set(_endpoints.values()) | _paths)
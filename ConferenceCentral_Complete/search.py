@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+
+"""search.py
+
+Udacity conference server-side Python App Engine full-text search
+
+Conferences (name, description) and Sessions (name, highlights) are
+tokenized into an inverted index. Each term's posting list -- the websafe
+keys of the documents containing it -- is split across POSTING_SHARDS
+PostingList entity groups by document, so concurrent writes of different
+documents rarely touch the same entity group. Within a shard, postings are
+stored in chunks of at most CHUNK_SIZE keys, which keeps every entity well
+below the datastore's 1MB limit however common the term. Prefixes of each
+token of at least MIN_PREFIX_LENGTH characters are indexed as terms of
+their own ('conf*'), which is how 'conf*' queries are answered without
+scanning; shorter prefixes would be in nearly every document.
+
+A SearchDocument per indexed entity remembers the terms it was indexed
+under, so re-indexing only touches the posting lists that changed.
+
+Indexing runs in the /tasks/index_documents task (see queueIndex); the
+functions here only need the datastore, so they run against the local
+datastore stub as well.
+
+"""
+
+import hashlib
+import re
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import PostingList
+from models import SearchDocument
+
+POSTING_SHARDS = 4
+# websafe keys of postings per PostingList entity (about 100 bytes each)
+CHUNK_SIZE = 2000
+MIN_PREFIX_LENGTH = 3
+MAX_PREFIX_LENGTH = 8
+MAX_RESULTS = 100
+
+# text fields indexed per kind
+SEARCH_FIELDS = {
+    'Conference': ('name', 'description'),
+    'Session': ('name', 'highlights'),
+}
+
+STOPWORDS = frozenset(['a', 'an', 'and', 'at', 'for', 'in', 'of', 'on',
+    'or', 'the', 'to', 'with'])
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """Return the lower-cased word tokens of text, without stopwords."""
+    return [token for token in _TOKEN_RE.findall((text or '').lower())
+        if token not in STOPWORDS]
+
+
+def documentTerms(entity):
+    """Return the set of terms entity is indexed under: its tokens and
+    their prefixes."""
+    terms = set()
+    for field in SEARCH_FIELDS[entity._get_kind()]:
+        for token in tokenize(getattr(entity, field)):
+            terms.add(token)
+            for i in range(MIN_PREFIX_LENGTH,
+                    min(len(token), MAX_PREFIX_LENGTH) + 1):
+                terms.add(token[:i] + '*')
+    return terms
+
+
+def queryTerms(query):
+    """Return the index terms of a search query; a trailing '*' makes a
+    word a prefix term. Prefixes shorter than MIN_PREFIX_LENGTH are not
+    indexed, so they have no term (see matchesQuery)."""
+    terms = []
+    for word in (query or '').lower().split():
+        prefix = word.endswith('*')
+        for token in tokenize(word):
+            if not prefix:
+                terms.append(token)
+            elif len(token) >= MIN_PREFIX_LENGTH:
+                terms.append(token[:MAX_PREFIX_LENGTH] + '*')
+    return terms
+
+
+def matchesQuery(entity, query):
+    """Return True if entity contains every word of query (prefix words
+    longer than MAX_PREFIX_LENGTH or shorter than MIN_PREFIX_LENGTH are
+    only checked here)."""
+    tokens = set()
+    for field in SEARCH_FIELDS[entity._get_kind()]:
+        tokens.update(tokenize(getattr(entity, field)))
+    for word in (query or '').lower().split():
+        prefix = word.endswith('*')
+        for token in tokenize(word):
+            if prefix:
+                if not any(t.startswith(token) for t in tokens):
+                    return False
+            elif token not in tokens:
+                return False
+    return True
+
+
+def _shard(websafe_key):
+    return int(hashlib.md5(websafe_key).hexdigest(), 16) % POSTING_SHARDS
+
+
+def postingKey(kind, term, shard):
+    return ndb.Key(PostingList, '%s|%s|%d' % (kind, term, shard))
+
+
+def postingKeys(kind, term):
+    """Return the keys of all shards of term's posting list."""
+    return [postingKey(kind, term, shard) for shard in range(POSTING_SHARDS)]
+
+
+def chunkKeys(posting):
+    """Return the keys of the chunks of a posting list shard after the
+    first, which posting (the shard's root PostingList) holds itself."""
+    return [ndb.Key(PostingList, i, parent=posting.key)
+        for i in range(1, posting.chunks)]
+
+
+@ndb.transactional_tasklet()
+def _updatePostingAsync(p_key, add, remove):
+    """Add and remove postings in one posting list shard.
+
+    Postings are removed from whichever chunk holds them; new ones fill up
+    the last chunk, then new chunks. Only the chunks that change are
+    written, and empty chunks at the end are dropped.
+    """
+    posting = yield p_key.get_async()
+    if not posting:
+        if not add:
+            return
+        posting = PostingList(key=p_key)
+    c_keys = chunkKeys(posting)
+    chunks = [posting] + [chunk or PostingList(key=key) for key, chunk in
+        zip(c_keys, (yield ndb.get_multi_async(c_keys)))]
+
+    changed = set()
+    present = set()
+    for i, chunk in enumerate(chunks):
+        keys = [key for key in chunk.keys if key not in remove]
+        if len(keys) != len(chunk.keys):
+            chunk.keys = keys
+            changed.add(i)
+        present.update(keys)
+    for key in sorted(add - present):
+        if len(chunks[-1].keys) >= CHUNK_SIZE:
+            chunks.append(PostingList(key=ndb.Key(PostingList, len(chunks),
+                parent=p_key)))
+        chunks[-1].keys.append(key)
+        changed.add(len(chunks) - 1)
+
+    # drop empty chunks at the end
+    dropped = []
+    while len(chunks) > 1 and not chunks[-1].keys:
+        dropped.append(chunks.pop().key)
+        changed.discard(len(chunks))
+    if len(chunks) != posting.chunks:
+        posting.chunks = len(chunks)
+        changed.add(0)
+    if not posting.keys and posting.chunks == 1:
+        # the whole posting list is empty
+        yield ndb.delete_multi_async(dropped + [p_key])
+        return
+    yield (ndb.put_multi_async([chunks[i] for i in sorted(changed)]) +
+        ndb.delete_multi_async(dropped))
+
+
+def indexDocuments(kind, keys):
+    """(Re-)index the entities at keys, all of kind; keys of entities that
+    no longer exist are removed from the index."""
+    entities = ndb.get_multi(keys)
+    sd_keys = [ndb.Key(SearchDocument, '%s|%s' % (kind, key.urlsafe()))
+        for key in keys]
+    documents = ndb.get_multi(sd_keys)
+
+    # collect the postings to add and remove, per posting list shard
+    changes = {}
+    for key, entity, document in zip(keys, entities, documents):
+        websafe_key = key.urlsafe()
+        shard = _shard(websafe_key)
+        new_terms = documentTerms(entity) if entity else set()
+        old_terms = set(document.terms) if document else set()
+        for term in new_terms - old_terms:
+            changes.setdefault(postingKey(kind, term, shard),
+                (set(), set()))[0].add(websafe_key)
+        for term in old_terms - new_terms:
+            changes.setdefault(postingKey(kind, term, shard),
+                (set(), set()))[1].add(websafe_key)
+
+    # each shard is its own entity group; update them concurrently
+    ndb.Future.wait_all([_updatePostingAsync(p_key, add, remove)
+        for p_key, (add, remove) in changes.iteritems()])
+
+    to_put = []
+    to_delete = []
+    for sd_key, entity in zip(sd_keys, entities):
+        if entity:
+            to_put.append(SearchDocument(key=sd_key,
+                terms=sorted(documentTerms(entity))))
+        else:
+            to_delete.append(sd_key)
+    ndb.put_multi(to_put)
+    ndb.delete_multi(to_delete)
+
+
+def queueIndex(keys, transactional=False):
+    """Enqueue (re-)indexing of the entities at keys, all of one kind."""
+    taskqueue.add(url='/tasks/index_documents',
+        params={'kind': keys[0].kind(), 'key': [key.urlsafe() for key in keys]},
+        transactional=transactional)
+
+
+def search(kind, query, limit=MAX_RESULTS):
+    """Return the entities of kind containing every word of query, at
+    most limit of them, in websafe key order.
+
+    The posting lists of all query terms are read in one batch get (plus
+    one for the further chunks of lists that have them) and intersected
+    smallest first; only the matching entities are fetched.
+    """
+    terms = queryTerms(query)
+    if not terms:
+        return []
+    p_keys = [key for term in terms for key in postingKeys(kind, term)]
+    postings = ndb.get_multi(p_keys)
+    c_keys = [key for posting in postings if posting
+        for key in chunkKeys(posting)]
+    chunks = dict(zip(c_keys, ndb.get_multi(c_keys)))
+
+    matches = []
+    for i in range(len(terms)):
+        keys = set()
+        for posting in postings[i * POSTING_SHARDS:(i + 1) * POSTING_SHARDS]:
+            if posting:
+                keys.update(posting.keys)
+                for c_key in chunkKeys(posting):
+                    keys.update(getattr(chunks[c_key], 'keys', ()))
+        matches.append(keys)
+    matches.sort(key=len)
+    result = matches[0]
+    for keys in matches[1:]:
+        if not result:
+            break
+        result = result & keys
+
+    # fetch the candidates a page at a time; nearly all of them match, so
+    # this is usually a single batch get
+    result = sorted(result)
+    found = []
+    for start in range(0, len(result), limit):
+        for entity in ndb.get_multi([ndb.Key(urlsafe=key)
+                for key in result[start:start + limit]]):
+            if entity and matchesQuery(entity, query):
+                found.append(entity)
+                if len(found) >= limit:
+                    return found
+    return found
@@ -14,3 +14,12 @@ created/forked from conference.py by wesc on 2014 may 24
 # Console or Cloud Console.
 WEB_CLIENT_ID = '731253416709-nfu9v26ngjsuu1jhdv4eb1bi2puhtni3.apps.googleusercontent.com'
 
+# OAuth2 tokeninfo endpoint used by utils.getUserId(id_type="oauth"); point
+# it at a local fake to run without leaving the instance.
+TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo'
+
+# directory export.LocalFileSink writes export chunks to
+EXPORT_ROOT = '/tmp/conference-exports'
+
+# attribute RPC counts, bytes and wall time to endpoints (see rpcstats.py)
+RPC_STATS_ENABLED = False
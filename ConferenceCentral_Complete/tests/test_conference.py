@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+
+"""test_conference.py
+
+Udacity conference server-side Python App Engine ConferenceApi tests
+
+"""
+
+from testbase import ConferenceTestCase
+
+import endpoints
+from google.appengine.api import datastore_errors
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+from protorpc import message_types
+
+import conference
+import counters
+import main
+from models import Conference
+from models import ConferenceForm
+from models import NearlySoldOut
+from models import Profile
+from models import ProfileMiniForm
+from models import Registration
+from models import SeatShard
+from models import TeeShirtSize
+from models import WebsafeKeysForm
+
+
+class UpdateConferenceTest(ConferenceTestCase):
+
+    def setUp(self):
+        super(UpdateConferenceTest, self).setUp()
+        self.actAs('owner@example.com')
+        conference.ConferenceApi().createConference(
+            ConferenceForm(name='PyCon', city='London', maxAttendees=10))
+        self.conf = Conference.query().get()
+
+
+    def update(self, **fields):
+        return conference.ConferenceApi().updateConference(
+            conference.CONF_POST_REQUEST.combined_message_class(
+                websafeConferenceKey=self.conf.key.urlsafe(), **fields))
+
+
+    def testOwnerUpdates(self):
+        cf = self.update(city='Paris', maxAttendees=20)
+        self.assertEqual(cf.city, 'Paris')
+        self.assertEqual(cf.seatsAvailable, 20)
+        self.assertEqual(cf.organizerDisplayName, 'owner')
+        self.assertEqual(self.conf.key.get().city, 'Paris')
+
+
+    def testNonOwnerIsForbidden(self):
+        self.actAs('other@example.com')
+        with self.assertRaises(endpoints.ForbiddenException) as raised:
+            self.update(city='Paris')
+        self.assertEqual(raised.exception.http_status, 403)
+        self.assertEqual(self.conf.key.get().city, 'London')
+
+
+    def testUnknownConferenceIsNotFound(self):
+        self.conf.key.delete()
+        with self.assertRaises(endpoints.NotFoundException):
+            self.update(city='Paris')
+
+
+class RegisterBatchTest(ConferenceTestCase):
+
+    def setUp(self):
+        super(RegisterBatchTest, self).setUp()
+        self.actAs('owner@example.com')
+        for name, seats in (('Open', 10), ('Full', 1)):
+            conference.ConferenceApi().createConference(
+                ConferenceForm(name=name, maxAttendees=seats))
+        self.confs = dict((conf.name, conf.key.urlsafe())
+            for conf in Conference.query())
+        self.actAs('first@example.com')
+        self.register([self.confs['Full']])
+        self.actAs('user@example.com')
+
+
+    def register(self, keys):
+        results = conference.ConferenceApi().registerForConferences(
+            WebsafeKeysForm(keys=keys))
+        return dict((item.websafeKey, (item.data, item.error))
+            for item in results.items)
+
+
+    def seats(self, name):
+        return conference.ConferenceApi().getConference(
+            conference.CONF_GET_REQUEST.combined_message_class(
+            websafeConferenceKey=self.confs[name])).seatsAvailable
+
+
+    def testRegistersEachConferenceOnce(self):
+        results = self.register([self.confs['Open'], self.confs['Full'],
+            'malformed', self.confs['Open']])
+        self.assertEqual(results[self.confs['Open']], (True, None))
+        self.assertEqual(results[self.confs['Full']],
+            (False, 'There are no seats available.'))
+        self.assertFalse(results['malformed'][0])
+        self.assertEqual(Registration.query().count(), 2)
+        self.assertEqual(self.seats('Open'), 9)
+        self.assertEqual(self.seats('Full'), 0)
+
+        results = self.register([self.confs['Open']])
+        self.assertEqual(results[self.confs['Open']], (False,
+            'You have already registered for this conference'))
+        self.assertEqual(self.seats('Open'), 9)
+
+
+    def testTimedOutWriteKeepsOnlyWrittenSeats(self):
+        self.actAs('owner@example.com')
+        conference.ConferenceApi().createConference(
+            ConferenceForm(name='Other', maxAttendees=10))
+        self.confs['Other'] = Conference.query(
+            Conference.name == 'Other').get().key.urlsafe()
+        self.actAs('user@example.com')
+
+        @ndb.tasklet
+        def timedOut(api, registrations):
+            # the first Registration is written before the timeout
+            r_key, c_key = registrations[0]
+            yield Registration(key=r_key, conferenceKey=c_key).put_async()
+            raise datastore_errors.Timeout()
+
+        put = conference.ConferenceApi._putRegistrationsAsync
+        conference.ConferenceApi._putRegistrationsAsync = timedOut
+        try:
+            with self.assertRaises(datastore_errors.Timeout):
+                self.register([self.confs['Open'], self.confs['Other']])
+        finally:
+            conference.ConferenceApi._putRegistrationsAsync = put
+        self.assertEqual(self.seats('Open'), 9)
+        self.assertEqual(self.seats('Other'), 10)
+
+
+    def testCachedConferenceServesCurrentSeats(self):
+        self.assertEqual(self.seats('Open'), 10)
+        self.register([self.confs['Open']])
+        self.assertIsNotNone(memcache.get(
+            conference.MEMCACHE_CONFERENCE_KEY % self.confs['Open']))
+        self.assertEqual(self.seats('Open'), 9)
+        # seats are recomputed if their cache entry is gone
+        memcache.delete(counters.MEMCACHE_SEATS_KEY % self.confs['Open'])
+        self.assertEqual(self.seats('Open'), 9)
+
+
+    def testKeyOfAnotherKindIsRejected(self):
+        profile_key = ndb.Key(urlsafe=self.confs['Open']).parent().urlsafe()
+        results = self.register([profile_key])
+        self.assertEqual(results[profile_key], (False,
+            'No conference found with key: %s' % profile_key))
+
+
+class LegacySeatsTest(ConferenceTestCase):
+    """Conferences created before seats were sharded"""
+
+    def setUp(self):
+        super(LegacySeatsTest, self).setUp()
+        self.actAs('user@example.com')
+        owner = ndb.Key('Profile', 'owner@example.com')
+        # three of ten seats are held by attendees registered back then
+        self.conf_key = Conference(parent=owner, name='Legacy',
+            maxAttendees=10, seatsAvailable=7).put()
+        Registration(key=Registration.makeKey(
+            ndb.Key('Profile', 'user@example.com'),
+            self.conf_key.urlsafe()), conferenceKey=self.conf_key).put()
+
+
+    def unregister(self):
+        return conference.ConferenceApi()._conferenceRegistration(
+            conference.CONF_GET_REQUEST.combined_message_class(
+            websafeConferenceKey=self.conf_key.urlsafe()), reg=False)
+
+
+    def shards(self):
+        return ndb.get_multi(counters.shardKeys(self.conf_key))
+
+
+    def testShardsCountHeldSeatsAsTaken(self):
+        shards = counters.getShards(self.conf_key.get())
+        self.assertEqual(sum(shard.allotment for shard in shards), 10)
+        self.assertEqual(sum(shard.seatsAvailable for shard in shards), 7)
+        self.assertTrue(all(shard.seatsAvailable <= shard.allotment
+            for shard in shards))
+
+        self.assertTrue(self.unregister().data)
+        self.assertEqual(sum(shard.seatsAvailable
+            for shard in self.shards()), 8)
+
+
+    def testSeatIsGivenBackToFullShards(self):
+        # shards created from seatsAvailable alone have no held seats
+        for key, n in zip(counters.shardKeys(self.conf_key),
+                counters._allotments(7)):
+            SeatShard(key=key, allotment=n, seatsAvailable=n).put()
+
+        self.assertTrue(self.unregister().data)
+        shards = self.shards()
+        self.assertEqual(sum(shard.seatsAvailable for shard in shards), 8)
+        self.assertEqual(sum(shard.allotment for shard in shards), 8)
+
+
+class AnnouncementTest(ConferenceTestCase):
+
+    def setUp(self):
+        super(AnnouncementTest, self).setUp()
+        self.actAs('owner@example.com')
+        for name, seats in (('Small', 3), ('Large', 100)):
+            conference.ConferenceApi().createConference(
+                ConferenceForm(name=name, maxAttendees=seats))
+
+
+    def announcement(self):
+        return conference.ConferenceApi().getAnnouncement(
+            message_types.VoidMessage()).data
+
+
+    def runCron(self):
+        taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        batch_size = main.SetAnnouncementHandler.batch_size
+        main.SetAnnouncementHandler.batch_size = 1
+        batches = 1
+        try:
+            main.app.get_response('/crons/set_announcement')
+            # the remaining batches run as chained tasks
+            tasks = taskqueue.get_filtered_tasks(url='/crons/set_announcement')
+            while tasks:
+                taskqueue.DeleteTask('default', tasks[0].name)
+                main.app.get_response(tasks[0].url, method='POST',
+                    body=tasks[0].payload)
+                batches += 1
+                tasks = taskqueue.get_filtered_tasks(
+                    url='/crons/set_announcement')
+        finally:
+            main.SetAnnouncementHandler.batch_size = batch_size
+        return batches
+
+
+    def testCreationAnnounces(self):
+        self.assertIn('Small', self.announcement())
+        self.assertNotIn('Large', self.announcement())
+
+
+    def testCronReconcilesSet(self):
+        large = Conference.query(Conference.name == 'Large').get()
+        ndb.delete_multi(NearlySoldOut.query().fetch(keys_only=True))
+        NearlySoldOut(id=large.key.urlsafe(), name='Large').put()
+        gone = ndb.Key(Conference, 1, parent=large.key.parent())
+        NearlySoldOut(id=gone.urlsafe(), name='Gone').put()
+        memcache.flush_all()
+
+        self.assertEqual(self.runCron(), 2)
+        self.assertEqual(sorted(entry.name
+            for entry in NearlySoldOut.query()), ['Small'])
+        self.assertEqual(memcache.get(conference.MEMCACHE_NEARLY_SOLD_OUT_KEY),
+            {Conference.query(Conference.name == 'Small').get().key.urlsafe():
+                'Small'})
+        self.assertIn('Small', self.announcement())
+        self.assertNotIn('Large', self.announcement())
+
+
+class QuerySessionsTest(ConferenceTestCase):
+
+    def setUp(self):
+        super(QuerySessionsTest, self).setUp()
+        self.actAs('owner@example.com')
+        conference.ConferenceApi().createConference(
+            ConferenceForm(name='PyCon', maxAttendees=10))
+        wsck = Conference.query().get().key.urlsafe()
+        sessions = [('Match late', '2016-01-01', '11:00', '60'),
+            ('Match early', '2016-01-02', '09:30', '45 min')]
+        # sessions each matching one of the two ranges only, ahead of the
+        # matches in either range's order
+        for i in range(5):
+            sessions.append(('Too long %d' % i, '2016-01-01', '09:00', '2h'))
+            sessions.append(('Too early %d' % i, '2016-01-01', '08:00', '5'))
+        for name, day, start, duration in sessions:
+            conference.ConferenceApi().createSession(
+                conference.SESS_POST_REQUEST.combined_message_class(
+                    websafeConferenceKey=wsck, name=name, speaker='Guido',
+                    date=day, startTime=start, duration=duration))
+        self.scan_budget = conference.SCAN_BUDGET
+
+
+    def tearDown(self):
+        conference.SCAN_BUDGET = self.scan_budget
+        super(QuerySessionsTest, self).tearDown()
+
+
+    def query(self, cursor=None, **ranges):
+        return conference.ConferenceApi().querySessions(
+            conference.SESS_SEARCH_REQUEST.combined_message_class(
+                cursor=cursor, **ranges))
+
+
+    def queryAll(self, **ranges):
+        """Return the names of all matches, following nextCursor."""
+        names = []
+        sf = self.query(**ranges)
+        names.extend(item.name for item in sf.items)
+        while sf.nextCursor:
+            sf = self.query(cursor=sf.nextCursor, **ranges)
+            names.extend(item.name for item in sf.items)
+        return sorted(names)
+
+
+    def testRangesAreCombined(self):
+        self.assertEqual(self.queryAll(startTimeFrom='09:00',
+            startTimeTo='12:00', maxDuration=60),
+            ['Match early', 'Match late'])
+
+
+    def testScanBudgetDoesNotHideLaterMatches(self):
+        conference.SCAN_BUDGET = 5
+        sf = self.query(startTimeFrom='09:00', startTimeTo='12:00',
+            maxDuration=60)
+        self.assertEqual(sf.items, [])
+        self.assertTrue(sf.nextCursor)
+        self.assertEqual(self.queryAll(startTimeFrom='09:00',
+            startTimeTo='12:00', maxDuration=60),
+            ['Match early', 'Match late'])
+
+
+    def testNoMatchIsNotFound(self):
+        with self.assertRaises(endpoints.NotFoundException):
+            self.query(startTimeFrom='13:00', maxDuration=30)
+
+
+class SaveProfileTest(ConferenceTestCase):
+
+    def save(self, **fields):
+        return conference.ConferenceApi().saveProfile(
+            ProfileMiniForm(**fields))
+
+
+    def testStaleCachedProfileDoesNotOverwrite(self):
+        self.actAs('user@example.com')
+        self.save(displayName='Old')
+        cache_key = conference.MEMCACHE_PROFILE_KEY % 'user@example.com'
+        self.assertIsNotNone(memcache.get(cache_key))
+
+        # another instance stores a newer Profile; the cache keeps the old
+        prof = ndb.Key(Profile, 'user@example.com').get()
+        prof.teeShirtSize = 'XL_M'
+        prof.put()
+        version = prof.version
+
+        pf = self.save(displayName='New')
+        prof = ndb.Key(Profile, 'user@example.com').get()
+        self.assertEqual((prof.displayName, prof.teeShirtSize),
+            ('New', 'XL_M'))
+        self.assertEqual(prof.version, version + 1)
+        self.assertEqual(pf.teeShirtSize, TeeShirtSize.XL_M)
+        self.assertEqual(memcache.get(cache_key).version, prof.version)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""test_emails.py
+
+Udacity conference server-side Python App Engine confirmation email digest
+tests, run against the in-memory LocalQueue and LocalMailer
+
+"""
+
+from testbase import ConferenceTestCase
+
+import emails
+from models import ConferenceForm
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FailingMailer(emails.LocalMailer):
+
+    def send_mail(self, sender, to, subject, body):
+        raise RuntimeError('mail is down')
+
+
+class DigestSenderTest(ConferenceTestCase):
+
+    def setUp(self):
+        super(DigestSenderTest, self).setUp()
+        self.clock = Clock()
+        self.queue = emails.LocalQueue(clock=self.clock, retry_limit=2)
+        self.mailer = emails.LocalMailer()
+
+
+    def confirm(self, email, name):
+        emails.enqueueConfirmation(email, ConferenceForm(name=name,
+            city='London', maxAttendees=10), queue=self.queue)
+
+
+    def sender(self, mailer=None, **options):
+        return emails.DigestSender(queue=self.queue,
+            mailer=mailer or self.mailer, sender='noreply@example.com',
+            **options)
+
+
+    def testOneDigestPerRecipient(self):
+        self.confirm('a@example.com', 'PyCon')
+        self.confirm('a@example.com', 'JSConf')
+        self.confirm('b@example.com', 'GopherCon')
+        stats = self.sender().run()
+
+        self.assertEqual((stats['sent'], stats['digests'], stats['backlog']),
+            (3, 2, 0))
+        sent = dict((to, (subject, body))
+            for _, to, subject, body in self.mailer.sent)
+        self.assertEqual(sent['a@example.com'][0],
+            'You created 2 new Conferences!')
+        self.assertIn('PyCon', sent['a@example.com'][1])
+        self.assertIn('JSConf', sent['a@example.com'][1])
+        self.assertEqual(sent['b@example.com'][0],
+            'You created a new Conference!')
+
+
+    def testRecipientsOverTheLimitWaitForTheNextRun(self):
+        for email in ('a@example.com', 'b@example.com', 'c@example.com'):
+            self.confirm(email, 'PyCon')
+        stats = self.sender(max_digests=2).run()
+        self.assertEqual((stats['digests'], stats['leased'],
+            stats['backlog']), (2, 2, 1))
+
+        # the third recipient was never leased, so it is sent right away
+        stats = self.sender(max_digests=2).run()
+        self.assertEqual((stats['digests'], stats['backlog']), (1, 0))
+        self.assertEqual(sorted(to for _, to, _, _ in self.mailer.sent),
+            ['a@example.com', 'b@example.com', 'c@example.com'])
+
+
+    def testWaitingDoesNotUseUpRetries(self):
+        self.queue = emails.LocalQueue(clock=self.clock, retry_limit=10)
+        recipients = ['user%02d@example.com' % i for i in range(15)]
+        for email in recipients:
+            self.confirm(email, 'PyCon')
+        for _ in range(20):
+            self.sender(max_digests=1).run()
+        self.assertEqual(sorted(to for _, to, _, _ in self.mailer.sent),
+            recipients)
+
+
+    def testFailedDigestsAreRetriedThenDropped(self):
+        self.confirm('a@example.com', 'PyCon')
+        stats = self.sender(FailingMailer()).run()
+        self.assertEqual((stats['failed'], stats['backlog']), (1, 1))
+
+        # the task stays leased until its lease expires
+        self.assertEqual(self.sender().run()['sent'], 0)
+        self.clock.now += emails.LEASE_SECONDS
+        self.sender(FailingMailer()).run()
+        self.clock.now += emails.LEASE_SECONDS
+        self.sender(FailingMailer()).run()
+
+        # leased 3 times: over the retry limit of 2
+        self.clock.now += emails.LEASE_SECONDS
+        stats = self.sender().run()
+        self.assertEqual((stats['sent'], stats['backlog']), (0, 0))
+        self.assertEqual(self.mailer.sent, [])
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+"""test_export.py
+
+Udacity conference server-side Python App Engine bulk data export tests
+
+"""
+
+import os
+
+from testbase import ConferenceTestCase
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import export
+import main
+from models import Conference
+
+
+class MemorySink(object):
+
+    def __init__(self):
+        self.chunks = {}
+
+    def write(self, name, data):
+        self.chunks[name] = data
+
+
+class ExportTest(ConferenceTestCase):
+
+    def setUp(self):
+        super(ExportTest, self).setUp()
+        ndb.put_multi([Conference(name='Conf %d' % i) for i in range(5)])
+        self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+
+
+    def exportTasks(self):
+        return self.taskqueue.get_filtered_tasks(url='/tasks/export')
+
+
+    def testBatchRunTwiceAdvancesOnce(self):
+        sink = MemorySink()
+        job = export.startJob('jsonl', sink=sink)
+        duplicate = job.key.get(use_cache=False)
+        first = export.runBatch(job.key.get(use_cache=False), sink,
+            batch_size=2)
+        # a second run of the first batch starts from the job as it was
+        again = export.runBatch(duplicate, sink, batch_size=2)
+        self.assertEqual((again.chunk, again.cursor),
+            (first.chunk, first.cursor))
+        stored = job.key.get(use_cache=False)
+        self.assertEqual((stored.chunk, stored.rowCount), (1, 2))
+        self.assertEqual(sorted(sink.chunks),
+            ['export-%d/Conference-00000.jsonl' % job.key.id()])
+
+
+    def testResumeDoesNotQueueTwice(self):
+        response = main.app.get_response('/tasks/export?format=csv')
+        self.assertEqual(response.status_int, 200)
+        job_id = export.ExportJob.query().get().key.id()
+        main.app.get_response('/tasks/export?job=%d' % job_id)
+        main.app.get_response('/tasks/export?job=%d' % job_id)
+        self.assertEqual([task.name for task in self.exportTasks()],
+            ['export-%d-0-0' % job_id])
+
+
+    def testStaleTaskOnlyRequeues(self):
+        job = export.startJob('jsonl')
+        job.chunk = 1
+        job.put()
+        main.app.get_response('/tasks/export', POST={'job': job.key.id(),
+            'batch': 'export-%d-0-0' % job.key.id()})
+        self.assertEqual(job.key.get().rowCount, 0)
+        self.assertEqual([task.name for task in self.exportTasks()],
+            ['export-%d-0-1' % job.key.id()])
+
+
+    def testNoSinkOutsideDevServer(self):
+        os.environ['SERVER_SOFTWARE'] = 'Google App Engine/1.9.0'
+        response = main.app.get_response('/tasks/export?format=jsonl')
+        self.assertEqual(response.status_int, 501)
+        self.assertEqual(export.ExportJob.query().count(), 0)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+"""test_planner.py
+
+Udacity conference server-side Python App Engine query planner tests
+
+"""
+
+import unittest
+
+import testbase
+
+import planner
+
+INDEXES = [
+    ('Conference', False, (('city', 'asc'), ('month', 'asc'),
+        ('name', 'asc'))),
+    ('Conference', False, (('month', 'asc'), ('name', 'asc'))),
+    ('Conference', False, (('name', 'asc'), ('city', 'asc'),
+        ('startDate', 'asc'))),
+]
+
+
+def _filter(field, operator, value):
+    return {'field': field, 'operator': operator, 'value': value}
+
+
+class PlanTest(unittest.TestCase):
+
+    def testPushesEqualityAndMostSelectiveInequality(self):
+        plan = planner.plan('Conference', [_filter('city', '=', 'London'),
+            _filter('month', '<', 3), _filter('maxAttendees', '>', 10)],
+            {'month': (1, 12), 'maxAttendees': (0, 1000)})
+        self.assertEqual(plan.inequality_field, 'month')
+        self.assertEqual(plan.residual, [_filter('maxAttendees', '>', 10)])
+        self.assertEqual(plan.requiredIndex(), ['city', 'month', 'name'])
+
+
+    def testServedPlanIsKept(self):
+        plan = planner.plan('Conference', [_filter('city', '=', 'London'),
+            _filter('month', '<', 3)], indexes=INDEXES)
+        self.assertEqual(plan.residual, [])
+        self.assertTrue(plan.servedBy(INDEXES))
+
+
+    def testUnindexedEqualityIsEvaluatedInMemory(self):
+        plan = planner.plan('Conference', [_filter('topics', '=', 'Web'),
+            _filter('month', '<', 3)], indexes=INDEXES)
+        self.assertEqual(plan.pushed, [_filter('month', '<', 3)])
+        self.assertEqual(plan.residual, [_filter('topics', '=', 'Web')])
+
+
+    def testUnindexedProjectionIsDropped(self):
+        projection = ('name', 'city', 'startDate')
+        self.assertEqual(planner.plan('Conference', [],
+            projection=projection, indexes=INDEXES).projection, projection)
+        plan = planner.plan('Conference', [_filter('month', '=', 3)],
+            projection=projection, indexes=INDEXES)
+        self.assertEqual(plan.projection, ())
+        self.assertEqual(plan.residual, [])
+
+
+    def testIndexYamlIsLoaded(self):
+        indexes = planner.loadIndexes(testbase.APP_ROOT + '/index.yaml')
+        self.assertIn(('Conference', False, (('topics', 'asc'),
+            ('maxAttendees', 'asc'), ('name', 'asc'))), indexes)
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+
+"""test_rpcstats.py
+
+Udacity conference server-side Python App Engine RPC accounting page tests
+
+"""
+
+import json
+
+from testbase import ConferenceTestCase
+
+import main
+import rpcstats
+
+
+class RpcStatsHandlerTest(ConferenceTestCase):
+
+    def get(self, minutes):
+        return main.app.get_response('/admin/rpcstats?minutes=%s' % minutes)
+
+
+    def testBadMinutesAreRejected(self):
+        for minutes in ('abc', '1.5', '0', '-3'):
+            self.assertEqual(self.get(minutes).status_int, 400, minutes)
+
+
+    def testMinutesAreCapped(self):
+        response = self.get(100000)
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(json.loads(response.body)['minutes'],
+            rpcstats.MAX_MINUTES)
+        self.assertEqual(json.loads(self.get(5).body)['minutes'], 5)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+"""test_search.py
+
+Udacity conference server-side Python App Engine search index tests
+
+"""
+
+import testbase
+
+from google.appengine.ext import ndb
+
+import search
+from models import Conference
+from models import PostingList
+
+
+class SearchIndexTest(testbase.ConferenceTestCase):
+
+    def setUp(self):
+        super(SearchIndexTest, self).setUp()
+        self.chunk_size = search.CHUNK_SIZE
+        search.CHUNK_SIZE = 3
+
+
+    def tearDown(self):
+        search.CHUNK_SIZE = self.chunk_size
+        super(SearchIndexTest, self).tearDown()
+
+
+    def _index(self, names):
+        keys = ndb.put_multi([Conference(name=name) for name in names])
+        search.indexDocuments('Conference', keys)
+        return keys
+
+
+    def _postingSizes(self, term):
+        """Return the number of postings in each chunk of term's shards."""
+        sizes = []
+        for posting in ndb.get_multi(search.postingKeys('Conference', term)):
+            if posting:
+                chunks = [posting] + ndb.get_multi(search.chunkKeys(posting))
+                sizes.extend(len(chunk.keys) for chunk in chunks)
+        return sizes
+
+
+    def testPostingListsAreChunked(self):
+        keys = self._index(['Python Conference %d' % i for i in range(30)])
+        sizes = self._postingSizes('python')
+        self.assertEqual(sum(sizes), 30)
+        self.assertTrue(max(sizes) <= search.CHUNK_SIZE)
+        self.assertEqual(len(search.search('Conference', 'pyt* conference')),
+            30)
+
+        ndb.delete_multi(keys[:25])
+        search.indexDocuments('Conference', keys[:25])
+        self.assertEqual(sum(self._postingSizes('python')), 5)
+        self.assertEqual(sorted(conf.key for conf in
+            search.search('Conference', 'python')), sorted(keys[25:]))
+
+        ndb.delete_multi(keys[25:])
+        search.indexDocuments('Conference', keys[25:])
+        self.assertEqual(PostingList.query().count(), 0)
+
+
+    def testShortPrefixesAreNotIndexed(self):
+        self._index(['Python Conference', 'Ruby Conference'])
+        self.assertEqual(self._postingSizes('py*'), [])
+        self.assertEqual([conf.name for conf in
+            search.search('Conference', 'py* conference')],
+            ['Python Conference'])
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+"""test_utils.py
+
+Udacity conference server-side Python App Engine OAuth token lookup tests,
+run against a fake tokeninfo endpoint served on localhost
+
+"""
+
+import BaseHTTPServer
+import json
+import threading
+import unittest
+import urlparse
+
+from testbase import ConferenceTestCase
+
+import settings
+import utils
+
+
+class FakeTokenInfo(BaseHTTPServer.HTTPServer):
+    """FakeTokenInfo -- tokeninfo endpoint answering from tokens, a dict of
+    token -> user id; tokens in failing get a 500"""
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+            FakeTokenInfoHandler)
+        self.tokens = {}
+        self.failing = set()
+        self.requests = []
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/tokeninfo' % self.server_address[1]
+
+
+class FakeTokenInfoHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        params = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+        token = (params.get('id_token') or params.get('access_token'))[0]
+        self.server.requests.append(token)
+        if token in self.server.failing:
+            status, body = 500, 'backend error'
+        elif token in self.server.tokens:
+            status, body = 200, json.dumps({'expires_in': 600,
+                'user_id': self.server.tokens[token]})
+        else:
+            status, body = 400, json.dumps({'error': 'invalid_token'})
+        self.send_response(status)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TokenUserIdTest(ConferenceTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeTokenInfo()
+
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+
+    def setUp(self):
+        super(TokenUserIdTest, self).setUp()
+        self.tokeninfo_url = settings.TOKENINFO_URL
+        settings.TOKENINFO_URL = self.server.url
+        self.server.tokens.clear()
+        self.server.failing.clear()
+        del self.server.requests[:]
+        utils._token_cache.clear()
+        utils._backoff.clear()
+
+
+    def tearDown(self):
+        settings.TOKENINFO_URL = self.tokeninfo_url
+        super(TokenUserIdTest, self).tearDown()
+
+
+    def testLookupsAreCached(self):
+        self.server.tokens['good'] = '42'
+        self.assertEqual(utils._getTokenUserId('good', 'access_token'), '42')
+        self.assertEqual(utils._getTokenUserId('good', 'access_token'), '42')
+        self.assertEqual(self.server.requests, ['good'])
+
+        # another instance finds it in memcache
+        utils._token_cache.clear()
+        self.assertEqual(utils._getTokenUserId('good', 'access_token'), '42')
+        self.assertEqual(self.server.requests, ['good'])
+
+
+    def testInvalidTokenIsCached(self):
+        self.assertEqual(utils._getTokenUserId('bad', 'id_token'), '')
+        self.assertEqual(utils._getTokenUserId('bad', 'id_token'), '')
+        # looked up once as an id_token, once as an access_token
+        self.assertEqual(self.server.requests, ['bad', 'bad'])
+
+
+    def testFailureBacksOffThatTokenOnly(self):
+        self.server.tokens['good'] = '42'
+        self.server.failing.add('flaky')
+        self.assertEqual(utils._getTokenUserId('flaky', 'access_token'), '')
+        self.assertEqual(utils._getTokenUserId('flaky', 'access_token'), '')
+        self.assertEqual(self.server.requests, ['flaky'])
+
+        self.assertEqual(utils._getTokenUserId('good', 'access_token'), '42')
+        self.assertEqual(self.server.requests, ['flaky', 'good'])
+
+
+    def testLeastRecentlyUsedIsEvicted(self):
+        size = utils.TOKEN_CACHE_SIZE
+        utils.TOKEN_CACHE_SIZE = 2
+        try:
+            for token in ('a', 'b', 'c'):
+                self.server.tokens[token] = token.upper()
+            utils._getTokenUserId('a', 'access_token')
+            utils._getTokenUserId('b', 'access_token')
+            # a hit makes 'a' the most recently used, so 'b' is evicted
+            utils._getTokenUserId('a', 'access_token')
+            utils._getTokenUserId('c', 'access_token')
+        finally:
+            utils.TOKEN_CACHE_SIZE = size
+        self.assertEqual(set(utils._token_cache), set(
+            [utils._tokenCacheKey('a'), utils._tokenCacheKey('c')]))
+
+
+class ParseDurationMinutesTest(unittest.TestCase):
+
+    def testFormats(self):
+        for duration, minutes in (('90', 90), ('90 min', 90),
+                ('45 minutes', 45), ('1:30', 90), ('1h 30m', 90),
+                ('2 hours', 120), ('2h', 120), (' 1 hr 5 mins ', 65)):
+            self.assertEqual(utils.parseDurationMinutes(duration), minutes,
+                duration)
+
+
+    def testUnparseable(self):
+        for duration in (None, '', 'all day', '1:xx', 'h'):
+            self.assertIsNone(utils.parseDurationMinutes(duration), duration)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+"""testbase.py
+
+Udacity conference server-side Python App Engine test setup
+
+Puts the App Engine SDK ($APPENGINE_SDK, or the one on sys.path) and the
+application on sys.path; ConferenceTestCase runs each test against fresh
+testbed stubs. Run the tests from the application directory with:
+
+    APPENGINE_SDK=/path/to/google_appengine python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import unittest
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if os.environ.get('APPENGINE_SDK'):
+    sys.path.insert(0, os.environ['APPENGINE_SDK'])
+import dev_appserver
+dev_appserver.fix_sys_path()
+sys.path.insert(0, APP_ROOT)
+
+# endpoints.api_server reads the version when conference is imported
+os.environ.setdefault('CURRENT_VERSION_ID', '1.1')
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+
+class ConferenceTestCase(unittest.TestCase):
+    """ConferenceTestCase -- test case with the testbed stubs the
+    application uses, and a strongly consistent datastore"""
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.setup_env(app_id='conference-test',
+            current_version_id='1.1', overwrite=True)
+        self.testbed.init_datastore_v3_stub(consistency_policy=
+            datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=APP_ROOT)
+        self.testbed.init_mail_stub()
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_urlfetch_stub()
+        self.testbed.init_user_stub()
+        ndb.get_context().clear_cache()
+
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+
+    def actAs(self, email):
+        """Make endpoints requests on behalf of email."""
+        os.environ['ENDPOINTS_AUTH_EMAIL'] = email
+        os.environ['ENDPOINTS_AUTH_DOMAIN'] = 'example.com'
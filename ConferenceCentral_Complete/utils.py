@@ -1,10 +1,183 @@
+import hashlib
+import heapq
 import json
 import os
+import re
+import threading
 import time
 import uuid
+from datetime import datetime
+from datetime import timedelta
 
+from collections import OrderedDict
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
 from models import Profile
+import settings
+
+# resolved tokeninfo lookups are cached in-process (least recently used
+# evicted first) and in memcache until the token expires; invalid tokens
+# are remembered for a short while
+MEMCACHE_TOKENINFO_KEY = 'tokeninfo:%s'
+TOKEN_CACHE_SIZE = 1000
+MAX_TOKEN_TTL = 3600
+INVALID_TOKEN_TTL = 60
+TOKENINFO_DEADLINE = 5
+# after a failed call to the tokeninfo endpoint, calls for that token are
+# skipped for BACKOFF_BASE * 2^(failures - 1) seconds (at most BACKOFF_MAX)
+# instead of sleeping on the request thread
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+
+# shared by the instance's request threads; guarded by _token_lock
+_token_cache = OrderedDict()
+_backoff = OrderedDict()
+_token_lock = threading.Lock()
+
+_DURATION_RE = re.compile(
+    r'^\s*(?:(\d+)\s*(?:h|hr|hrs|hours?)\s*)?(?:(\d+)\s*(?:m|min|mins|minutes?)?)?\s*$',
+    re.IGNORECASE)
+
+def parseDurationMinutes(duration):
+    """Return the free-form duration string (e.g. '90', '90 min', '1:30',
+    '1h 30m', '2 hours') in minutes, or None if it can't be parsed."""
+    if not duration:
+        return None
+    if ':' in duration:
+        try:
+            hours, minutes = duration.strip().split(':')
+            return int(hours) * 60 + int(minutes)
+        except ValueError:
+            return None
+    match = _DURATION_RE.match(duration)
+    if not match or not any(match.groups()):
+        return None
+    hours, minutes = match.groups()
+    return int(hours or 0) * 60 + int(minutes or 0)
+
+def sessionInterval(sess):
+    """Return the (start, end) datetimes of sess, or None if it has no date
+    or start time. Sessions without a known duration occupy their start
+    minute."""
+    if not sess.date or not sess.startTime:
+        return None
+    start = datetime.combine(sess.date, sess.startTime)
+    minutes = sess.durationMinutes
+    if minutes is None:
+        minutes = parseDurationMinutes(sess.duration)
+    return start, start + timedelta(minutes=max(minutes or 0, 1))
+
+def findOverlaps(intervals):
+    """Return dict of id -> ids of the intervals overlapping it, for
+    intervals given as (start, end, id) tuples.
+
+    Sort-and-sweep: intervals are visited by start, and a heap of the
+    active ones (by end) is pruned of those that ended before the current
+    start, so the pass is O(n log n) plus the number of overlaps.
+    """
+    overlaps = {}
+    active = []
+    for start, end, ident in sorted(intervals):
+        while active and active[0][0] <= start:
+            heapq.heappop(active)
+        for _, other in active:
+            overlaps.setdefault(ident, []).append(other)
+            overlaps.setdefault(other, []).append(ident)
+        heapq.heappush(active, (end, ident))
+    return overlaps
+
+def _tokenCacheKey(token):
+    # tokens are credentials; only their hash is used as a cache key
+    return MEMCACHE_TOKENINFO_KEY % hashlib.sha256(token).hexdigest()
+
+def _bounded(cache, key, value):
+    """Set key of the OrderedDict cache as its most recently used entry,
+    evicting the least recently used beyond TOKEN_CACHE_SIZE."""
+    cache.pop(key, None)
+    cache[key] = value
+    while len(cache) > TOKEN_CACHE_SIZE:
+        cache.popitem(last=False)
+
+def _cachedToken(cache_key):
+    """Return the in-process cache entry of cache_key, marking it most
+    recently used, or None."""
+    with _token_lock:
+        cached = _token_cache.pop(cache_key, None)
+        if cached and cached[1] > time.time():
+            _token_cache[cache_key] = cached
+            return cached
+    return None
+
+def _cacheToken(cache_key, user_id, ttl):
+    with _token_lock:
+        _bounded(_token_cache, cache_key, (user_id, time.time() + ttl))
+
+def _backingOff(cache_key):
+    with _token_lock:
+        backoff = _backoff.get(cache_key)
+        return backoff is not None and time.time() < backoff[1]
+
+def _lookupFailed(cache_key):
+    with _token_lock:
+        failures = _backoff.get(cache_key, (0, 0))[0] + 1
+        _bounded(_backoff, cache_key, (failures, time.time() + min(
+            BACKOFF_BASE * 2 ** (failures - 1), BACKOFF_MAX)))
+
+def _lookupSucceeded(cache_key):
+    with _token_lock:
+        _backoff.pop(cache_key, None)
+
+def _fetchTokenInfo(token, token_type):
+    """Return (user_id, ttl) from the tokeninfo endpoint; user_id is '' for
+    an invalid token and None if the endpoint could not be reached."""
+    # an id_token lookup of an access token fails; retry it as one
+    token_types = [token_type]
+    if token_type != 'access_token':
+        token_types.append('access_token')
+    for token_type in token_types:
+        url = '%s?%s=%s' % (settings.TOKENINFO_URL, token_type, token)
+        try:
+            resp = urlfetch.fetch(url, deadline=TOKENINFO_DEADLINE)
+        except urlfetch.Error:
+            return None, 0
+        if resp.status_code == 200:
+            info = json.loads(resp.content)
+            ttl = min(int(info.get('expires_in', MAX_TOKEN_TTL)),
+                MAX_TOKEN_TTL)
+            return info.get('user_id', ''), ttl
+        if resp.status_code != 400 or 'invalid_token' not in resp.content:
+            return None, 0
+    return '', INVALID_TOKEN_TTL
+
+def _getTokenUserId(token, token_type):
+    """Return the user id of an OAuth token, looking it up in the
+    in-process cache, then memcache, then the tokeninfo endpoint.
+
+    While lookups of the token are backing off after a failure, '' is
+    returned right away rather than waiting for the endpoint; other tokens
+    are still looked up.
+    """
+    cache_key = _tokenCacheKey(token)
+    cached = _cachedToken(cache_key)
+    if cached:
+        return cached[0]
+    cached = memcache.get(cache_key)
+    if cached is not None:
+        user_id, expires_at = cached
+        _cacheToken(cache_key, user_id, expires_at - time.time())
+        return user_id
+
+    if _backingOff(cache_key):
+        return ''
+    user_id, ttl = _fetchTokenInfo(token, token_type)
+    if user_id is None:
+        _lookupFailed(cache_key)
+        return ''
+    _lookupSucceeded(cache_key)
+    if ttl > 0:
+        _cacheToken(cache_key, user_id, ttl)
+        memcache.set(cache_key, (user_id, time.time() + ttl), time=ttl)
+    return user_id
 
 def getUserId(user, id_type="email"):
     if id_type == "email":
@@ -17,22 +190,7 @@ def getUserId(user, id_type="email"):
         token_type = 'id_token'
         if 'OAUTH_USER_ID' in os.environ:
             token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+        return _getTokenUserId(token, token_type)
 
     if id_type == "custom":
         # implement your own user_id creation and getting algorythm